@@ -105,11 +105,47 @@ os.environ["PATH"] = (
 )
 
 # GDAL Error Handling
-from osgeo import gdal, ogr, osr
+# Importing GDAL is slow, and many commands don't need it - so it is only imported where it is used, and this
+# import hook makes sure that gdal, ogr and osr are configured to raise exceptions as soon as they are imported.
 
-gdal.UseExceptions()
-ogr.UseExceptions()
-osr.UseExceptions()
+
+class _OsgeoLoader:
+    def __init__(self, loader):
+        self.loader = loader
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.loader.exec_module(module)
+        module.UseExceptions()
+
+
+class _OsgeoFinder:
+    MODULES = ("osgeo.gdal", "osgeo.ogr", "osgeo.osr")
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname not in self.MODULES:
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                spec.loader = _OsgeoLoader(spec.loader)
+                return spec
+        return None
+
+
+if "osgeo" in sys.modules:
+    # Already imported by whoever imported Kart - configure it now.
+    from osgeo import gdal, ogr, osr
+
+    gdal.UseExceptions()
+    ogr.UseExceptions()
+    osr.UseExceptions()
+else:
+    sys.meta_path.insert(0, _OsgeoFinder())
 
 # Libgit2 options
 import pygit2
@@ -1,20 +1,34 @@
 import json
 import logging
+import time
 
 import pygit2
 
 from sqlalchemy.exc import OperationalError
 
-from .db import KartAnnotation, annotations_session
+from kart.serialise_util import msg_pack, msg_unpack
+from kart.utils import chunk
+
+from .db import (
+    KartAnnotation,
+    KartTreeBlobCount,
+    KartTreeDiff,
+    annotations_session,
+    begin_transaction,
+    ignore_readonly_db,
+)
 
 L = logging.getLogger(__name__)
 
 
 class DiffAnnotations:
+    # The maximum number of annotations to look up in a single query.
+    QUERY_BATCH_SIZE = 500
+
     def __init__(self, repo):
         self.repo = repo
 
-    def _object_id(self, base, target):
+    def object_id(self, base, target):
         # this is actually symmetric, so we can marginally increase hit rate by sorting first
         base = base.peel(pygit2.Tree)
         target = target.peel(pygit2.Tree)
@@ -30,7 +44,7 @@ class DiffAnnotations:
         target: target Tree or Commit object for this diff (revB in a 'revA...revB' diff)
         """
         assert isinstance(data, dict)
-        object_id = self._object_id(base, target)
+        object_id = self.object_id(base, target)
         data = json.dumps(data)
         with annotations_session(self.repo) as session:
             if session.is_readonly:
@@ -61,6 +75,55 @@ class DiffAnnotations:
                         raise
         return data
 
+    def store_many(self, *, annotation_type, items):
+        """
+        Stores many diff annotations of the same type in a single transaction - much faster than calling store()
+        for each one when building annotations in bulk.
+
+        items: (object_id, data) pairs, where object_id is as returned by self.object_id(base, target)
+        """
+        rows = [
+            {
+                "object_id": object_id,
+                "annotation_type": annotation_type,
+                "data": json.dumps(data),
+            }
+            for object_id, data in items
+        ]
+        if not rows:
+            return
+        with annotations_session(self.repo) as session:
+            if session.is_readonly:
+                L.info("Can't store annotation; annotations.db is read-only")
+                return
+            with ignore_readonly_db(session):
+                begin_transaction(session)
+                # A single prepared statement, executed once per row.
+                session.execute(
+                    KartAnnotation.__table__.insert().prefix_with("OR REPLACE"), rows
+                )
+                session.commit()
+
+    def find_existing(self, *, annotation_type, object_ids):
+        """Returns the subset of the given object_ids that already have an annotation of the given type."""
+        result = set()
+        with annotations_session(self.repo) as session:
+            for batch in chunk(object_ids, self.QUERY_BATCH_SIZE):
+                try:
+                    rows = list(
+                        session.query(KartAnnotation.object_id).filter(
+                            KartAnnotation.annotation_type == annotation_type,
+                            KartAnnotation.object_id.in_(batch),
+                        )
+                    )
+                except OperationalError as e:
+                    # The db exists but is readonly and doesn't contain the table yet.
+                    if "no such table: kart_annotations" in str(e):
+                        return result
+                    raise
+                result.update(row[0] for row in rows)
+        return result
+
     def get(self, *, base, target, annotation_type):
         """
         Returns a diff annotation from the sqlite database.
@@ -70,7 +133,7 @@ class DiffAnnotations:
         target: target Tree or Commit object for this diff (revB in a 'revA...revB' diff)
         """
         with annotations_session(self.repo) as session:
-            object_id = self._object_id(base, target)
+            object_id = self.object_id(base, target)
             try:
                 annotations = list(
                     session.query(KartAnnotation).filter(
@@ -104,3 +167,424 @@ class DiffAnnotations:
                     object_id,
                 )
                 return None
+
+
+class TreeBlobCounts:
+    """
+    Counts the blobs in trees - eg the features in a dataset's feature tree - and caches the counts in the annotations
+    database, keyed by tree ID. The count for a tree is the sum of the counts for its subtrees, and subtrees are cached
+    separately too - so when a tree shares most of its subtrees with a tree that has been counted before (eg, the same
+    dataset at the previous commit) only the subtrees that have changed need to be counted.
+    """
+
+    # Subtrees up to this many levels below the tree being counted are cached separately.
+    # (For a dataset's feature tree, each level is one 64-way branch of the path-encoder).
+    # Deeper subtrees are counted directly, and only cached as part of their ancestors.
+    MAX_CACHED_DEPTH = 2
+    # The maximum number of counts to look up in a single query.
+    QUERY_BATCH_SIZE = 500
+
+    def __init__(self, repo):
+        self.repo = repo
+
+    def count_blobs(self, tree):
+        """Returns the total number of blobs in the given tree and all of its subtrees."""
+        if tree.id == self.repo.empty_tree.id:
+            return 0
+        with annotations_session(self.repo) as session:
+            known = self._fetch(session, [tree])
+            new_counts = {}
+            result = self._count(session, tree, 0, known, new_counts)
+            self._write(session, new_counts)
+        return result
+
+    def _count(self, session, tree, depth, known, new_counts):
+        tree_id = tree.id.hex
+        if tree_id in known:
+            return known[tree_id]
+
+        if depth >= self.MAX_CACHED_DEPTH:
+            # Diffing against the empty tree is the fastest way to get libgit2 to count the blobs in a tree.
+            count = len(tree.diff_to_tree())
+        else:
+            count = 0
+            subtrees = []
+            for child in tree:
+                if child.type_str == "tree":
+                    subtrees.append(child)
+                else:
+                    count += 1
+            # Look up all the subtrees at this level at once.
+            known.update(
+                self._fetch(session, [s for s in subtrees if s.id.hex not in known])
+            )
+            for subtree in subtrees:
+                count += self._count(session, subtree, depth + 1, known, new_counts)
+
+        known[tree_id] = count
+        new_counts[tree_id] = count
+        return count
+
+    def _fetch(self, session, trees):
+        result = {}
+        tree_ids = [t.id.hex for t in trees]
+        for id_batch in chunk(tree_ids, self.QUERY_BATCH_SIZE):
+            try:
+                rows = list(
+                    session.query(
+                        KartTreeBlobCount.tree_id, KartTreeBlobCount.count
+                    ).filter(KartTreeBlobCount.tree_id.in_(id_batch))
+                )
+            except OperationalError as e:
+                # Eg, the db exists but is readonly and doesn't contain the table, or it is locked.
+                # Either way, nothing is cached.
+                L.info("Can't look up tree blob counts: %s", e)
+                return result
+            result.update(rows)
+        return result
+
+    def _write(self, session, new_counts):
+        if not new_counts or session.is_readonly:
+            return
+        try:
+            # Counts can be needed by several threads at once - see BaseWorkingCopy.write_full - so rather than
+            # waiting for whoever has the db locked, just don't store them.
+            session.execute("PRAGMA busy_timeout = 0;")
+            begin_transaction(session)
+            session.execute(
+                KartTreeBlobCount.__table__.insert().prefix_with("OR REPLACE"),
+                [{"tree_id": t, "count": c} for t, c in new_counts.items()],
+            )
+            session.commit()
+        except OperationalError as e:
+            # The cache is only an optimisation - if annotations.db is read-only, or is locked by another
+            # kart process or thread, the counts just aren't stored.
+            L.info("Can't store tree blob counts: %s", e)
+            session.rollback()
+
+
+class TreeDiffFile:
+    __slots__ = ("path",)
+
+    def __init__(self, path):
+        self.path = path
+
+
+class TreeDiffDelta:
+    """
+    A single change from a TreeDiffCache diff.
+    Has the same attributes as the pygit2.DiffDelta objects used by DatasetDiffMixin.transform_raw_deltas.
+    """
+
+    __slots__ = ("status", "old_file", "new_file")
+
+    STATUS_CHARS = {
+        pygit2.GIT_DELTA_ADDED: "A",
+        pygit2.GIT_DELTA_DELETED: "D",
+        pygit2.GIT_DELTA_MODIFIED: "M",
+    }
+
+    def __init__(self, status, path):
+        self.status = status
+        self.old_file = self.new_file = TreeDiffFile(path)
+
+    def status_char(self):
+        return self.STATUS_CHARS.get(self.status, "?")
+
+    def __repr__(self):
+        return f"<TreeDiffDelta: {self.status_char()} {self.new_file.path}>"
+
+
+class TreeDiff:
+    """
+    Used in place of a pygit2.Diff. The deltas are generated lazily, in path order, as they are iterated over -
+    so, unlike a pygit2.Diff, the entire diff is never held in memory, and it can only be iterated over once.
+    """
+
+    def __init__(self, changes):
+        self._changes = changes
+
+    @property
+    def deltas(self):
+        for status, path in self._changes:
+            yield TreeDiffDelta(status, path)
+
+
+class TreeDiffCache:
+    """
+    Diffs trees, and caches the list of changed paths between each pair of subtrees that are visited.
+    Overlapping diffs (eg A -> B, B -> C, and A -> C) generally have many subtree-pairs in common, so only
+    the subtrees that haven't been diffed before need to be descended into.
+    Cached diffs are stored in the annotations database and are evicted when they haven't been used recently.
+    """
+
+    # Subtrees up to this many levels below the tree being diffed are cached separately.
+    # (For a dataset's feature tree, each level is one 64-way branch of the path-encoder).
+    # Deeper subtrees are diffed directly, and only cached as part of their ancestors.
+    MAX_CACHED_DEPTH = 2
+    # Diffs with more changes than this aren't cached - though their subtrees still are.
+    MAX_ENTRY_SIZE = 20_000
+    # Once the total number of changes in the cache exceeds this, least recently used entries are evicted.
+    MAX_TOTAL_SIZE = 5_000_000
+    # New entries are written to the database once they contain this many changes in total, so that
+    # memory use doesn't depend on the size of the diff.
+    WRITE_BATCH_SIZE = 100_000
+    # The maximum number of entries to look up in a single query.
+    QUERY_BATCH_SIZE = 500
+
+    _REVERSED_STATUS = {
+        pygit2.GIT_DELTA_ADDED: pygit2.GIT_DELTA_DELETED,
+        pygit2.GIT_DELTA_DELETED: pygit2.GIT_DELTA_ADDED,
+    }
+
+    def __init__(self, repo):
+        self.repo = repo
+
+    def diff_trees(self, old_tree, new_tree, *, use_cache=True):
+        """
+        Returns a TreeDiff of the changes from old_tree to new_tree - the same changes as
+        old_tree.diff_to_tree(new_tree), except that renames etc are never detected.
+        If use_cache is False, nothing is looked up in or stored to the cache - but the trees are still only diffed
+        as the TreeDiff is iterated over, so the whole diff is never held in memory.
+        """
+        return TreeDiff(self.iter_changes(old_tree, new_tree, use_cache=use_cache))
+
+    def iter_changes(self, old_tree, new_tree, *, use_cache=True):
+        """Yields a (status, path) tuple for every change from old_tree to new_tree, in path order."""
+        ctx = _TreeDiffContext(self) if use_cache else _UncachedTreeDiffContext()
+        ctx.fetch([(old_tree, new_tree)])
+        yield from self._iter_diff(ctx, old_tree, new_tree, 0)
+        ctx.write()
+
+    def _iter_diff(self, ctx, old_tree, new_tree, depth):
+        if old_tree.id == new_tree.id:
+            return
+
+        cached = ctx.get(old_tree, new_tree)
+        if cached is not None:
+            yield from cached
+            return
+
+        if depth >= self.MAX_CACHED_DEPTH:
+            changes = self._libgit2_diff(old_tree, new_tree)
+        else:
+            changes = self._iter_children_diff(ctx, old_tree, new_tree, depth)
+
+        if not ctx.caching:
+            yield from changes
+            return
+
+        # Changes are collected for caching only while there are few enough of them to be cached.
+        collected = []
+        for change in changes:
+            if collected is not None:
+                collected.append(change)
+                if len(collected) > self.MAX_ENTRY_SIZE:
+                    collected = None
+            yield change
+
+        if collected is not None:
+            ctx.put(old_tree, new_tree, collected)
+
+    def _iter_children_diff(self, ctx, old_tree, new_tree, depth):
+        old_children = {obj.name: obj for obj in old_tree}
+        new_children = {obj.name: obj for obj in new_tree}
+        names = sorted(
+            name
+            for name in old_children.keys() | new_children.keys()
+            if old_children.get(name) != new_children.get(name)
+        )
+
+        subtree_pairs = []
+        for name in names:
+            old_child, new_child = old_children.get(name), new_children.get(name)
+            if _is_tree(old_child) != _is_tree(new_child) and None not in (
+                old_child,
+                new_child,
+            ):
+                # A blob was replaced with a tree, or vice versa - this doesn't happen in Kart datasets.
+                yield from self._libgit2_diff(old_tree, new_tree)
+                return
+            if _is_tree(old_child) and _is_tree(new_child):
+                subtree_pairs.append((old_child, new_child))
+
+        # Look up all the subtree-pairs at this level at once.
+        ctx.fetch(subtree_pairs)
+
+        empty_tree = self.repo.empty_tree
+        for name in names:
+            old_child, new_child = old_children.get(name), new_children.get(name)
+            if _is_tree(old_child) or _is_tree(new_child):
+                child_changes = self._iter_diff(
+                    ctx,
+                    old_child if old_child is not None else empty_tree,
+                    new_child if new_child is not None else empty_tree,
+                    depth + 1,
+                )
+                for status, path in child_changes:
+                    yield status, f"{name}/{path}"
+            elif old_child is None:
+                yield pygit2.GIT_DELTA_ADDED, name
+            elif new_child is None:
+                yield pygit2.GIT_DELTA_DELETED, name
+            else:
+                yield pygit2.GIT_DELTA_MODIFIED, name
+
+    def _libgit2_diff(self, old_tree, new_tree):
+        flags = pygit2.GIT_DIFF_SKIP_BINARY_CHECK
+        diff = old_tree.diff_to_tree(new_tree, flags=flags)
+        return [(d.status, d.new_file.path) for d in diff.deltas]
+
+    def _write(self, session, new_entries, used_entries):
+        if session.is_readonly:
+            return
+        now = int(time.time())
+        try:
+            begin_transaction(session)
+            if used_entries:
+                session.execute(
+                    "UPDATE kart_tree_diffs SET last_used = :now WHERE object_id = :object_id;",
+                    [{"now": now, "object_id": o} for o in used_entries],
+                )
+            for object_id, changes in new_entries.items():
+                session.merge(
+                    KartTreeDiff(
+                        object_id=object_id,
+                        data=msg_pack([[int(s), p] for s, p in changes]),
+                        size=len(changes),
+                        last_used=now,
+                    )
+                )
+            if new_entries:
+                self._evict(session)
+            session.commit()
+        except OperationalError as e:
+            # The cache is only an optimisation - if annotations.db is read-only, or is locked by another
+            # kart process, the entries just aren't stored.
+            L.info("Can't store tree diffs: %s", e)
+            session.rollback()
+
+    def _evict(self, session):
+        session.flush()
+        total_size = session.scalar("SELECT total(size) FROM kart_tree_diffs;")
+        if total_size <= self.MAX_TOTAL_SIZE:
+            return
+        # Evict down to 90% of the maximum size, so that we don't have to evict again straight away.
+        to_evict = total_size - self.MAX_TOTAL_SIZE * 0.9
+        evicted_ids = []
+        for object_id, size in session.execute(
+            "SELECT object_id, size FROM kart_tree_diffs ORDER BY last_used;"
+        ):
+            if to_evict <= 0:
+                break
+            evicted_ids.append(object_id)
+            to_evict -= size
+        L.debug("evicting %d cached tree diffs", len(evicted_ids))
+        session.execute(
+            "DELETE FROM kart_tree_diffs WHERE object_id = :object_id;",
+            [{"object_id": o} for o in evicted_ids],
+        )
+
+
+def _is_tree(obj):
+    return obj is not None and obj.type_str == "tree"
+
+
+class _TreeDiffContext:
+    """
+    The state of a single TreeDiffCache.iter_changes operation.
+    The annotations database is only accessed briefly to read or write a batch of entries, rather than held open
+    for as long as the changes are being iterated over.
+    """
+
+    caching = True
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.fetched = {}
+        self.new_entries = {}
+        self.new_entries_size = 0
+        self.used_entries = set()
+
+    @staticmethod
+    def _object_id(old_tree, new_tree):
+        # Stored in sorted order like diff annotations - the reverse diff is the same changes, with adds and deletes
+        # swapped. Returns the object ID and whether the diff is stored reversed.
+        old_id, new_id = old_tree.id.hex, new_tree.id.hex
+        if old_id <= new_id:
+            return f"{old_id}...{new_id}", False
+        return f"{new_id}...{old_id}", True
+
+    def _reverse(self, changes):
+        reversed_status = self.cache._REVERSED_STATUS
+        return [(reversed_status.get(s, s), p) for s, p in changes]
+
+    def fetch(self, tree_pairs):
+        """Loads any cached diffs between the given pairs of trees."""
+        object_ids = [
+            self._object_id(old_tree, new_tree)[0]
+            for old_tree, new_tree in tree_pairs
+            if old_tree.id != new_tree.id
+        ]
+        if not object_ids:
+            return
+        with annotations_session(self.cache.repo) as session:
+            for id_batch in chunk(object_ids, self.cache.QUERY_BATCH_SIZE):
+                try:
+                    entries = list(
+                        session.query(
+                            KartTreeDiff.object_id, KartTreeDiff.data
+                        ).filter(KartTreeDiff.object_id.in_(id_batch))
+                    )
+                except OperationalError as e:
+                    # Eg, the db exists but is readonly and doesn't contain the table, or it is locked.
+                    # Either way, nothing is cached.
+                    L.info("Can't look up tree diffs: %s", e)
+                    return
+                for object_id, data in entries:
+                    self.fetched[object_id] = [tuple(c) for c in msg_unpack(data)]
+
+    def get(self, old_tree, new_tree):
+        object_id, is_reversed = self._object_id(old_tree, new_tree)
+        changes = self.fetched.pop(object_id, None)
+        if changes is None:
+            return None
+        self.used_entries.add(object_id)
+        return self._reverse(changes) if is_reversed else changes
+
+    def put(self, old_tree, new_tree, changes):
+        object_id, is_reversed = self._object_id(old_tree, new_tree)
+        if object_id in self.used_entries:
+            return
+        self.new_entries[object_id] = self._reverse(changes) if is_reversed else changes
+        self.new_entries_size += len(changes)
+        if self.new_entries_size >= self.cache.WRITE_BATCH_SIZE:
+            self.write()
+
+    def write(self):
+        """Writes any new entries to the database, and records which entries were used."""
+        if not self.new_entries and not self.used_entries:
+            return
+        with annotations_session(self.cache.repo) as session:
+            self.cache._write(session, self.new_entries, self.used_entries)
+        self.new_entries = {}
+        self.new_entries_size = 0
+        self.used_entries = set()
+
+
+class _UncachedTreeDiffContext:
+    """Used in place of a _TreeDiffContext when a TreeDiffCache.iter_changes operation doesn't use the cache."""
+
+    caching = False
+
+    def fetch(self, tree_pairs):
+        pass
+
+    def get(self, old_tree, new_tree):
+        return None
+
+    def put(self, old_tree, new_tree, changes):
+        pass
+
+    def write(self):
+        pass
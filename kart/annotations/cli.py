@@ -1,15 +1,27 @@
+import contextlib
+import multiprocessing
 import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 import click
 import pygit2
 
 from kart.diff_estimation import estimate_diff_feature_counts
 from kart.exceptions import InvalidOperation
+from kart.utils import chunk
 
 from .db import annotations_session, is_db_writable
 
 EMPTY_TREE_SHA = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
 
+ANNOTATION_TYPE = "feature-change-counts-exact"
+
+# The number of commits that are sent to a worker process, and then written to the annotations db
+# (and committed) at a time.
+BUILD_BATCH_SIZE = 100
+
 
 def gen_reachable_commits(repo):
     """
@@ -22,6 +34,40 @@ def gen_reachable_commits(repo):
     yield from walker
 
 
+# The repo for the current worker process - see _init_annotations_process.
+_process_repo = None
+
+
+def _init_annotations_process(repo_path):
+    from kart.repo import KartRepo
+
+    global _process_repo
+    _process_repo = KartRepo(repo_path)
+
+
+def _count_feature_changes(repo, commit_ids):
+    """
+    Returns a list of (commit_id, feature_change_counts) for each of the given commits,
+    where the feature change counts are for the diff between the commit and its first parent.
+    """
+    result = []
+    for commit_id in commit_ids:
+        commit = repo[commit_id]
+        counts = estimate_diff_feature_counts(
+            repo,
+            commit.parents[0] if commit.parents else repo.empty_tree,
+            commit,
+            accuracy="exact",
+            annotate=False,
+        )
+        result.append((commit_id, counts))
+    return result
+
+
+def _count_feature_changes_in_process(commit_ids):
+    return _count_feature_changes(_process_repo, commit_ids)
+
+
 @click.command(name="build-annotations")
 @click.pass_context
 @click.option(
@@ -29,11 +75,17 @@ def gen_reachable_commits(repo):
     is_flag=True,
     help="Build annotations for reachable commits on all refs",
 )
-def build_annotations(ctx, all_reachable):
+@click.option(
+    "--num-processes",
+    type=click.INT,
+    help="How many worker processes to use. Defaults to the number of available CPU cores.",
+)
+def build_annotations(ctx, all_reachable, num_processes):
     """
     Builds annotations against commits; stores the annotations in a sqlite database.
 
     If --all-reachable is not specified, commits hashes or refs should be supplied on stdin.
+    Commits that have already been annotated are skipped.
     """
     repo = ctx.obj.repo
     if all_reachable:
@@ -55,15 +107,83 @@ def build_annotations(ctx, all_reachable):
                 raise InvalidOperation(
                     "Annotations database is readonly; can't continue"
                 )
-            click.echo("Building feature change counts...")
-            for i, commit in enumerate(commits):
-                click.echo(
-                    f"({i+1}/{len(commits)}): {commit.short_id} {commit.message.splitlines()[0]}"
+            # Lets readers (eg a concurrent kart log) keep using the db while it is being written to.
+            session.execute("PRAGMA journal_mode=WAL;")
+            _build_feature_change_counts(repo, commits, num_processes)
+    click.echo("done.")
+
+
+def _build_feature_change_counts(repo, commits, num_processes):
+    from kart.fast_import import get_default_num_processes
+
+    annotations = repo.diff_annotations
+    object_ids = {
+        commit.id.hex: annotations.object_id(
+            commit.parents[0] if commit.parents else repo.empty_tree, commit
+        )
+        for commit in commits
+    }
+    already_done = annotations.find_existing(
+        annotation_type=ANNOTATION_TYPE, object_ids=set(object_ids.values())
+    )
+    todo = [c for c in commits if object_ids[c.id.hex] not in already_done]
+    if len(todo) < len(commits):
+        click.echo(
+            f"Skipped {len(commits) - len(todo):,d} commits that were already annotated"
+        )
+    if not todo:
+        return
+
+    if num_processes is None:
+        num_processes = get_default_num_processes()
+
+    click.echo("Building feature change counts...")
+    t0 = time.monotonic()
+    num_done = 0
+
+    def _write_results(results):
+        nonlocal num_done
+        # One transaction per batch - if interrupted, the work that was committed doesn't need to be redone.
+        annotations.store_many(
+            annotation_type=ANNOTATION_TYPE,
+            items=[(object_ids[commit_id], counts) for commit_id, counts in results],
+        )
+        for commit_id, counts in results:
+            num_done += 1
+            commit = repo[commit_id]
+            click.echo(
+                f"({num_done}/{len(todo)}): {commit.short_id} {commit.message.splitlines()[0]}"
+            )
+
+    batches = chunk((c.id.hex for c in todo), BUILD_BATCH_SIZE)
+    # Small jobs are done in this process - it's not worth starting worker processes
+    # unless there is more than one batch of work to do.
+    if num_processes <= 1 or len(todo) <= BUILD_BATCH_SIZE:
+        for batch in batches:
+            _write_results(_count_feature_changes(repo, batch))
+    else:
+        with contextlib.ExitStack() as stack:
+            # Spawn rather than fork - forking a process with open repo / database handles isn't safe.
+            executor = stack.enter_context(
+                ProcessPoolExecutor(
+                    num_processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_annotations_process,
+                    initargs=(str(repo.workdir_path),),
                 )
-                estimate_diff_feature_counts(
-                    repo,
-                    commit.parents[0] if commit.parents else repo.empty_tree,
-                    commit,
-                    accuracy="exact",
+            )
+            pending = deque()
+            for batch in batches:
+                pending.append(
+                    executor.submit(_count_feature_changes_in_process, batch)
                 )
-    click.echo("done.")
+                if len(pending) >= num_processes * 2:
+                    _write_results(pending.popleft().result())
+            while pending:
+                _write_results(pending.popleft().result())
+
+    elapsed = time.monotonic() - t0
+    rate = num_done / elapsed if elapsed else 0
+    click.echo(
+        f"Built feature change counts for {num_done:,d} commits in {elapsed:.1f}s ({rate:,.1f} commits/s)"
+    )
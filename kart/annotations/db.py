@@ -4,7 +4,7 @@ import logging
 import threading
 
 from kart.sqlalchemy.sqlite import sqlite_engine
-from sqlalchemy import Column, Integer, Text, UniqueConstraint
+from sqlalchemy import Column, Integer, LargeBinary, Text, UniqueConstraint
 from sqlalchemy.exc import OperationalError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
@@ -37,9 +37,51 @@ class KartAnnotation(Base):
         return json.loads(self.data)
 
 
+class KartTreeDiff(Base):
+    """
+    A cached list of the changes between two trees - see TreeDiffCache.
+    Unlike KartAnnotations, these are evicted when they haven't been used recently.
+    """
+
+    __tablename__ = "kart_tree_diffs"
+    # "{tree_id}...{tree_id}", sorted, as for diff annotations:
+    object_id = Column(Text, nullable=False, primary_key=True)
+    # msgpacked list of [status, path] pairs:
+    data = Column(LargeBinary, nullable=False)
+    # The number of changes in data:
+    size = Column(Integer, nullable=False)
+    last_used = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f"<KartTreeDiff({self.object_id})>"
+
+
+class KartTreeBlobCount(Base):
+    """
+    The number of blobs in a tree, including in all its subtrees - see TreeBlobCounts.
+    Since this only depends on the tree ID, these never need to be invalidated.
+    """
+
+    __tablename__ = "kart_tree_blob_counts"
+    tree_id = Column(Text, nullable=False, primary_key=True)
+    count = Column(Integer, nullable=False)
+
+    def __repr__(self):
+        return f"<KartTreeBlobCount({self.tree_id})>"
+
+
 _local = threading.local()
 
 
+def begin_transaction(session):
+    """
+    Explicitly begins a transaction on the given annotations session. The connection is otherwise in autocommit
+    mode - see sqlite_engine - so each row written by an executemany would be committed separately.
+    The transaction ends when the session is committed or rolled back.
+    """
+    session.execute("BEGIN;")
+
+
 @contextlib.contextmanager
 def ignore_readonly_db(session):
     try:
@@ -61,6 +103,12 @@ def _annotations_session(db_path):
         s.is_readonly = None
         try:
             s.execute(CreateTable(KartAnnotation.__table__, if_not_exists=True))
+            s.execute(CreateTable(KartTreeDiff.__table__, if_not_exists=True))
+            s.execute(CreateTable(KartTreeBlobCount.__table__, if_not_exists=True))
+            s.execute(
+                "CREATE INDEX IF NOT EXISTS kart_tree_diffs_last_used "
+                "ON kart_tree_diffs (last_used);"
+            )
         except OperationalError as e:
             # ignore errors from readonly databases.
             if "readonly database" in str(e):
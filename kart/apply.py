@@ -1,3 +1,4 @@
+import itertools
 import json
 from binascii import unhexlify
 from datetime import datetime
@@ -6,7 +7,15 @@ from enum import Enum, auto
 import click
 import pygit2
 
-from .diff_structs import Delta, DeltaDiff, KeyValue, RepoDiff
+from .diff_structs import (
+    DatasetDiff,
+    Delta,
+    DeltaDiff,
+    KeyValue,
+    RepoDiff,
+    StreamingDeltaDiff,
+    StreamingRepoDiff,
+)
 from .exceptions import (
     NO_TABLE,
     NO_WORKING_COPY,
@@ -16,6 +25,7 @@ from .exceptions import (
     NotYetImplemented,
 )
 from .geometry import hex_wkb_to_gpkg_geom
+from .json_stream import JsonStreamReader
 from .tabular.schema import Schema
 from .timestamps import iso8601_tz_to_timedelta, iso8601_utc_to_datetime
 
@@ -175,34 +185,167 @@ def _build_signature(patch_metadata, person, repo):
     return repo.author_signature(**signature)
 
 
-def apply_patch(
-    *,
-    repo,
-    do_commit,
-    patch_file,
-    allow_empty,
-    ref="HEAD",
-    **kwargs,
-):
+DIFF_KEYS = ("kart.diff/v1+hexwkb", "sno.diff/v1+hexwkb")
+PATCH_KEYS = ("kart.patch/v1", "sno.patch/v1")
+
+
+def _read_patch(patch_file):
+    """
+    Reads the given patch file incrementally. Returns a tuple (metadata, json_diff, reader).
+    In the usual case - a patch as written by `kart create-patch`, where the patch metadata comes before the diff -
+    json_diff is None, and the reader is positioned at the start of the diff, so that the diff can be streamed
+    by _iter_streaming_ds_diffs. Otherwise, the entire diff has to be read into memory, and json_diff is a dict.
+    """
+    reader = JsonStreamReader(patch_file)
+    metadata = json_diff = None
+    diff_found = False
     try:
-        patch = json.load(patch_file)
+        for key in reader.iter_object_keys():
+            if key in PATCH_KEYS and metadata is None:
+                metadata = reader.read_value()
+            elif key in DIFF_KEYS and not diff_found:
+                diff_found = True
+                if metadata is not None:
+                    break
+                json_diff = reader.read_value()
+            else:
+                reader.read_value()
     except json.JSONDecodeError as e:
         raise click.FileError("Failed to parse JSON patch file") from e
 
-    json_diff = patch.get("kart.diff/v1+hexwkb")
-    if json_diff is None:
-        json_diff = patch.get("sno.diff/v1+hexwkb")
-    if json_diff is None:
+    if not diff_found:
         raise click.FileError(
             "Failed to parse JSON patch file: patch contains no `kart.diff/v1+hexwkb` object"
         )
-
-    metadata = patch.get("kart.patch/v1")
-    if metadata is None:
-        metadata = patch.get("sno.patch/v1")
     if metadata is None:
         # Not all diffs are patches.
         raise click.UsageError("Patch contains no author or head information")
+    return metadata, json_diff, reader
+
+
+def _parse_feature_changes(feature_changes, dataset, meta_diff, allow_minimal_updates):
+    """Generator. Parses each of the given feature changes into a Delta."""
+    feature_changes = iter(feature_changes)
+    first_change = next(feature_changes, None)
+    if first_change is None:
+        return
+
+    old_schema = new_schema = None
+    if dataset is not None:
+        old_schema = new_schema = dataset.schema
+
+    schema_delta = meta_diff.get("schema.json") if meta_diff else None
+    if schema_delta and schema_delta.old_value:
+        old_schema = Schema.from_column_dicts(schema_delta.old_value)
+    if schema_delta and schema_delta.new_value:
+        new_schema = Schema.from_column_dicts(schema_delta.new_value)
+
+    delta_parser = DeltaParser(
+        old_schema,
+        new_schema,
+        allow_minimal_updates=allow_minimal_updates,
+    )
+    for change in itertools.chain([first_change], feature_changes):
+        yield delta_parser.parse(change)
+
+
+def _parse_ds_diff(
+    ds_path, meta_changes, feature_changes, *, rs, do_commit, allow_minimal_updates
+):
+    """
+    Returns a DatasetDiff for the given meta and feature changes. If feature_changes is an iterator
+    rather than a list, the feature changes are parsed as they are read from it (see StreamingDeltaDiff).
+    """
+    repo = rs.repo
+    dataset = rs.datasets().get(ds_path)
+    meta_change_type = _meta_change_type({"meta": meta_changes})
+    check_change_supported(
+        repo.table_dataset_version, dataset, ds_path, meta_change_type, do_commit
+    )
+
+    ds_diff = DatasetDiff()
+    meta_diff = None
+    if meta_changes:
+        meta_diff = DeltaDiff(
+            Delta.from_key_and_plus_minus_dict(
+                k, v, allow_minimal_updates=allow_minimal_updates
+            )
+            for (k, v) in meta_changes.items()
+        )
+        ds_diff["meta"] = meta_diff
+
+    deltas = _parse_feature_changes(
+        feature_changes, dataset, meta_diff, allow_minimal_updates
+    )
+    if isinstance(feature_changes, list):
+        feature_diff = DeltaDiff(deltas)
+    else:
+        feature_diff = StreamingDeltaDiff(deltas)
+    if feature_diff:
+        ds_diff["feature"] = feature_diff
+    return ds_diff
+
+
+def _translate_json_errors(items):
+    """
+    Generator. Yields the given items as they are read from the patch - wherever they are consumed, which may be long
+    after _iter_streaming_ds_diffs yielded them - and reports any malformed JSON the same way as _read_patch does.
+    """
+    try:
+        yield from items
+    except json.JSONDecodeError as e:
+        raise click.FileError("Failed to parse JSON patch file") from e
+
+
+def _iter_streaming_ds_diffs(reader, **kwargs):
+    """
+    Generator. Reads the diff from the patch one dataset at a time, and yields (ds_path, ds_diff) for each dataset.
+    The feature changes in each ds_diff are read from the patch as they are needed, so the patch is never held in
+    memory - but this only works if any meta changes for a dataset come before its feature changes in the patch.
+    """
+    try:
+        for ds_path in reader.iter_object_keys():
+            meta_changes = {}
+            ds_diff_done = False
+            for key in reader.iter_object_keys():
+                if key == "meta" and not ds_diff_done:
+                    meta_changes = reader.read_value()
+                elif key == "feature" and not ds_diff_done:
+                    feature_changes = _translate_json_errors(reader.iter_array())
+                    ds_diff = _parse_ds_diff(
+                        ds_path, meta_changes, feature_changes, **kwargs
+                    )
+                    if ds_diff:
+                        yield ds_path, ds_diff
+                    # Make sure we've reached the end of the feature changes, whether or not they were all used.
+                    for _ in feature_changes:
+                        pass
+                    ds_diff_done = True
+                elif key == "meta":
+                    raise click.FileError(
+                        f"Failed to parse JSON patch file: meta changes for {ds_path} must come before feature changes"
+                    )
+                else:
+                    reader.read_value()
+
+            if not ds_diff_done:
+                ds_diff = _parse_ds_diff(ds_path, meta_changes, [], **kwargs)
+                if ds_diff:
+                    yield ds_path, ds_diff
+    except json.JSONDecodeError as e:
+        raise click.FileError("Failed to parse JSON patch file") from e
+
+
+def apply_patch(
+    *,
+    repo,
+    do_commit,
+    patch_file,
+    allow_empty,
+    ref="HEAD",
+    **kwargs,
+):
+    metadata, json_diff, reader = _read_patch(patch_file)
 
     resolve_missing_values_from_rs = None
     if "base" in metadata:
@@ -236,49 +379,24 @@ def apply_patch(
     if wc:
         wc.check_not_dirty()
 
-    repo_diff = RepoDiff()
-    for ds_path, ds_diff_dict in json_diff.items():
-        dataset = rs.datasets().get(ds_path)
-        meta_change_type = _meta_change_type(ds_diff_dict)
-        check_change_supported(
-            repo.table_dataset_version, dataset, ds_path, meta_change_type, do_commit
-        )
-
-        meta_changes = ds_diff_dict.get("meta", {})
-
-        if meta_changes:
-            allow_minimal_updates = bool(resolve_missing_values_from_rs)
-            meta_diff = DeltaDiff(
-                Delta.from_key_and_plus_minus_dict(
-                    k, v, allow_minimal_updates=allow_minimal_updates
-                )
-                for (k, v) in meta_changes.items()
-            )
-            repo_diff.recursive_set([ds_path, "meta"], meta_diff)
-        else:
-            meta_diff = None
-
-        feature_changes = ds_diff_dict.get("feature", [])
-        if feature_changes:
-            old_schema = new_schema = None
-            if dataset is not None:
-                old_schema = new_schema = dataset.schema
-
-            schema_delta = meta_diff.get("schema.json") if meta_diff else None
-            if schema_delta and schema_delta.old_value:
-                old_schema = Schema.from_column_dicts(schema_delta.old_value)
-            if schema_delta and schema_delta.new_value:
-                new_schema = Schema.from_column_dicts(schema_delta.new_value)
-
-            delta_parser = DeltaParser(
-                old_schema,
-                new_schema,
-                allow_minimal_updates=bool(resolve_missing_values_from_rs),
-            )
-            feature_diff = DeltaDiff(
-                (delta_parser.parse(change) for change in feature_changes)
+    parse_kwargs = {
+        "rs": rs,
+        "do_commit": do_commit,
+        "allow_minimal_updates": bool(resolve_missing_values_from_rs),
+    }
+    if json_diff is None:
+        repo_diff = StreamingRepoDiff(_iter_streaming_ds_diffs(reader, **parse_kwargs))
+    else:
+        repo_diff = RepoDiff()
+        for ds_path, ds_diff_dict in json_diff.items():
+            ds_diff = _parse_ds_diff(
+                ds_path,
+                ds_diff_dict.get("meta", {}),
+                ds_diff_dict.get("feature", []),
+                **parse_kwargs,
             )
-            repo_diff.recursive_set([ds_path, "feature"], feature_diff)
+            if ds_diff:
+                repo_diff[ds_path] = ds_diff
 
     if do_commit:
         commit = rs.commit_diff(
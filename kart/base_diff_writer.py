@@ -1,17 +1,22 @@
+import collections
 import itertools
 import logging
+import os
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import click
 
 from . import diff_util
-from .diff_structs import WORKING_COPY_EDIT
+from .diff_structs import WORKING_COPY_EDIT, Delta, KeyValue
 from .exceptions import NO_WORKING_COPY, CrsError, InvalidOperation, NotFound
 from .key_filters import RepoKeyFilter
-from .promisor_utils import FetchPromisedBlobsProcess, object_is_promised
+from .promisor_utils import PromisedBlobFetcher, object_is_promised
 from .spatial_filter import SpatialFilter
+from .tabular.feature_output import reproject_features
+from .utils import chunk
 
 L = logging.getLogger("kart.diff_writer")
 
@@ -32,6 +37,15 @@ class BaseDiffWriter:
     # as we know the delta does or does not match the spatial filter.
     record_spatial_filter_stats = False
 
+    # Feature deltas are output in order, but the lazily-loaded values of upcoming deltas are loaded ahead of time
+    # by this many worker threads, in batches of PREFETCH_BATCH_SIZE - see _prefetch_delta_values.
+    PREFETCH_THREADS = min(8, os.cpu_count() or 1)
+    PREFETCH_BATCH_SIZE = 100
+
+    # When reprojecting into the target CRS, the geometries of this many feature deltas are reprojected together -
+    # see reprojected_ds_feature_deltas.
+    REPROJECTION_BATCH_SIZE = 1000
+
     @classmethod
     def get_diff_writer_class(cls, output_format):
         if output_format == "quiet":
@@ -74,6 +88,8 @@ class BaseDiffWriter:
         target_crs=None,
         # used by json-lines diffs only
         diff_estimate_accuracy=None,
+        # used by json, json-lines and geojson diffs only
+        stream_features=False,
     ):
         self.repo = repo
         self.commit_spec = commit_spec
@@ -109,6 +125,9 @@ class BaseDiffWriter:
 
         self.json_style = json_style
         self.target_crs = target_crs
+        # Feature deltas can only be streamed (see StreamingDeltaDiff) when diffing commits -
+        # diffing the working copy involves combining two diffs by primary key.
+        self.stream_features = stream_features and not self.include_wc_diff
 
         self.commit = None
 
@@ -251,6 +270,7 @@ class BaseDiffWriter:
             include_wc_diff=self.include_wc_diff,
             wc_diff_context=self.wc_diff_context,
             repo_key_filter=self.repo_key_filter,
+            stream_features=self.stream_features,
         )
 
     def get_dataset_diff(self, ds_path):
@@ -272,13 +292,50 @@ class BaseDiffWriter:
             include_wc_diff=self.include_wc_diff,
             wc_diff_context=self.wc_diff_context,
             ds_filter=self.repo_key_filter[ds_path],
+            stream_features=self.stream_features,
         )
 
     def _unfiltered_ds_feature_deltas(self, ds_path, ds_diff):
         if "feature" not in ds_diff:
             return
 
-        yield from ds_diff["feature"].sorted_items()
+        yield from self._prefetch_delta_values(ds_diff["feature"].sorted_items())
+
+    def _prefetch_delta_values(self, key_delta_pairs):
+        """
+        Yields the given (key, delta) pairs unchanged and in the same order, but loads the values of upcoming
+        deltas in a pool of worker threads so that they are ready by the time they are needed. Reading blobs
+        releases the GIL, so this keeps more than one core busy while outputting a large diff.
+        At most 2 * PREFETCH_THREADS batches are loaded ahead, so memory use stays bounded.
+        """
+        if self.PREFETCH_THREADS <= 1:
+            yield from key_delta_pairs
+            return
+
+        max_pending = 2 * self.PREFETCH_THREADS
+        pending = collections.deque()
+        key_delta_pairs = iter(key_delta_pairs)
+        with ThreadPoolExecutor(max_workers=self.PREFETCH_THREADS) as executor:
+            try:
+                while True:
+                    while len(pending) < max_pending:
+                        batch = list(
+                            itertools.islice(key_delta_pairs, self.PREFETCH_BATCH_SIZE)
+                        )
+                        if not batch:
+                            break
+                        pending.append(
+                            (batch, executor.submit(_load_delta_values, batch))
+                        )
+                    if not pending:
+                        return
+                    batch, future = pending.popleft()
+                    future.result()
+                    yield from batch
+            finally:
+                # Don't load any more values if the caller stopped early.
+                for batch, future in pending:
+                    future.cancel()
 
     def filtered_ds_feature_deltas(self, ds_path, ds_diff):
         """
@@ -329,9 +386,52 @@ class BaseDiffWriter:
             if do_yield:
                 if delta_fetcher.ensure_delta_is_ready_or_start_fetch(key, delta):
                     yield key, delta
+            yield from delta_fetcher.iter_fetched_deltas()
 
         yield from delta_fetcher.finish_fetching_deltas()
 
+    def reprojected_ds_feature_deltas(self, ds_path, ds_diff):
+        """
+        Yields the same key, deltas as filtered_ds_feature_deltas, but with the geometries of the features
+        reprojected into self.target_crs (if it is set). The geometries are reprojected in batches, which is much
+        quicker than reprojecting each feature as it is output.
+        """
+        if "feature" not in ds_diff:
+            return
+
+        deltas = self.filtered_ds_feature_deltas(ds_path, ds_diff)
+        old_transform, new_transform = self.get_geometry_transforms(ds_path, ds_diff)
+        if old_transform is None and new_transform is None:
+            yield from deltas
+            return
+
+        for batch in chunk(deltas, self.REPROJECTION_BATCH_SIZE):
+            olds = self._reproject_key_values(
+                [delta.old for key, delta in batch], old_transform
+            )
+            news = self._reproject_key_values(
+                [delta.new for key, delta in batch], new_transform
+            )
+            for (key, delta), old, new in zip(batch, olds, news):
+                reprojected_delta = Delta(old, new)
+                reprojected_delta.flags = delta.flags
+                yield key, reprojected_delta
+
+    @classmethod
+    def _reproject_key_values(cls, key_values, geometry_transform):
+        if geometry_transform is None:
+            return key_values
+        present = [kv for kv in key_values if kv is not None]
+        reprojected = iter(
+            reproject_features(
+                [(kv.key, kv.get_lazy_value()) for kv in present], geometry_transform
+            )
+        )
+        return [
+            KeyValue(kv.key, next(reprojected)) if kv is not None else None
+            for kv in key_values
+        ]
+
     def record_spatial_filter_stat(
         self, ds_path, key, delta, old_match_result, new_match_result
     ):
@@ -472,24 +572,41 @@ class BaseDiffWriter:
             sys.exit(0)
 
 
+def _load_delta_values(key_delta_pairs):
+    """
+    Loads and caches the lazy values of the given deltas. Any errors are ignored - including errors caused by
+    promised blobs that are missing - since the value will be loaded again, and the error raised, when it is used.
+    """
+    for key, delta in key_delta_pairs:
+        for key_value in (delta.old, delta.new):
+            if key_value is None:
+                continue
+            try:
+                key_value.get_lazy_value()
+            except Exception:
+                pass
+
+
 class DeltaFetcher:
     """
-    Given a diff Delta, either reports that it is available immediately, or kicks off a fetch so that it will be
-    available soon, and adds it to the list of buffered deltas. This lets the diff writer above first output the deltas
-    that are available immediately, and then block until the other deltas have been fetched, and finally output those.
+    Given a diff Delta, either reports that it is available immediately, or requests a fetch so that it will be
+    available soon, and adds it to the list of buffered deltas. The fetches happen in the background, which lets the
+    diff writer above keep outputting the deltas that are available immediately - along with any buffered deltas
+    that have been fetched in the meantime - and finally block until the remaining deltas have been fetched.
     """
 
     def __init__(self, diff_writer, ds_path):
         self.diff_writer = diff_writer
         self.ds_path = ds_path
+        # (key, delta, blob IDs that are still needed) for each delta that is waiting to be fetched.
         self.buffered_deltas = []
 
     def ensure_delta_is_ready_or_start_fetch(self, key, delta):
         """
         If the delta is locally available, simply returns True.
         Otherwise, kicks off a fetch operation so that the Delta will be available soon, and adds the Delta
-        to a buffer of deltas to be retried later. After doing any other useful work while waiting for the
-        fetch to , all the deltas that were fetched can be generated by calling finish_fetching_deltas.
+        to a buffer of deltas to be retried later. The deltas that have been fetched so far can be generated at any
+        time by calling iter_fetched_deltas, and all the rest by calling finish_fetching_deltas.
         """
 
         old_value_ready = self._is_delta_value_ready(delta.old)
@@ -497,38 +614,65 @@ class DeltaFetcher:
         if old_value_ready and new_value_ready:
             return True
 
-        self.buffered_deltas.append((key, delta))
+        needed_blob_ids = set()
         if not old_value_ready:
-            self._start_fetch(delta.old)
+            needed_blob_ids.add(self._start_fetch(delta.old))
         if not new_value_ready:
-            self._start_fetch(delta.new)
+            needed_blob_ids.add(self._start_fetch(delta.new))
+        self.buffered_deltas.append((key, delta, needed_blob_ids))
         return False
 
     @property
-    def fetch_process(self):
-        if not hasattr(self, "_fetch_process"):
-            self._fetch_process = FetchPromisedBlobsProcess(self.diff_writer.repo)
-        return self._fetch_process
+    def fetcher(self):
+        if not hasattr(self, "_fetcher"):
+            self._fetcher = PromisedBlobFetcher(self.diff_writer.repo)
+        return self._fetcher
 
     def _start_fetch(self, delta_key_value):
-        blob = delta_key_value.value.args[0]
-        self.fetch_process.fetch(blob.id.hex)
+        blob_id = delta_key_value.value.args[0].id.hex
+        self.fetcher.fetch(blob_id)
+        return blob_id
+
+    def iter_fetched_deltas(self):
+        """Yields any buffered deltas that have finished fetching, without blocking."""
+        if self.buffered_deltas and self.fetcher.poll():
+            yield from self._take_fetched_deltas()
+
+    def _take_fetched_deltas(self):
+        fetched = self.fetcher.fetched
+        still_buffered = []
+        ready = []
+        for key, delta, needed_blob_ids in self.buffered_deltas:
+            if needed_blob_ids <= fetched:
+                ready.append((key, delta))
+            else:
+                still_buffered.append((key, delta, needed_blob_ids))
+        self.buffered_deltas = still_buffered
+        return ready
 
     def finish_fetching_deltas(self):
-        """Blocks until all the deltas that were requested finish fetching, then yields them all."""
+        """Blocks until all the deltas that were requested finish fetching, yielding each one once it is fetched."""
 
-        if not hasattr(self, "_fetch_process"):
+        if not hasattr(self, "_fetcher"):
             # We didn't start fetching any features - nothing to do here.
             return
 
-        # Notify the user about the fetch at this point since this is the point at which the diff
-        # output will stop until the fetch completes.
-        click.echo(
-            f"Fetching missing but required features in {self.ds_path}", err=True
-        )
+        if self.buffered_deltas:
+            # Notify the user about the fetch at this point since this is the point at which the diff
+            # output will stop until the fetch completes.
+            click.echo(
+                f"Fetching missing but required features in {self.ds_path}", err=True
+            )
 
-        self._fetch_process.finish()
-        yield from self.buffered_deltas
+        try:
+            while self.buffered_deltas and self._fetcher.is_fetching:
+                self._fetcher.wait_for_any()
+                yield from self._take_fetched_deltas()
+        finally:
+            self._fetcher.close()
+        # Anything left over wasn't fetched - let the diff writer report the error when it tries to read it.
+        yield from ((key, delta) for key, delta, needed_blob_ids in self.buffered_deltas)
+        self.buffered_deltas = []
 
     def _is_delta_value_ready(self, delta_key_value):
         if delta_key_value is None:
@@ -165,7 +165,7 @@ def commit(ctx, message, allow_empty, allow_pk_conflicts, output_format, filters
         raise click.UsageError("Aborting commit due to empty commit message.")
 
     new_commit = repo.structure().commit_diff(
-        wc_diff, commit_msg, allow_empty=allow_empty
+        wc_diff, commit_msg, allow_empty=allow_empty, from_working_copy=True
     )
 
     working_copy.reset_tracking_table(commit_diff_writer.repo_key_filter)
@@ -1,5 +1,3 @@
-from osgeo import osr
-
 from .cli_util import StringFromFile
 from .exceptions import CrsError
 from .serialise_util import uint32hash
@@ -20,6 +18,8 @@ def make_crs(crs_text, context=None):
     Accepted input is very flexible.
     see https://gdal.org/api/ogrspatialref.html#classOGRSpatialReference_1aec3c6a49533fe457ddc763d699ff8796
     """
+    from osgeo import osr
+
     try:
         crs = osr.SpatialReference()
         crs.SetFromUserInput(crs_text)
@@ -61,6 +61,8 @@ NAME_PATTERN = (Keyword, OpenBracket, String)
 
 
 def parse_name(crs):
+    from osgeo import osr
+
     if isinstance(crs, str):
         result = WKTLexer().find_pattern(
             crs, NAME_PATTERN, at_depth=0, extract_strings=True
@@ -80,6 +82,7 @@ AUTHORITY_PATTERN = ("AUTHORITY", OpenBracket, String, Comma, String, CloseBrack
 
 
 def parse_authority(crs):
+    from osgeo import osr
 
     if isinstance(crs, str):
         result = WKTLexer().find_pattern(
@@ -155,6 +158,7 @@ CUSTOM_RANGE = MAX_CUSTOM_ID - MIN_CUSTOM_ID + 1
 
 def _generate_identifier_int(crs):
     """Given a CRS, generate a unique stable int for it - based on its authority or name, if these are present."""
+    from osgeo import osr
 
     # Generate an identifier int based on the WKT authority or name if one is set:
     identifier_str = _find_identifier_str(crs)
@@ -7,10 +7,18 @@ from kart.key_filters import DatasetKeyFilter, MetaKeyFilter, UserStringKeyFilte
 class DatasetDiffMixin:
     """Adds diffing of meta-items to a dataset, by delegating to dataset.meta_items()"""
 
-    def diff(self, other, ds_filter=DatasetKeyFilter.MATCH_ALL, reverse=False):
+    def diff(
+        self,
+        other,
+        ds_filter=DatasetKeyFilter.MATCH_ALL,
+        reverse=False,
+        stream_features=False,
+    ):
         """
         Generates a Diff from self -> other.
         If reverse is true, generates a diff from other -> self.
+        If stream_features is true, any feature deltas are generated on demand, in path order -
+        see StreamingDeltaDiff. (Not relevant to datasets without features).
         """
         ds_diff = DatasetDiff()
         meta_filter = ds_filter.get("meta", ds_filter.child_type())
@@ -49,24 +57,34 @@ class DatasetDiffMixin:
         # Subclasses to override.
         pass
 
-    def get_raw_diff_for_subtree(self, other, subtree_name, reverse=False):
+    def get_raw_diff_for_subtree(self, other, subtree_name, reverse=False, lazy=False):
         """
         Get a pygit2.Diff of the diff between some subtree of this dataset, and the same subtree of another dataset
-        (generally the "same" dataset at a different revision).
+        (generally the "same" dataset at a different revision). If the repo is configured to use the TreeDiffCache,
+        or if lazy is True, the result is a pygit2.Diff-like TreeDiff instead, which only diffs the trees as it is
+        iterated over - so the whole diff is never held in memory.
         """
 
-        flags = pygit2.GIT_DIFF_SKIP_BINARY_CHECK
         self_subtree = self.get_subtree(subtree_name)
         other_subtree = other.get_subtree(subtree_name) if other else self._empty_tree
 
-        diff = self_subtree.diff_to_tree(other_subtree, flags=flags, swap=reverse)
+        use_cache = self.repo.use_tree_diff_cache
+        if use_cache or lazy:
+            old_subtree, new_subtree = self_subtree, other_subtree
+            if reverse:
+                old_subtree, new_subtree = new_subtree, old_subtree
+            diff = self.repo.tree_diff_cache.diff_trees(
+                old_subtree, new_subtree, use_cache=use_cache
+            )
+        else:
+            flags = pygit2.GIT_DIFF_SKIP_BINARY_CHECK
+            diff = self_subtree.diff_to_tree(other_subtree, flags=flags, swap=reverse)
         self.L.debug(
-            "diff %s (%s -> %s / %s): %s changes",
+            "diff %s (%s -> %s / %s)",
             subtree_name,
             self_subtree.id,
             other_subtree.id if other_subtree else None,
             "R" if reverse else "F",
-            len(diff),
         )
         return diff
 
@@ -79,6 +97,7 @@ class DatasetDiffMixin:
         key_decoder_method,
         value_decoder_method,
         reverse=False,
+        lazy=False,
     ):
         """
         A pattern for datasets to use for diffing some specific subtree. Works as follows:
@@ -98,12 +117,15 @@ class DatasetDiffMixin:
         key_decoder_method, value_decoder_method - these must be names of methods that are present in both
             self and other - self's methods are used to decode self's items, and other's methods for other's items.
         reverse - normally yields deltas from self -> other, but if reverse is True, yields deltas from other -> self.
+        lazy - if True, the subtrees are only diffed as the deltas are consumed - see get_raw_diff_for_subtree.
         """
         # TODO - if the key-filter is very restrictive (ie it has only a few items in) then
         # it would be more efficient if we first search for those items and diff only those.
 
         subtree_name = subtree_name.rstrip("/")
-        raw_diff = self.get_raw_diff_for_subtree(other, subtree_name, reverse=reverse)
+        raw_diff = self.get_raw_diff_for_subtree(
+            other, subtree_name, reverse=reverse, lazy=lazy
+        )
         # NOTE - we could potentially call diff.find_similar() to detect renames here,
 
         if reverse:
@@ -0,0 +1,234 @@
+import logging
+from collections import OrderedDict
+
+import pygit2
+from pysqlite3 import dbapi2 as sqlite
+
+from kart.repo import KartRepoFiles
+from kart.serialise_util import msg_pack, msg_unpack
+from kart.structure import DATASET_DIRNAME_PATTERN
+
+L = logging.getLogger("kart.dataset_tree_index")
+
+
+class DatasetTreeIndex:
+    """
+    A persistent index of which datasets exist at each commit, and the OID of the tree of each one, eg:
+    commit-id -> {"nz_building_outlines": "8f7dbff287b9d40a772a1315c47e208124028645", ...}
+
+    Commits are immutable, so entries never need to be invalidated - commits that aren't yet indexed are indexed
+    the first time they are asked about. A commit is indexed by comparing its tree to the tree of its first parent,
+    descending only into the subtrees that differ - so indexing a commit that only changes one dataset doesn't involve
+    looking at any of the others, and no datasets are ever instantiated.
+
+    The index is only a cache - if the index file can't be written, an in-memory index is used instead, so
+    everything still works, just more slowly next time.
+    """
+
+    # How many newly indexed commits are held in memory before they are written to the index file.
+    WRITE_BATCH_SIZE = 1000
+    # How many recently used commits are held in memory, already decoded - when walking history, each commit is
+    # looked up along with its first parent, so only the last few are ever needed again.
+    CACHE_SIZE = 100
+
+    def __init__(self, repo):
+        self.repo = repo
+        self.cache = OrderedDict()
+        self.unwritten = {}
+        self.db = None
+        db_path = repo.gitdir_file(KartRepoFiles.DATASET_TREES)
+        try:
+            self._open_db(f"file:{db_path}")
+        except sqlite.Error as e:
+            L.warning("Can't use dataset tree index at %s: %s", db_path, e)
+            self._use_memory_db()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.flush()
+        self._close_db()
+
+    def _open_db(self, uri):
+        self.db = sqlite.connect(uri, uri=True)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS commit_dataset_trees "
+            "(commit_id TEXT PRIMARY KEY, dataset_trees BLOB NOT NULL);"
+        )
+
+    def _use_memory_db(self):
+        # Commits that are evicted from the cache still need to be found again without re-indexing them -
+        # an in-memory database holds them compactly, for as long as this index is open.
+        self._close_db()
+        self._open_db(":memory:")
+
+    def _close_db(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def flush(self):
+        """Writes any newly indexed commits to the index file."""
+        if not self.unwritten or self.db is None:
+            self.unwritten.clear()
+            return
+        try:
+            self._write_unwritten()
+        except sqlite.Error as e:
+            L.warning("Couldn't update dataset tree index: %s", e)
+            self._use_memory_db()
+            self._write_unwritten()
+        self.unwritten.clear()
+
+    def _write_unwritten(self):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO commit_dataset_trees (commit_id, dataset_trees) VALUES (?, ?);",
+                (
+                    (commit_id, msg_pack(dataset_trees))
+                    for commit_id, dataset_trees in self.unwritten.items()
+                ),
+            )
+
+    def _lookup(self, commit_id):
+        result = self.cache.get(commit_id)
+        if result is not None:
+            self.cache.move_to_end(commit_id)
+            return result
+        result = self.unwritten.get(commit_id)
+        if result is None and self.db is not None:
+            row = self.db.execute(
+                "SELECT dataset_trees FROM commit_dataset_trees WHERE commit_id = ?;",
+                (commit_id,),
+            ).fetchone()
+            if row is not None:
+                result = msg_unpack(row[0])
+        if result is not None:
+            self._cache(commit_id, result)
+        return result
+
+    def _cache(self, commit_id, dataset_trees):
+        self.cache[commit_id] = dataset_trees
+        self.cache.move_to_end(commit_id)
+        while len(self.cache) > self.CACHE_SIZE:
+            self.cache.popitem(last=False)
+
+    def _store(self, commit_id, dataset_trees):
+        self._cache(commit_id, dataset_trees)
+        self.unwritten[commit_id] = dataset_trees
+        if len(self.unwritten) >= self.WRITE_BATCH_SIZE:
+            self.flush()
+
+    def get_dataset_trees(self, commit):
+        """
+        Given a commit, returns a dict of the OIDs of the dataset trees at that commit, keyed by dataset path, eg:
+        {
+            "nz_building_outlines": "8f7dbff287b9d40a772a1315c47e208124028645",
+            ...
+        }
+        """
+        commit_id = commit.id.hex
+        result = self._lookup(commit_id)
+        if result is not None:
+            return result
+
+        # Find the nearest first-parent ancestor that is already indexed, then index forwards from there -
+        # iteratively, since this could be the entire history of the repo.
+        to_index = [commit]
+        base_trees = {}
+        while True:
+            try:
+                parent = to_index[-1].parents[0]
+            except (KeyError, IndexError):
+                # Initial commit, or a shallow clone where the parent is not present.
+                parent = None
+                break
+            parent_trees = self._lookup(parent.id.hex)
+            if parent_trees is not None:
+                base_trees = parent_trees
+                break
+            to_index.append(parent)
+
+        base_tree = parent.peel(pygit2.Tree) if parent is not None else None
+        for c in reversed(to_index):
+            tree = c.peel(pygit2.Tree)
+            base_trees = _update_dataset_trees(base_trees, base_tree, tree)
+            self._store(c.id.hex, base_trees)
+            base_tree = tree
+
+        return base_trees
+
+    def get_changed_datasets(self, commit):
+        """Given a commit, returns a sorted list of the paths of the datasets changed by that commit."""
+        cur_trees = self.get_dataset_trees(commit)
+        try:
+            if not commit.parents:
+                return sorted(cur_trees.keys())
+            prev_trees = self.get_dataset_trees(commit.parents[0])
+        except KeyError:
+            # Shallow clone - the parent commit is not present.
+            return sorted(cur_trees.keys())
+
+        changes = prev_trees.items() ^ cur_trees.items()
+        return sorted(set(ds_path for ds_path, tree_id in changes))
+
+
+def _update_dataset_trees(base_trees, base_tree, tree):
+    """
+    Given base_trees - the dataset trees found in base_tree - returns the dataset trees found in tree.
+    Only the subtrees that differ between base_tree and tree are examined.
+    """
+    if base_tree is not None and base_tree.id == tree.id:
+        return base_trees
+
+    result = dict(base_trees)
+    _update_subtree(result, base_tree, tree, "")
+    return result
+
+
+def _update_subtree(result, base_tree, tree, path):
+    base_children = _child_trees(base_tree)
+    children = _child_trees(tree)
+    for name in base_children.keys() | children.keys():
+        base_child = base_children.get(name)
+        child = children.get(name)
+        if base_child is not None and child is not None:
+            if base_child.id == child.id:
+                continue
+
+        child_path = f"{path}/{name}" if path else name
+        if child is None:
+            _forget_subtree(result, child_path)
+            continue
+
+        if _is_dataset_tree(child):
+            result[child_path] = child.id.hex
+        else:
+            result.pop(child_path, None)
+        # Datasets can be nested inside other datasets, as well as in ordinary directories.
+        _update_subtree(result, base_child, child, child_path)
+
+
+def _forget_subtree(result, path):
+    prefix = f"{path}/"
+    for ds_path in [p for p in result if p == path or p.startswith(prefix)]:
+        del result[ds_path]
+
+
+def _child_trees(tree):
+    """Returns the non-hidden child trees of the given tree, keyed by name."""
+    if tree is None:
+        return {}
+    return {
+        child.name: child
+        for child in tree
+        if child.type_str == "tree" and not child.name.startswith(".")
+    }
+
+
+def _is_dataset_tree(tree):
+    return any(DATASET_DIRNAME_PATTERN.fullmatch(child.name) for child in tree)
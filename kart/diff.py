@@ -115,6 +115,16 @@ def feature_count_diff(
         "the stream when it is ready. If the estimate is not ready before the process exits, it will not be added."
     ),
 )
+@click.option(
+    "--stream-features",
+    is_flag=True,
+    default=False,
+    help=(
+        "Output each feature change as soon as it is found, so that memory use doesn't grow with the size of the diff. "
+        "Feature changes are output in the order they are stored, rather than in primary key order. "
+        "Only used with -o json, -o json-lines or -o geojson, when diffing two commits."
+    ),
+)
 @click.argument("commit_spec", required=False, nargs=1)
 @click.argument("filters", nargs=-1)
 def diff(
@@ -128,6 +138,7 @@ def diff(
     commit_spec,
     filters,
     add_feature_count_estimate,
+    stream_features,
 ):
     """
     Show changes between two commits, or between a commit and the working copy.
@@ -158,6 +169,11 @@ def diff(
             only_feature_count,
         )
 
+    if stream_features and output_type not in ("json", "json-lines", "geojson"):
+        raise click.UsageError(
+            "--stream-features requires json, json-lines or geojson output"
+        )
+
     from .base_diff_writer import BaseDiffWriter
 
     repo = ctx.obj.get_repo(allowed_states=KartRepoState.ALL_STATES)
@@ -170,6 +186,7 @@ def diff(
         json_style=fmt,
         target_crs=crs,
         diff_estimate_accuracy=add_feature_count_estimate,
+        stream_features=stream_features,
     )
     diff_writer.write_diff()
 
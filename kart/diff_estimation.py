@@ -1,10 +1,8 @@
-import subprocess
 import threading
 
 import pygit2
 
 from kart.diff_util import get_dataset_diff, WCDiffContext
-from kart.exceptions import SubprocessError
 
 ACCURACY_SUBTREE_SAMPLES = {
     "veryfast": 2,
@@ -17,32 +15,15 @@ ACCURACY_SUBTREE_SAMPLES = {
 ACCURACY_CHOICES = ("veryfast", "fast", "medium", "good", "exact")
 
 
-def get_exact_diff_blob_count(repo, tree1, tree2):
+def get_exact_diff_blob_count(tree1, tree2):
     """
-    Returns an exact blob count for the diff between the two pygit2.Tree instances
+    Returns an exact blob count for the diff between the two pygit2.Tree instances.
+    The trees are diffed in-process by libgit2, which skips any subtrees that are identical in both trees.
     """
     if tree1 == tree2:
         return 0
 
-    git_rev_spec = f"{tree1.id}..{tree2.id}"
-    p = subprocess.Popen(
-        [
-            "git",
-            "-C",
-            repo.path,
-            "diff",
-            "--name-only",
-            "--no-renames",
-            git_rev_spec,
-        ],
-        stdout=subprocess.PIPE,
-        encoding="utf-8",
-    )
-    count = sum(1 for x in p.stdout)
-    retcode = p.wait()
-    if retcode != 0:
-        raise SubprocessError("Error calling git diff", retcode)
-    return count
+    return len(tree1.diff_to_tree(tree2, flags=pygit2.GIT_DIFF_SKIP_BINARY_CHECK))
 
 
 def get_approximate_diff_blob_count(
@@ -76,12 +57,14 @@ def estimate_diff_feature_counts(
     *,
     include_wc_diff=False,
     accuracy,
+    annotate=True,
 ):
     """
     Estimates feature counts for each dataset in the given diff.
     Returns a dict (keys are dataset paths; values are feature counts)
     Datasets with (probably) no features changed are not present in the dict.
     `accuracy` should be one of ACCURACY_CHOICES
+    If `annotate` is False, the result is neither looked up in nor stored to repo.diff_annotations.
     """
     base = base.peel(pygit2.Tree)
     target = target.peel(pygit2.Tree)
@@ -90,10 +73,11 @@ def estimate_diff_feature_counts(
 
     assert accuracy in ACCURACY_CHOICES
 
+    annotate = annotate and not include_wc_diff
     if include_wc_diff:
         working_copy = repo.working_copy
         wc_diff_context = WCDiffContext(repo)
-    else:
+    elif annotate:
         annotation_type = f"feature-change-counts-{accuracy}"
         annotation = repo.diff_annotations.get(
             base=base,
@@ -136,10 +120,8 @@ def estimate_diff_feature_counts(
             ds_total = len(ds_diff.get("feature", []))
 
         elif accuracy == "exact":
-            # nice, simple, no stats involved. but slow :/
-            ds_total = get_exact_diff_blob_count(
-                repo, base_feature_tree, target_feature_tree
-            )
+            # nice, simple, no stats involved.
+            ds_total = get_exact_diff_blob_count(base_feature_tree, target_feature_tree)
         else:
             path_encoder = (
                 base_ds.feature_path_encoder
@@ -160,7 +142,7 @@ def estimate_diff_feature_counts(
         if ds_total:
             dataset_change_counts[dataset_path] = ds_total
 
-    if not include_wc_diff:
+    if annotate:
         repo.diff_annotations.store(
             base=base,
             target=target,
@@ -1,3 +1,4 @@
+import itertools
 from collections import UserDict
 from dataclasses import dataclass
 from typing import Any
@@ -204,7 +205,7 @@ class RichDict(UserDict):
         super().__init__(*args, **kwargs)
 
     def ensure_child_type(self, key, value):
-        if type(value) != self.child_type:
+        if not isinstance(value, self.child_type):
             raise TypeError(
                 f"{type(self).__name__} accepts children of type {self.child_type.__name__} "
                 f"but received {type(value).__name__}"
@@ -458,6 +459,45 @@ class DeltaDiff(Diff):
         return sorted(self.items(), key=key)
 
 
+class StreamingDeltaDiff(DeltaDiff):
+    """
+    A DeltaDiff that doesn't hold its Deltas in memory - instead they are generated one at a time from the given
+    iterable (generally a dataset's diff_feature generator), in the order they are generated. This allows for
+    outputting diffs of any size in bounded memory, but it means the deltas can only be iterated over once,
+    and only in the order they are generated (which for features is path order, not primary key order).
+    """
+
+    def __init__(self, deltas):
+        super().__init__()
+        deltas = iter(deltas)
+        # Peek at the first delta so that we know if this diff is empty or not.
+        first_delta = next(deltas, None)
+        self._deltas = (
+            itertools.chain([first_delta], deltas) if first_delta is not None else None
+        )
+
+    def __bool__(self):
+        return self._deltas is not None
+
+    def __len__(self):
+        raise TypeError("StreamingDeltaDiff has no len()")
+
+    def items(self):
+        deltas, self._deltas = self._deltas, iter(())
+        if deltas is None:
+            return
+        for delta in deltas:
+            yield delta.key, delta
+
+    def values(self):
+        for key, delta in self.items():
+            yield delta
+
+    def sorted_items(self):
+        """Yields the deltas in the order they are generated - they can't be sorted without holding them all."""
+        return self.items()
+
+
 class DatasetDiff(Diff):
     """A DatasetDiff contains up to two DeltaDiffs, at keys "meta" or "feature"."""
 
@@ -478,3 +518,30 @@ class RepoDiff(Diff):
     """A RepoDiff contains zero or more DatasetDiffs (one for each dataset that has changes)."""
 
     child_type = DatasetDiff
+
+
+class StreamingRepoDiff(RepoDiff):
+    """
+    A RepoDiff that doesn't hold its DatasetDiffs in memory - instead they are generated one at a time from the given
+    iterable of (ds_path, ds_diff) pairs. Like StreamingDeltaDiff, it can only be iterated over once. Each DatasetDiff
+    should be finished with before the next one is requested, since generating the next one may invalidate it.
+    """
+
+    def __init__(self, ds_diffs):
+        super().__init__()
+        self._ds_diffs = iter(ds_diffs)
+
+    def __len__(self):
+        raise TypeError("StreamingRepoDiff has no len()")
+
+    def items(self):
+        ds_diffs, self._ds_diffs = self._ds_diffs, iter(())
+        yield from ds_diffs
+
+    def values(self):
+        for ds_path, ds_diff in self.items():
+            yield ds_diff
+
+    def sorted_items(self):
+        """Yields the dataset diffs in the order they are generated."""
+        return self.items()
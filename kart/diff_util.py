@@ -109,6 +109,7 @@ def get_repo_diff(
     include_wc_diff=False,
     wc_diff_context=None,
     repo_key_filter=RepoKeyFilter.MATCH_ALL,
+    stream_features=False,
 ):
     """
     Generates a RepoDiff containing an entry for every dataset in the repo
@@ -119,6 +120,7 @@ def get_repo_diff(
         (in which case, target_rs must be the HEAD commit which the working copy is tracking).
     wc_diff_context - not required, but can be used to control where the working-copy is found
     repo_key_filter - controls which datasets (and PK values) match and are included in the diff.
+    stream_features - if True, feature deltas are generated on demand - see get_dataset_diff.
     """
 
     all_ds_paths = get_all_ds_paths(base_rs, target_rs, repo_key_filter)
@@ -134,6 +136,7 @@ def get_repo_diff(
             include_wc_diff=include_wc_diff,
             wc_diff_context=wc_diff_context,
             ds_filter=repo_key_filter[ds_path],
+            stream_features=stream_features,
         )
     # No need to recurse since self.get_dataset_diff already prunes the dataset diffs.
     repo_diff.prune(recurse=False)
@@ -148,6 +151,7 @@ def get_dataset_diff(
     include_wc_diff=False,
     wc_diff_context=None,
     ds_filter=DatasetKeyFilter.MATCH_ALL,
+    stream_features=False,
 ):
     """
     Generates the DatasetDiff for the dataset at path dataset_path.
@@ -158,7 +162,13 @@ def get_dataset_diff(
     wc_diff_context - reusing the same WCDiffContext for every dataset that is being diffed at one time
         is more efficient as it can save pygit2.Index.diff_to_worktree being called multiple times
     ds_filter - controls which PK values match and are included in the diff.
+    stream_features - if True, feature deltas are not held in memory, but are generated on demand in path order -
+        see StreamingDeltaDiff. Not supported when include_wc_diff is True, since the working copy diff must be
+        concatenated with the commit diff by primary key.
     """
+    if stream_features and include_wc_diff:
+        raise ValueError("Can't stream features when diffing the working copy")
+
     base_target_diff = None
     target_wc_diff = None
 
@@ -177,7 +187,12 @@ def get_dataset_diff(
             from_ds, to_ds = target_ds, base_ds
             reverse = True
 
-        base_target_diff = from_ds.diff(to_ds, ds_filter=ds_filter, reverse=reverse)
+        base_target_diff = from_ds.diff(
+            to_ds,
+            ds_filter=ds_filter,
+            reverse=reverse,
+            stream_features=stream_features,
+        )
         L.debug("base<>target diff (%s): %s", ds_path, repr(base_target_diff))
 
     if include_wc_diff:
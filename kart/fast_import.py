@@ -1,8 +1,14 @@
+import itertools
 import logging
 import math
+import multiprocessing
+import queue
 import subprocess
+import threading
 import time
 import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import ExitStack, contextmanager
 from enum import Enum, auto
 
@@ -21,7 +27,7 @@ from .structure import Datasets
 from .tabular.import_source import TableImportSource
 from .tabular.pk_generation import PkGeneratingTableImportSource
 from .timestamps import minutes_to_tz_offset
-from .utils import get_num_available_cores
+from .utils import chunk, get_num_available_cores
 
 L = logging.getLogger("kart.fast_import")
 
@@ -38,12 +44,32 @@ class FastImportSettings:
     If not set, reasonable defaults are used.
     """
 
-    def __init__(self, *, num_processes=None, max_pack_size=None, max_delta_depth=None):
+    # Sources smaller than this aren't worth starting up a pool of encoder processes for.
+    MIN_FEATURES_FOR_ENCODER_PROCESSES = 100_000
+
+    def __init__(
+        self,
+        *,
+        num_processes=None,
+        max_pack_size=None,
+        max_delta_depth=None,
+        num_encoder_processes=None,
+        encoder_batch_size=None,
+    ):
         self.num_processes = num_processes or get_default_num_processes()
         # Maximum size of pack files
         self.max_pack_size = max_pack_size or "2G"
         # Maximum depth of delta-compression chains
         self.max_delta_depth = max_delta_depth or 0
+        # Number of worker processes which encode features into blobs - 0 means encode them in this process.
+        # Defaults to one encoder process per git-fast-import process.
+        if num_encoder_processes is None:
+            num_encoder_processes = (
+                self.num_processes if self.num_processes > 1 else 0
+            )
+        self.num_encoder_processes = num_encoder_processes
+        # Number of features sent to an encoder process at a time
+        self.encoder_batch_size = encoder_batch_size or 1000
 
     def as_args(self):
         args = []
@@ -375,6 +401,7 @@ def fast_import_tables(
                     replace_ids,
                     limit,
                     verbosity,
+                    settings,
                 )
 
         if import_refs:
@@ -435,6 +462,7 @@ def _import_single_source(
     replace_ids,
     limit,
     verbosity,
+    settings,
 ):
     """
     repo - the Kart repo to import into.
@@ -449,6 +477,7 @@ def _import_single_source(
         0: no progress information is printed to stdout.
         1: basic status information
         2: full output of `git-fast-import --stats ...`
+    settings - FastImportSettings: Tuneable settings which affect performance.
     """
     replacing_dataset = None
     if replace_existing == ReplaceExisting.GIVEN:
@@ -530,6 +559,19 @@ def _import_single_source(
                 source,
                 replacing_dataset=replacing_dataset,
             )
+        elif (
+            settings.num_encoder_processes > 1
+            and id_iterator is None
+            and num_rows >= settings.MIN_FEATURES_FOR_ENCODER_PROCESSES
+        ):
+            if limit:
+                src_iterator = itertools.islice(src_iterator, limit)
+            feature_blob_iter = parallel_encode_feature_blobs(
+                dataset.feature_blob_encoder(source.schema),
+                src_iterator,
+                num_workers=settings.num_encoder_processes,
+                batch_size=settings.encoder_batch_size,
+            )
         else:
             feature_blob_iter = dataset.import_iter_feature_blobs(
                 repo, src_iterator, source
@@ -548,6 +590,9 @@ def _import_single_source(
             if limit is not None and i == (limit - 1):
                 click.secho(f"  Stopping at {limit:,d} features", fg="yellow")
                 break
+        if hasattr(feature_blob_iter, "close"):
+            # Shut down any encoder processes if we stopped early.
+            feature_blob_iter.close()
         t2 = time.monotonic()
         if verbosity >= 1:
             click.echo(f"Added {num_rows:,d} Features to index in {t2-t1:.1f}s")
@@ -564,6 +609,95 @@ def _import_single_source(
         click.echo(f"Closed in {(t3-t2):.0f}s")
 
 
+_END_OF_BATCHES = object()
+
+# The FeatureBlobEncoder for the current worker process - see _init_encoder_process.
+_process_encoder = None
+
+
+def _init_encoder_process(encoder):
+    global _process_encoder
+    _process_encoder = encoder
+
+
+def _encode_feature_batch(features):
+    return _process_encoder.encode_features(features)
+
+
+def parallel_encode_feature_blobs(encoder, src_iterator, *, num_workers, batch_size):
+    """
+    Generator. Encodes the features from src_iterator into (path, blob_data) tuples using a pool of worker processes.
+    Results are yielded in the same order as the features were read from src_iterator.
+
+    encoder - a picklable FeatureBlobEncoder - see TableV3.feature_blob_encoder
+    src_iterator - the features to encode. This is read from a separate reader thread.
+    num_workers - the number of worker processes to use.
+    batch_size - the number of features sent to a worker process at a time.
+
+    At most 2 * num_workers batches are read from the source but not yet yielded at any time,
+    so memory use doesn't depend on the size of the source.
+    """
+    max_batches_in_flight = num_workers * 2
+    batch_queue = queue.Queue(maxsize=max_batches_in_flight)
+    stop_reading = threading.Event()
+
+    def _put(item):
+        while not stop_reading.is_set():
+            try:
+                batch_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _read_batches():
+        try:
+            for batch in chunk(src_iterator, batch_size):
+                if not _put(batch):
+                    return
+        except Exception as e:
+            # Re-raised in the main thread.
+            _put(e)
+        else:
+            _put(_END_OF_BATCHES)
+
+    reader = threading.Thread(target=_read_batches, name="fast-import-reader")
+
+    # Spawn rather than fork - forking a process with open repo / database handles and running threads isn't safe.
+    mp_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+        num_workers,
+        mp_context=mp_context,
+        initializer=_init_encoder_process,
+        initargs=(encoder,),
+    ) as executor:
+        reader.start()
+        try:
+            pending = deque()
+            reading = True
+            while reading or pending:
+                # Keep the workers busy, but don't wait for the reader if there are results ready to yield.
+                while reading and len(pending) < max_batches_in_flight:
+                    try:
+                        item = batch_queue.get(block=not pending)
+                    except queue.Empty:
+                        break
+                    if item is _END_OF_BATCHES:
+                        reading = False
+                    elif isinstance(item, Exception):
+                        raise item
+                    else:
+                        pending.append(executor.submit(_encode_feature_batch, item))
+
+                if pending:
+                    yield from pending.popleft().result()
+        finally:
+            stop_reading.set()
+            reader.join()
+            for future in pending:
+                future.cancel()
+
+
 def write_blob_to_stream(stream, blob_path, blob_data):
     stream.write(f"M 644 inline {blob_path}\ndata {len(blob_data)}\n".encode("utf8"))
     stream.write(blob_data)
@@ -95,7 +95,8 @@ def fsck(ctx, reset_datasets, fsck_args):
                 f"SELECT COUNT(*) FROM {working_copy.table_identifier(dataset)};"
             )
             click.echo(f"{wc_count} features in {table}")
-            ds_count = dataset.feature_count
+            # Counted directly - a cached count could hide a mismatch.
+            ds_count = sum(1 for blob in dataset.feature_blobs())
             if wc_count != ds_count:
                 has_err = True
                 click.secho(
@@ -1,12 +1,14 @@
 import binascii
+import functools
+import itertools
 import json
 import math
 import re
 import struct
+import sys
+from array import array
 from enum import IntEnum
 
-from osgeo import ogr, osr
-
 from .cli_util import StringFromFile
 from .exceptions import GeometryError
 
@@ -37,6 +39,22 @@ GPKG_ENVELOPE_SIZES = {
 }
 
 
+# GDAL is slow to import, and most commands don't need it - so it is only imported the first time it is needed.
+# The import is cached here, rather than repeated in every function that converts a geometry.
+@functools.lru_cache(maxsize=1)
+def _ogr():
+    from osgeo import ogr
+
+    return ogr
+
+
+@functools.lru_cache(maxsize=1)
+def _osr():
+    from osgeo import osr
+
+    return osr
+
+
 class GeometryType(IntEnum):
     POINT = 1
     LINESTRING = 2
@@ -187,6 +205,8 @@ class Geometry(bytes):
 
     @property
     def geometry_type_name(self):
+        ogr = _ogr()
+
         ogr_type = self.geometry_type
         name = GeometryType(ogr.GT_Flatten(ogr_type)).name
         z = ogr.GT_HasZ(ogr_type)
@@ -276,6 +296,8 @@ def _desired_gpkg_envelope_type(flags, wkb_buffer, wkb_offset=0):
       * XY and XYM geometries get XY envelopes
       * XYZ and XYZM geometries get XYZ envelopes
     """
+    ogr = _ogr()
+
     if flags & _GPKG_EMPTY_BIT:
         # no need to add envelopes to empties
         return GPKG_ENVELOPE_NONE
@@ -350,6 +372,8 @@ def gpkg_geom_to_wkb(gpkg_geom):
     Returns little-endian ISO WKB (as bytes), or `None` if gpkg_geom is `None`.
     http://www.geopackage.org/spec/#gpb_format
     """
+    ogr = _ogr()
+
     if gpkg_geom is None:
         return None
     flags = _validate_gpkg_geom(gpkg_geom)
@@ -397,11 +421,33 @@ def parse_gpkg_geom(gpkg_geom):
     return wkb_offset, is_le, crs_id
 
 
+def gpkg_point_xy(gpkg_geom):
+    """
+    Returns the (x, y) coordinates of the given GPKG geometry if it is a non-empty point, or None if it is anything else.
+    This is read directly from the WKB, without loading the geometry into OGR.
+    """
+    flags = _validate_gpkg_geom(gpkg_geom)
+    if flags & _GPKG_EMPTY_BIT:
+        return None
+    wkb_offset = 8 + gpkg_envelope_size(flags)
+    wkb_is_le, geom_type = _wkb_endianness_and_geometry_type(
+        gpkg_geom, wkb_offset=wkb_offset
+    )
+    if geom_type % 1000 != GeometryType.POINT:
+        return None
+    x, y = struct.unpack_from(f"{_bo(wkb_is_le)}dd", gpkg_geom, wkb_offset + 5)
+    if math.isnan(x) or math.isnan(y):
+        return None
+    return x, y
+
+
 def gpkg_geom_to_ogr(gpkg_geom, parse_crs=False):
     """
     Parse GeoPackage geometry values to an OGR Geometry object
     http://www.geopackage.org/spec/#gpb_format
     """
+    ogr, osr = _ogr(), _osr()
+
     if gpkg_geom is None:
         return None
 
@@ -420,6 +466,8 @@ def gpkg_geom_to_ogr(gpkg_geom, parse_crs=False):
 
 def wkt_to_gpkg_geom(wkt, **kwargs):
     """Given a well-known-text string, returns a GPKG Geometry object."""
+    ogr = _ogr()
+
     if wkt is None:
         return None
 
@@ -429,6 +477,8 @@ def wkt_to_gpkg_geom(wkt, **kwargs):
 
 def wkb_to_gpkg_geom(wkb, **kwargs):
     """Given a well-known-binary bytestring, returns a GPKG Geometry object."""
+    ogr = _ogr()
+
     if wkb is None:
         return None
 
@@ -446,6 +496,8 @@ def hex_wkb_to_gpkg_geom(hex_wkb, **kwargs):
 
 
 def wkb_to_ogr(wkb):
+    ogr = _ogr()
+
     return ogr.CreateGeometryFromWkb(wkb)
 
 
@@ -465,6 +517,8 @@ WKB_POINT_EMPTY_LE = b"\x01\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\xF8\x7F\x00\
 
 
 def ogr_to_hex_wkb(ogr_geom):
+    ogr = _ogr()
+
     wkb = ogr_geom.ExportToIsoWkb(ogr.wkbNDR)
     return binascii.hexlify(wkb).decode("ascii").upper()
 
@@ -488,6 +542,8 @@ def ogr_to_gpkg_geom(
 
     Underscore-prefixed kwargs are for use by the tests, don't use them elsewhere.
     """
+    ogr = _ogr()
+
     if ogr_geom is None:
         return None
 
@@ -527,8 +583,129 @@ def ogr_to_gpkg_geom(
     return Geometry(header + envelope + wkb)
 
 
+class _UnsupportedWkb(ValueError):
+    pass
+
+
+def _wkb_coordinate_runs(wkb, offset, runs):
+    """
+    Finds the coordinates in the little-endian ISO WKB geometry at the given offset.
+    Appends a tuple (offset, num_points, dimensions, has_z) to runs for each sequence of points in the geometry,
+    and returns the offset at which the geometry ends.
+    Raises _UnsupportedWkb for anything other than the 7 basic geometry types.
+    """
+    if wkb[offset] != 1:
+        raise _UnsupportedWkb("Big-endian WKB")
+    (wkb_type,) = struct.unpack_from("<I", wkb, offset + 1)
+    geom_type, zm = wkb_type % 1000, wkb_type // 1000
+    if zm > 3 or not (
+        GeometryType.POINT <= geom_type <= GeometryType.GEOMETRYCOLLECTION
+    ):
+        raise _UnsupportedWkb(f"WKB geometry type {wkb_type}")
+    has_z = zm in (1, 3)
+    dims = 2 + has_z + (zm in (2, 3))
+    offset += 5
+
+    if geom_type == GeometryType.POINT:
+        runs.append((offset, 1, dims, has_z))
+        return offset + 8 * dims
+
+    (count,) = struct.unpack_from("<I", wkb, offset)
+    offset += 4
+    if geom_type == GeometryType.LINESTRING:
+        runs.append((offset, count, dims, has_z))
+        return offset + 8 * dims * count
+    if geom_type == GeometryType.POLYGON:
+        for i in range(count):
+            (num_points,) = struct.unpack_from("<I", wkb, offset)
+            offset += 4
+            runs.append((offset, num_points, dims, has_z))
+            offset += 8 * dims * num_points
+        return offset
+    # Multi-geometries and geometry collections.
+    for i in range(count):
+        offset = _wkb_coordinate_runs(wkb, offset, runs)
+    return offset
+
+
+def transform_gpkg_geoms(gpkg_geoms, transform):
+    """
+    Reprojects a batch of GPKG geometries using the given osr.CoordinateTransformation. The coordinates of all the
+    geometries are reprojected together by a single call to TransformPoints, and the results are written directly
+    into a copy of each geometry's WKB - which is much quicker than reprojecting each geometry individually via OGR.
+
+    Returns a list containing the reprojected version of each geometry (with no envelope) - or None in place of any
+    geometry that couldn't be reprojected this way (eg curved or empty geometries, or if the reprojection failed),
+    which the caller should reproject individually instead.
+    """
+    result = [None] * len(gpkg_geoms)
+    if sys.byteorder != "little":
+        return result
+
+    # The x, y and z coordinates of every point in the batch - z is zero for points that have no z.
+    xs, ys, zs = array("d"), array("d"), array("d")
+    # (index, wkb, runs, start, end) for each geometry that is being reprojected.
+    parsed = []
+    for i, gpkg_geom in enumerate(gpkg_geoms):
+        if gpkg_geom is None or gpkg_geom.is_empty():
+            continue
+        wkb_offset, is_le, crs_id = parse_gpkg_geom(gpkg_geom)
+        wkb = gpkg_geom[wkb_offset:]
+        runs = []
+        try:
+            if _wkb_coordinate_runs(wkb, 0, runs) != len(wkb):
+                continue
+        except (_UnsupportedWkb, struct.error, IndexError):
+            continue
+
+        start = len(xs)
+        for offset, num_points, dims, has_z in runs:
+            coords = array("d", wkb[offset : offset + 8 * dims * num_points])
+            xs.extend(coords[0::dims])
+            ys.extend(coords[1::dims])
+            if has_z:
+                zs.extend(coords[2::dims])
+            else:
+                zs.extend(array("d", bytes(8 * num_points)))
+        parsed.append((i, wkb, runs, start, len(xs)))
+
+    if not xs:
+        return result
+
+    try:
+        transformed = transform.TransformPoints(list(zip(xs, ys, zs)))
+    except RuntimeError:
+        return result
+    out_xs, out_ys, out_zs = (
+        array("d", c) for c in itertools.islice(zip(*transformed), 3)
+    )
+
+    header = struct.pack("<ccBBi", b"G", b"P", 0, _GPKG_LE_BIT, 0)
+    for i, wkb, runs, start, end in parsed:
+        if not math.isfinite(
+            sum(out_xs[start:end]) + sum(out_ys[start:end]) + sum(out_zs[start:end])
+        ):
+            # Some point couldn't be reprojected.
+            continue
+        out_wkb = bytearray(wkb)
+        pos = start
+        for offset, num_points, dims, has_z in runs:
+            end_offset = offset + 8 * dims * num_points
+            coords = array("d", out_wkb[offset:end_offset])
+            coords[0::dims] = out_xs[pos : pos + num_points]
+            coords[1::dims] = out_ys[pos : pos + num_points]
+            if has_z:
+                coords[2::dims] = out_zs[pos : pos + num_points]
+            out_wkb[offset:end_offset] = coords.tobytes()
+            pos += num_points
+        result[i] = Geometry(header + bytes(out_wkb))
+    return result
+
+
 def geojson_to_gpkg_geom(geojson, **kwargs):
     """Given a GEOJSON geometry, construct a GPKG geometry value."""
+    ogr = _ogr()
+
     if not isinstance(geojson, str):
         json_ogr = json.dumps(geojson)
 
@@ -1,3 +1,4 @@
+import html
 import json
 import string
 import sys
@@ -15,8 +16,22 @@ class HtmlDiffWriter(BaseDiffWriter):
     """
     Writes a file usually called DIFF.html (the default name), which contains both a GeoJSON viewer, and the diff itself
     in GeoJSON. Automatically opens the created file using webbrowser if the created file is not stdout.
+
+    The features are written to the file as a series of pages - one JSON <script> block per page of features,
+    followed by a manifest listing how many pages each dataset has - so the viewer only needs to render one page of
+    each dataset at a time. When diffing commits, the features are streamed (see StreamingDeltaDiff) since the pages
+    don't need to be in primary key order, so only one page is held in memory at a time. Working copy diffs still
+    have to be built up one dataset at a time.
     """
 
+    # The maximum number of features in each page - the old and new versions of an update always share a page,
+    # so a page can end up one feature longer than this.
+    PAGE_SIZE = 1000
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stream_features = not self.include_wc_diff
+
     @classmethod
     def _check_output_path(cls, repo, output_path):
         if isinstance(output_path, Path) and output_path.is_dir():
@@ -29,10 +44,7 @@ class HtmlDiffWriter(BaseDiffWriter):
         with open(
             Path(__file__).resolve().with_name("diff-view.html"), "r", encoding="utf8"
         ) as ft:
-            template = string.Template(ft.read())
-
-        repo_diff = self.get_repo_diff()
-        self.has_changes = bool(repo_diff)
+            template_head, template_tail = ft.read().split("${feature_pages}")
 
         if self.commit:
             commit_spec_desc = self.commit.short_id
@@ -41,27 +53,29 @@ class HtmlDiffWriter(BaseDiffWriter):
 
         title = f"{self.repo.workdir_path.stem}: {commit_spec_desc}"
 
-        all_datasets_geojson = {
-            ds_path: {
-                "type": "FeatureCollection",
-                "features": self.filtered_ds_feature_deltas_as_geojson(
-                    ds_path, ds_diff
-                ),
-            }
-            for ds_path, ds_diff in repo_diff.items()
-        }
-
         fo = resolve_output_path(self.output_path)
-        fo.write(
-            template.substitute(
-                {
-                    "title": title,
-                    "geojson_data": json.dumps(
-                        all_datasets_geojson, cls=ExtendedJsonEncoder
-                    ),
-                }
-            )
-        )
+        fo.write(string.Template(template_head).substitute(title=title))
+
+        self.has_changes = False
+        manifest = {"datasets": {}}
+        for ds_path in self.all_ds_paths:
+            ds_diff = self.get_dataset_diff(ds_path)
+            if not ds_diff:
+                continue
+            self.has_changes = True
+            features = self.filtered_ds_feature_deltas_as_geojson(ds_path, ds_diff)
+            num_pages = 0
+            for page in self._paginate(features):
+                self._write_script_block(
+                    fo,
+                    {"type": "FeatureCollection", "features": page},
+                    {"class": "kart-page", "data-dataset": ds_path},
+                )
+                num_pages += 1
+            manifest["datasets"][ds_path] = {"pages": num_pages}
+
+        self._write_script_block(fo, manifest, {"id": "kart-manifest"})
+        fo.write(string.Template(template_tail).substitute(title=title))
 
         if fo != sys.stdout:
             fo.close()
@@ -69,6 +83,28 @@ class HtmlDiffWriter(BaseDiffWriter):
 
         self.write_warnings_footer()
 
+    def _paginate(self, features):
+        """Groups the given GeoJSON features into lists of about PAGE_SIZE, without separating the halves of an update."""
+        page = []
+        for feature in features:
+            page.append(feature)
+            if len(page) >= self.PAGE_SIZE and not feature["id"].endswith(":U-"):
+                yield page
+                page = []
+        if page:
+            yield page
+
+    @classmethod
+    def _write_script_block(cls, fo, obj, attrs):
+        """Writes the given object as JSON inside a <script> element that the browser won't execute."""
+        attrs_html = "".join(
+            f' {name}="{html.escape(value)}"' for name, value in attrs.items()
+        )
+        # "<" can only appear inside JSON strings, where it can equally be written as "\u003c" - doing so means that
+        # nothing in the data (eg "</script>") can be mistaken for markup.
+        data = json.dumps(obj, cls=ExtendedJsonEncoder).replace("<", "\\u003c")
+        fo.write(f'<script type="application/json"{attrs_html}>{data}</script>\n')
+
 
 HtmlDiffWriter.filtered_ds_feature_deltas_as_geojson = (
     GeojsonDiffWriter.filtered_ds_feature_deltas_as_geojson
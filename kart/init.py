@@ -2,7 +2,6 @@ import os
 from pathlib import Path
 
 import click
-from osgeo import gdal
 
 from kart import is_windows
 
@@ -24,6 +23,8 @@ def list_import_formats(ctx):
     """
     List the supported import formats
     """
+    from osgeo import gdal
+
     click.echo("Geopackage: PATH.gpkg")
     click.echo("PostgreSQL: postgresql://HOST/DBNAME[/DBSCHEMA]")
     click.echo("SQL Server: mssql://HOST/DBNAME[/DBSCHEMA]")
@@ -31,6 +31,8 @@ class JsonDiffWriter(BaseDiffWriter):
     generated first, and then dumped. This means the diff can be slow to start - the situation is improved somewhat by
     the fact that Delta's can be lazily evaluated, so at least individual blobs needn't be read until each delta is output.
     JsonLinesDiffWriter is faster to start for multi-dataset repos since it generates diffs repo by repo.
+    With stream_features set, feature deltas aren't held in memory at all, so diffs of any size can be output in
+    bounded memory - but they are output in path order, rather than primary key order. See StreamingDeltaDiff.
 
     The basic diff structure is as follows - for meta items:
       {"kart.diff/v1+hexwkb": {dataset-path: {"meta": {meta-item-name: {"-/+": old/new-value}}}}}
@@ -58,8 +60,8 @@ class JsonDiffWriter(BaseDiffWriter):
             obj["kart.show/v1"] = commit_obj_to_json(self.commit)
 
     def write_diff(self):
-        # TODO - optimise - no need to generate the entire repo diff before starting output.
-        # (This is not quite as bad as it looks, since parts of the diff object are lazily generated.)
+        # The entire repo diff is generated before starting output, but this is not quite as bad as it looks,
+        # since parts of the diff object are lazily generated - or, with stream_features, not stored at all.
         repo_diff = self.get_repo_diff()
         self.has_changes = bool(repo_diff)
 
@@ -112,18 +114,15 @@ class JsonDiffWriter(BaseDiffWriter):
         if "feature" not in ds_diff:
             return
 
-        old_transform, new_transform = self.get_geometry_transforms(ds_path, ds_diff)
-        for key, delta in self.filtered_ds_feature_deltas(ds_path, ds_diff):
+        for key, delta in self.reprojected_ds_feature_deltas(ds_path, ds_diff):
             delta_as_json = {}
 
             if delta.old:
                 if self.patch_type == "full" or not delta.new:
-                    delta_as_json["-"] = feature_as_json(
-                        delta.old_value, delta.old_key, old_transform
-                    )
+                    delta_as_json["-"] = feature_as_json(delta.old_value, delta.old_key)
 
             if delta.new:
-                feature = feature_as_json(delta.new_value, delta.new_key, new_transform)
+                feature = feature_as_json(delta.new_value, delta.new_key)
                 if delta.old and self.patch_type == "minimal":
                     # mark feature updates using a different key, otherwise they can
                     # be easily confused with inserts, since minimal-style patches don't
@@ -305,18 +304,13 @@ class JsonLinesDiffWriter(BaseDiffWriter):
         if "feature" not in ds_diff:
             return
 
-        old_transform, new_transform = self.get_geometry_transforms(ds_path, ds_diff)
         obj = {"type": "feature", "dataset": ds_path, "change": None}
-        for key, delta in self.filtered_ds_feature_deltas(ds_path, ds_diff):
+        for key, delta in self.reprojected_ds_feature_deltas(ds_path, ds_diff):
             change = {}
             if delta.old:
-                change["-"] = feature_as_json(
-                    delta.old_value, delta.old_key, old_transform
-                )
+                change["-"] = feature_as_json(delta.old_value, delta.old_key)
             if delta.new:
-                change["+"] = feature_as_json(
-                    delta.new_value, delta.new_key, new_transform
-                )
+                change["+"] = feature_as_json(delta.new_value, delta.new_key)
             obj["change"] = change
             self.dump(obj)
 
@@ -429,24 +423,14 @@ class GeojsonDiffWriter(BaseDiffWriter):
         if "feature" not in ds_diff:
             return
 
-        old_transform, new_transform = self.get_geometry_transforms(ds_path, ds_diff)
-
-        for key, delta in self.filtered_ds_feature_deltas(ds_path, ds_diff):
+        for key, delta in self.reprojected_ds_feature_deltas(ds_path, ds_diff):
             if delta.old:
                 change_type = "U-" if delta.new else "D"
                 yield feature_as_geojson(
-                    delta.old_value,
-                    delta.old_key,
-                    ds_path,
-                    change_type,
-                    old_transform,
+                    delta.old_value, delta.old_key, ds_path, change_type
                 )
             if delta.new:
                 change_type = "U+" if delta.old else "I"
                 yield feature_as_geojson(
-                    delta.new_value,
-                    delta.new_key,
-                    ds_path,
-                    change_type,
-                    new_transform,
+                    delta.new_value, delta.new_key, ds_path, change_type
                 )
@@ -0,0 +1,113 @@
+import json
+import re
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# A number, true, false or null - anything up to the next delimiter.
+_SCALAR = re.compile(r"[^ \t\n\r,:\]\}]*")
+
+
+class JsonStreamReader:
+    """
+    Reads a JSON document from a text file incrementally, so that documents much larger than the available memory
+    can be processed. The caller navigates the structure of the document: iter_object_keys and iter_array step into
+    an object or an array, and read_value reads and decodes a single complete value (which must fit in memory).
+    Only the part of the document that is currently being decoded is held in memory.
+    """
+
+    CHUNK_SIZE = 1 << 16
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """Reads more of the file into the buffer. Returns False if there is nothing more to read."""
+        if self.eof:
+            return False
+        # Read at least as much as is already buffered, so that decoding a large value isn't quadratic.
+        chunk = self.fp.read(max(self.CHUNK_SIZE, len(self.buf) - self.pos))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        """Skips any whitespace, and returns the next character without consuming it - or "" at the end of file."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def _error(self, message):
+        return json.JSONDecodeError(message, self.buf, self.pos)
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise self._error(f"Expecting {char!r}")
+        self.pos += 1
+
+    def read_value(self):
+        """Reads and returns the next complete JSON value."""
+        if self._peek() not in ("{", "[", '"'):
+            # Numbers aren't self-delimiting - make sure we have the whole thing before decoding it.
+            while _SCALAR.match(self.buf, self.pos).end() == len(self.buf):
+                if not self._fill():
+                    break
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # Maybe the value continues past the end of the buffer.
+                if self._fill():
+                    continue
+                raise
+            self.pos = end
+            return value
+
+    def _end_of_item(self, close_char):
+        """Consumes the separator after an item. Returns True if it closed the object or array."""
+        char = self._peek()
+        if char == close_char:
+            self.pos += 1
+            return True
+        if char != ",":
+            raise self._error(f"Expecting ',' delimiter or {close_char!r}")
+        self.pos += 1
+        return False
+
+    def iter_object_keys(self):
+        """
+        Steps into the next value, which must be a JSON object, and yields its keys one at a time.
+        After each key is yielded, the caller must consume the corresponding value - using read_value,
+        iter_object_keys or iter_array - before the next key can be yielded.
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            if self._peek() != '"':
+                raise self._error("Expecting property name enclosed in double quotes")
+            key = self.read_value()
+            self._expect(":")
+            yield key
+            if self._end_of_item("}"):
+                return
+
+    def iter_array(self):
+        """Steps into the next value, which must be a JSON array, and yields each of its items, decoded."""
+        self._expect("[")
+        if self._peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.read_value()
+            if self._end_of_item("]"):
+                return
@@ -1,3 +1,4 @@
+import contextlib
 import re
 import subprocess
 import sys
@@ -9,6 +10,7 @@ import click
 import pygit2
 
 from . import diff_estimation
+from .dataset_tree_index import DatasetTreeIndex
 from .cli_util import (
     OutputFormatType,
     RemovalInKart012Warning,
@@ -406,26 +408,30 @@ def log(
             )
 
         commit_ids_and_refs_log = _parse_git_log_output(r.stdout.splitlines())
-        dataset_change_cache = {}
 
-        commit_log = (
-            commit_obj_to_json(
-                repo[commit_id],
-                repo,
-                refs,
-                dataset_changes,
-                dataset_change_cache,
-                with_feature_count,
+        with contextlib.ExitStack() as stack:
+            dataset_tree_index = None
+            if dataset_changes:
+                dataset_tree_index = stack.enter_context(DatasetTreeIndex(repo))
+
+            commit_log = (
+                commit_obj_to_json(
+                    repo[commit_id],
+                    repo,
+                    refs,
+                    dataset_changes,
+                    dataset_tree_index,
+                    with_feature_count,
+                )
+                for (commit_id, refs) in commit_ids_and_refs_log
             )
-            for (commit_id, refs) in commit_ids_and_refs_log
-        )
-        if output_type == "json-lines":
-            for item in commit_log:
-                # hardcoded style here; each item must be on one line.
-                dump_json_output(item, sys.stdout, "compact")
+            if output_type == "json-lines":
+                for item in commit_log:
+                    # hardcoded style here; each item must be on one line.
+                    dump_json_output(item, sys.stdout, "compact")
 
-        else:
-            dump_json_output(commit_log, sys.stdout, fmt)
+            else:
+                dump_json_output(commit_log, sys.stdout, fmt)
 
 
 def _parse_git_log_output(lines):
@@ -441,7 +447,7 @@ def commit_obj_to_json(
     repo=None,
     refs=None,
     dataset_changes=False,
-    dataset_change_cache={},
+    dataset_tree_index=None,
     with_feature_count=None,
 ):
     """Given a commit object, returns a dict ready for dumping as JSON."""
@@ -477,9 +483,12 @@ def commit_obj_to_json(
     if refs is not None:
         result["refs"] = refs
     if dataset_changes:
-        result["datasetChanges"] = get_dataset_changes(
-            repo, commit, dataset_change_cache
-        )
+        if dataset_tree_index is not None:
+            changes = dataset_tree_index.get_changed_datasets(commit)
+        else:
+            with DatasetTreeIndex(repo) as dataset_tree_index:
+                changes = dataset_tree_index.get_changed_datasets(commit)
+        result["datasetChanges"] = changes
     if with_feature_count:
         if (not dataset_changes) or result["datasetChanges"]:
             try:
@@ -499,38 +508,3 @@ def commit_obj_to_json(
         else:
             result["featureChanges"] = {}
     return result
-
-
-def get_dataset_changes(repo, commit, dataset_change_cache):
-    """Given a commit, returns a list of datasets changed by that commit."""
-    cur_datasets = _get_dataset_tree_ids(repo, commit, dataset_change_cache)
-    prev_datasets = None
-    try:
-        if not commit.parents:
-            return sorted(list(cur_datasets.keys()))
-
-        parent = commit.parents[0]
-        prev_datasets = _get_dataset_tree_ids(repo, parent, dataset_change_cache)
-        changes = prev_datasets.items() ^ cur_datasets.items()
-        return sorted(list(set(ds for ds, tree in changes)))
-
-    except KeyError:
-        return sorted(list(cur_datasets.keys()))
-
-
-def _get_dataset_tree_ids(repo, commit, dataset_change_cache):
-    """
-    Given a commit, returns a dict of dataset SHAs at that commit eg:
-    {
-        "nz_building_outlines": "8f7dbff287b9d40a772a1315c47e208124028645",
-        ...
-    }
-    """
-    commit_id = commit.id.hex
-    if commit_id not in dataset_change_cache:
-        result = {}
-        for dataset in repo.datasets(commit):
-            result[dataset.path] = dataset.tree.id.hex
-        dataset_change_cache[commit_id] = result
-
-    return dataset_change_cache[commit_id]
@@ -1,16 +1,25 @@
+import errno
 import shutil
 import subprocess
 import sys
 
 import click
+import pygit2
 
 from kart.cli_util import tool_environment
 from kart.exceptions import translate_subprocess_exit_code
-from .v1 import PointCloudV1
+from kart.lfs_util import get_local_path_from_lfs_hash
 
 # Handles point-cloud side of checkout.
 # Some of this may move at some point to be part of "filesystem" checkout which will also handle attachments.
 
+# Stores the ID of the tree that the point-cloud tiles in the working copy (and the worktree-index) were checked out
+# from, so that the next checkout only needs to write the tiles that are different.
+WORKTREE_TREE_FILE = "worktree-tree"
+
+# ioctl request number for FICLONE - see ioctl_ficlone(2).
+_FICLONE = 0x40049409
+
 
 def reset_wc_if_needed(repo):
     """Checks out point cloud tiles to working copy directory."""
@@ -18,61 +27,157 @@ def reset_wc_if_needed(repo):
         return
     assert repo.workdir_path.is_dir()
 
-    # TODO - checkout should check the existing worktree-index to do the following:
-    # - see what the <commit>...<commit> diffs are of the checkout operation we are doing
-    # - make sure they don't conflict with uncommitted WC diffs / make sure there are no WC diffs
-    # - apply the <commit>...<commit> diffs to the WC (instead of checking out from scratch)
-    # Right now we don't do any of this - we just write a new worktree and a new index over the top of the old one.
-    # Nothing is properly tidied up - files from the previous commit that was checked out will stay there unless
-    # they are replaced by the version of that file from the latest commit.
-
-    reset_index_paths = []
-    for dataset in repo.datasets():
-        if not isinstance(dataset, PointCloudV1):
-            continue
-
-        reset_index_paths.append(dataset.path)
-        wc_tiles_dir = repo.workdir_path / dataset.path / "tiles"
-        (wc_tiles_dir).mkdir(parents=True, exist_ok=True)
-
-        for tilename, lfs_path in dataset.tilenames_with_lfs_paths():
+    # TODO - checkout should make sure the <commit>...<commit> diffs don't conflict with uncommitted WC diffs /
+    # make sure there are no WC diffs. Right now uncommitted changes to tiles that are changed by the checkout
+    # are overwritten, and uncommitted changes to other tiles are left as they are.
+
+    base_tree = get_checked_out_tree(repo)
+    if base_tree is None:
+        # We don't know what is currently checked out - write every tile, and a new worktree-index from scratch.
+        base_tree = repo.empty_tree
+        worktree_index_file = repo.gitdir_file("worktree-index")
+        if worktree_index_file.exists():
+            worktree_index_file.unlink()
+
+    target_tree = repo.head_tree or repo.empty_tree
+    changed_wc_paths = []
+    all_tiles_written = True
+    for dataset, delta in _tile_deltas(repo, base_tree, target_tree):
+        if delta.old is not None:
+            wc_path = repo.workdir_file(dataset.tilename_to_wc_path(delta.old_key))
+            try:
+                wc_path.unlink()
+            except FileNotFoundError:
+                pass
+            changed_wc_paths.append(dataset.tilename_to_wc_path(delta.old_key))
+
+        if delta.new is not None:
+            tilename = delta.new_key
+            lfs_path = get_local_path_from_lfs_hash(repo, delta.new_value["oid"])
             if not lfs_path.is_file():
                 click.echo(
                     f"Couldn't find tile {tilename} locally - skipping...", err=True
                 )
+                all_tiles_written = False
                 continue
-            shutil.copy(lfs_path, wc_tiles_dir / tilename)
+            wc_path = repo.workdir_file(dataset.tilename_to_wc_path(tilename))
+            wc_path.parent.mkdir(parents=True, exist_ok=True)
+            _copy_tile(lfs_path, wc_path)
+            changed_wc_paths.append(dataset.tilename_to_wc_path(tilename))
 
-    # TODO - this marks everything inside these dataset folders as "clean" until the user makes an edit, which is then
-    # "dirty". Since we aren't tidying up the folders properly, there could actually be untracked files in them still.
-    # But it works well enough to show how diffing and committing works in principle - it just needs more work.
-    reset_worktree_index(repo, reset_index_paths)
+    update_worktree_index(repo, changed_wc_paths)
+    if all_tiles_written:
+        set_checked_out_tree(repo, target_tree)
+    else:
+        # Make sure the skipped tiles are written next time.
+        forget_checked_out_tree(repo)
 
 
-def reset_worktree_index(repo, reset_index_paths):
+def update_wc_after_commit(repo, old_tree, new_tree):
+    """
+    Updates the worktree-index after the changes made to tiles in the working copy have been committed -
+    the tiles themselves are already in place, so only the index entries for the changed tiles need updating.
     """
-    Creates a file <GIT-DIR>/worktree-index that is an index of that part of the contents of the workdir
-    that is contained within the given update_index_paths (which can be files or folders).
+    if repo.is_bare:
+        return
+    changed_wc_paths = []
+    for dataset, delta in _tile_deltas(repo, old_tree, new_tree):
+        if delta.old is not None:
+            changed_wc_paths.append(dataset.tilename_to_wc_path(delta.old_key))
+        if delta.new is not None:
+            changed_wc_paths.append(dataset.tilename_to_wc_path(delta.new_key))
+
+    update_worktree_index(repo, changed_wc_paths)
+    checked_out_tree = get_checked_out_tree(repo)
+    if checked_out_tree is not None and checked_out_tree.id == old_tree.id:
+        set_checked_out_tree(repo, new_tree)
+    else:
+        # The other tiles weren't known to be checked out from old_tree, so they aren't known to match new_tree.
+        forget_checked_out_tree(repo)
+
+
+def _tile_deltas(repo, base_tree, target_tree):
+    """Yields (dataset, delta) for every tile that differs between the point-cloud datasets of the two trees."""
+    base_datasets = repo.datasets(base_tree, filter_dataset_type="point-cloud")
+    target_datasets = repo.datasets(target_tree, filter_dataset_type="point-cloud")
+    ds_paths = {ds.path for ds in base_datasets} | {ds.path for ds in target_datasets}
+
+    for ds_path in sorted(ds_paths):
+        base_ds = base_datasets.get(ds_path)
+        target_ds = target_datasets.get(ds_path)
+        if base_ds is not None:
+            deltas = base_ds.diff_tile(target_ds)
+        else:
+            deltas = target_ds.diff_tile(None, reverse=True)
+        for delta in deltas:
+            yield target_ds or base_ds, delta
+
+
+def _copy_tile(lfs_path, wc_path):
+    """
+    Copies the given tile from the LFS object store into the working copy - as a reflink where the filesystem allows,
+    so that no data is actually copied unless the tile is edited.
     """
-    worktree_index_file = repo.gitdir_file("worktree-index")
+    try:
+        _reflink(lfs_path, wc_path)
+    except OSError:
+        shutil.copy(lfs_path, wc_path)
 
-    # NOTE - we could also use pygit2.Index to do this, but this has been easier to get working so far.
-    env = tool_environment()
-    env["GIT_INDEX_FILE"] = str(worktree_index_file)
 
-    # TODO - this may be inefficient - it might be possible to reuse some or all of the existing index,
-    # rather than regenerating it from scratch.
-    if worktree_index_file.exists():
-        worktree_index_file.unlink()
+def _reflink(src_path, dest_path):
+    if not sys.platform.startswith("linux"):
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform")
+
+    import fcntl
+
+    with open(src_path, "rb") as src, open(dest_path, "wb") as dest:
+        fcntl.ioctl(dest.fileno(), _FICLONE, src.fileno())
 
-    for path in reset_index_paths:
-        try:
-            args = ["git", "add", path]
-            subprocess.check_call(
-                args, env=env, cwd=repo.workdir_path, stdout=subprocess.DEVNULL
-            )
-        except subprocess.CalledProcessError as e:
-            sys.exit(translate_subprocess_exit_code(e.returncode))
+
+def get_checked_out_tree(repo):
+    """Returns the tree that the point-cloud tiles in the working copy were checked out from, or None if not known."""
+    tree_file = repo.gitdir_file(WORKTREE_TREE_FILE)
+    if not tree_file.exists():
+        return None
+    try:
+        return repo[tree_file.read_text(encoding="utf-8").strip()].peel(pygit2.Tree)
+    except (KeyError, ValueError):
+        return None
+
+
+def set_checked_out_tree(repo, tree):
+    repo.write_gitdir_file(WORKTREE_TREE_FILE, tree.hex)
+
+
+def forget_checked_out_tree(repo):
+    tree_file = repo.gitdir_file(WORKTREE_TREE_FILE)
+    if tree_file.exists():
+        tree_file.unlink()
+
+
+def update_worktree_index(repo, wc_paths):
+    """
+    Updates the entries in <GIT-DIR>/worktree-index for the given paths in the workdir - paths that exist in the
+    workdir are added or updated, and paths that don't are removed. The rest of the index is left as it is.
+    """
+    if not wc_paths:
+        return
+
+    env = tool_environment()
+    env["GIT_INDEX_FILE"] = str(repo.gitdir_file("worktree-index"))
+
+    try:
+        args = ["git", "update-index", "--add", "--remove", "-z", "--stdin"]
+        subprocess.run(
+            args,
+            input="".join(f"{path}\0" for path in wc_paths).encode("utf-8"),
+            env=env,
+            cwd=repo.workdir_path,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+    except subprocess.CalledProcessError as e:
+        sys.exit(translate_subprocess_exit_code(e.returncode))
 
 
 @click.command("point-cloud-checkout", hidden=True)
@@ -82,8 +187,8 @@ def point_cloud_checkout(ctx):
     Basic checkout operation for point-clouds - can only checkout any-and-all point-cloud datasets at HEAD,
     as folders full of tiles.
 
-    Not made for switching branch, and doesn't do any tidying up - automatically removing these tiles
-    during a checkout, reset, or restore operation is not yet supported.
+    Only the tiles that differ from the ones that were last checked out are written - uncommitted changes to
+    those tiles are overwritten.
     """
     repo = ctx.obj.repo
     reset_wc_if_needed(repo)
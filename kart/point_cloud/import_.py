@@ -1,9 +1,14 @@
+import contextlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 import json
+import multiprocessing
 import os
 from pathlib import Path
 import uuid
 import subprocess
 import sys
+import time
 
 import click
 
@@ -48,18 +53,28 @@ from kart.tabular.version import (
 @click.option(
     "--dataset-path", "ds_path", help="The dataset's path once imported", required=True
 )
+@click.option(
+    "--num-workers",
+    type=click.INT,
+    help="How many tiles to read or convert in parallel. Defaults to the number of available CPU cores.",
+)
 @click.argument("sources", metavar="SOURCES", nargs=-1, required=True)
-def point_cloud_import(ctx, convert_to_copc, ds_path, sources):
+def point_cloud_import(ctx, convert_to_copc, ds_path, num_workers, sources):
     """
     Experimental command for importing point cloud datasets. Work-in-progress.
     Will eventually be merged with the main `import` command.
 
     SOURCES should be one or more LAZ or LAS files (or wildcards that match multiple LAZ or LAS files).
     """
-    import pdal
+    from kart.fast_import import get_default_num_processes
 
     repo = ctx.obj.repo
 
+    if num_workers is None:
+        num_workers = get_default_num_processes()
+    # Small imports are done in this process - there's no point starting more workers than there are tiles.
+    num_workers = min(num_workers, len(sources))
+
     # TODO - improve path validation to make sure datasets of any type don't collide with each other
     # or with attachments.
     validate_dataset_paths([ds_path])
@@ -80,75 +95,60 @@ def point_cloud_import(ctx, convert_to_copc, ds_path, sources):
 
     per_source_info = {}
 
-    for source in sources:
-        click.echo(f"Checking {source}...          \r", nl=False)
-        config = [
-            {
-                "type": "readers.las",
-                "filename": source,
-                "count": 0,  # Don't read any individual points.
+    probe_args = ((source, i == 0) for i, source in enumerate(sources))
+    with contextlib.closing(
+        _map_in_order(_probe_tile, probe_args, num_workers)
+    ) as all_metadata:
+        for source, metadata in zip(sources, all_metadata):
+            click.echo(f"Checking {source}...          \r", nl=False)
+
+            info = metadata["readers.las"]
+
+            compressed_set.add(info["compressed"])
+            if len(compressed_set) > 1:
+                raise _non_homogenous_error("filetype", "LAS vs LAZ")
+
+            version = f"{info['major_version']}.{info['minor_version']}"
+            version_set.add(version)
+            if len(version_set) > 1:
+                raise _non_homogenous_error("version", version_set)
+
+            copc_version_set.add(get_copc_version(info))
+            if len(copc_version_set) > 1:
+                raise _non_homogenous_error("COPC version", copc_version_set)
+
+            pdrf_set.add(info["dataformat_id"])
+            if len(pdrf_set) > 1:
+                raise _non_homogenous_error("Point Data Record Format", pdrf_set)
+
+            pdr_length_set.add(info["point_length"])
+            if len(pdr_length_set) > 1:
+                raise _non_homogenous_error("Point Data Record Length", pdr_length_set)
+
+            crs_set.add(info["srs"]["wkt"])
+            if len(crs_set) > 1:
+                raise _non_homogenous_error(
+                    "CRS",
+                    "\n vs \n".join(
+                        (format_wkt_for_output(wkt, sys.stderr) for wkt in crs_set)
+                    ),
+                )
+
+            if transform is None:
+                transform = _make_transform_to_crs84(crs_set.only())
+
+            native_envelope = get_native_envelope(info)
+            crs84_envelope = _transform_3d_envelope(transform, native_envelope)
+            per_source_info[source] = {
+                "count": info["count"],
+                "native_envelope": native_envelope,
+                "crs84_envelope": crs84_envelope,
             }
-        ]
-        if schema is None:
-            config.append({"type": "filters.info"})
-
-        pipeline = pdal.Pipeline(json.dumps(config))
-        try:
-            pipeline.execute()
-        except RuntimeError:
-            raise InvalidOperation(
-                f"Error reading {source}", exit_code=INVALID_FILE_FORMAT
-            )
-
-        metadata = _unwrap_metadata(pipeline.metadata)
-
-        info = metadata["readers.las"]
-
-        compressed_set.add(info["compressed"])
-        if len(compressed_set) > 1:
-            raise _non_homogenous_error("filetype", "LAS vs LAZ")
 
-        version = f"{info['major_version']}.{info['minor_version']}"
-        version_set.add(version)
-        if len(version_set) > 1:
-            raise _non_homogenous_error("version", version_set)
-
-        copc_version_set.add(get_copc_version(info))
-        if len(copc_version_set) > 1:
-            raise _non_homogenous_error("COPC version", copc_version_set)
-
-        pdrf_set.add(info["dataformat_id"])
-        if len(pdrf_set) > 1:
-            raise _non_homogenous_error("Point Data Record Format", pdrf_set)
-
-        pdr_length_set.add(info["point_length"])
-        if len(pdr_length_set) > 1:
-            raise _non_homogenous_error("Point Data Record Length", pdr_length_set)
-
-        crs_set.add(info["srs"]["wkt"])
-        if len(crs_set) > 1:
-            raise _non_homogenous_error(
-                "CRS",
-                "\n vs \n".join(
-                    (format_wkt_for_output(wkt, sys.stderr) for wkt in crs_set)
-                ),
-            )
-
-        if transform is None:
-            transform = _make_transform_to_crs84(crs_set.only())
-
-        native_envelope = get_native_envelope(info)
-        crs84_envelope = _transform_3d_envelope(transform, native_envelope)
-        per_source_info[source] = {
-            "count": info["count"],
-            "native_envelope": native_envelope,
-            "crs84_envelope": crs84_envelope,
-        }
-
-        if schema is None:
-            crs_name = get_identifier_str(crs_set.only())
-            schema = metadata["filters.info"]["schema"]
-            schema["CRS"] = crs_name
+            if schema is None:
+                crs_name = get_identifier_str(crs_set.only())
+                schema = metadata["filters.info"]["schema"]
+                schema["CRS"] = crs_name
 
     click.echo()
 
@@ -214,33 +214,59 @@ def point_cloud_import(ctx, convert_to_copc, ds_path, sources):
         for i, blob_path in write_blobs_to_stream(proc.stdin, extra_blobs):
             pass
 
-        for source in sources:
-            click.echo(f"Importing {source}...")
-
-            tmp_object_path = lfs_tmp_path / str(uuid.uuid4())
-            oid, size = import_func(source, tmp_object_path)
-            actual_object_path = get_local_path_from_lfs_hash(repo, oid)
-            actual_object_path.parents[0].mkdir(parents=True, exist_ok=True)
-            tmp_object_path.rename(actual_object_path)
-
-            # TODO - is this the right prefix and name?
-            tilename = os.path.splitext(os.path.basename(source))[0] + import_ext
-            tile_prefix = hexhash(tilename)[0:2]
-            blob_path = f"{ds_inner_path}/tile/{tile_prefix}/{tilename}"
-            info = per_source_info[source]
-            pointer_dict = {
-                "version": "https://git-lfs.github.com/spec/v1",
-                # TODO - available.<URL-IDX> <URL>
-                "kart.extent.crs84": _format_array(info["crs84_envelope"]),
-                "kart.extent.native": _format_array(info["native_envelope"]),
-                "kart.format": kart_format,
-                "kart.pc.count": info["count"],
-                "oid": f"sha256:{oid}",
-                "size": size,
-            }
-            write_blob_to_stream(
-                proc.stdin, blob_path, dict_to_pointer_file_bytes(pointer_dict)
-            )
+        # The tiles are converted and hashed in parallel, but written to the stream in the order they were given,
+        # so that the same import always produces the same stream.
+        tmp_object_paths = [lfs_tmp_path / str(uuid.uuid4()) for source in sources]
+        import_args = (
+            (source, tmp_object_path)
+            for source, tmp_object_path in zip(sources, tmp_object_paths)
+        )
+        # Throughput is measured in bytes actually converted and hashed - ie, the size of each imported tile.
+        start_time = time.monotonic()
+        total_size = 0
+        with contextlib.closing(
+            _map_in_order(import_func, import_args, num_workers)
+        ) as results:
+            for i, (source, tmp_object_path, (oid, size)) in enumerate(
+                zip(sources, tmp_object_paths, results), 1
+            ):
+                total_size += size
+                throughput = _format_throughput(
+                    i, total_size, time.monotonic() - start_time
+                )
+                click.echo(
+                    f"Importing {source}... ({i} of {len(sources)}, {throughput})"
+                )
+
+                actual_object_path = get_local_path_from_lfs_hash(repo, oid)
+                actual_object_path.parents[0].mkdir(parents=True, exist_ok=True)
+                tmp_object_path.rename(actual_object_path)
+
+                # TODO - is this the right prefix and name?
+                tilename = os.path.splitext(os.path.basename(source))[0] + import_ext
+                tile_prefix = hexhash(tilename)[0:2]
+                blob_path = f"{ds_inner_path}/tile/{tile_prefix}/{tilename}"
+                info = per_source_info[source]
+                pointer_dict = {
+                    "version": "https://git-lfs.github.com/spec/v1",
+                    # TODO - available.<URL-IDX> <URL>
+                    "kart.extent.crs84": _format_array(info["crs84_envelope"]),
+                    "kart.extent.native": _format_array(info["native_envelope"]),
+                    "kart.format": kart_format,
+                    "kart.pc.count": info["count"],
+                    "oid": f"sha256:{oid}",
+                    "size": size,
+                }
+                write_blob_to_stream(
+                    proc.stdin, blob_path, dict_to_pointer_file_bytes(pointer_dict)
+                )
+
+        elapsed = time.monotonic() - start_time
+        throughput = _format_throughput(len(sources), total_size, elapsed)
+        click.echo(
+            f"Imported {len(sources)} tiles ({total_size / 2**20:.1f} MB) in {elapsed:.1f}s "
+            f"({throughput})"
+        )
 
         write_blob_to_stream(
             proc.stdin, f"{ds_inner_path}/meta/schema.json", json_pack(schema)
@@ -255,6 +281,66 @@ def point_cloud_import(ctx, convert_to_copc, ds_path, sources):
     reset_wc_if_needed(repo)
 
 
+def _format_throughput(num_tiles, num_bytes, elapsed):
+    elapsed = max(elapsed, 0.001)
+    return f"{num_tiles / elapsed:.1f} tiles/s, {num_bytes / 2**20 / elapsed:.1f} MB/s"
+
+
+def _map_in_order(func, args_iter, num_workers):
+    """
+    Yields func(*args) for each args in args_iter, in the same order as args_iter.
+    If num_workers is more than 1, the calls are made in a pool of that many worker processes, with no more than
+    2 * num_workers calls queued at once - otherwise they are simply made in this process.
+    """
+    if num_workers <= 1:
+        for args in args_iter:
+            yield func(*args)
+        return
+
+    with ProcessPoolExecutor(
+        num_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        pending = deque()
+        try:
+            for args in args_iter:
+                pending.append(executor.submit(func, *args))
+                if len(pending) >= num_workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def _probe_tile(source, with_schema):
+    """
+    Reads the header of the given LAS / LAZ file, without reading any points - and the full schema too, if with_schema
+    is set. Returns the PDAL metadata.
+    """
+    import pdal
+
+    config = [
+        {
+            "type": "readers.las",
+            "filename": source,
+            "count": 0,  # Don't read any individual points.
+        }
+    ]
+    if with_schema:
+        config.append({"type": "filters.info"})
+
+    pipeline = pdal.Pipeline(json.dumps(config))
+    try:
+        pipeline.execute()
+    except RuntimeError:
+        raise InvalidOperation(
+            f"Error reading {source}", exit_code=INVALID_FILE_FORMAT
+        )
+
+    return _unwrap_metadata(pipeline.metadata)
+
+
 def _unwrap_metadata(metadata):
     if isinstance(metadata, str):
         metadata = json.loads(metadata)
@@ -94,7 +94,13 @@ class PointCloudV1(BaseDataset):
         oid, size = get_hash_and_size_of_file(wc_path)
         return {"name": wc_path.name, "oid": f"sha256:{oid}", "size": size}
 
-    def diff(self, other, ds_filter=DatasetKeyFilter.MATCH_ALL, reverse=False):
+    def diff(
+        self,
+        other,
+        ds_filter=DatasetKeyFilter.MATCH_ALL,
+        reverse=False,
+        stream_features=False,
+    ):
         """
         Generates a Diff from self -> other.
         If reverse is true, generates a diff from other -> self.
@@ -1,4 +1,5 @@
 import subprocess
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from contextlib import contextmanager
 from enum import IntEnum
 
@@ -142,7 +143,110 @@ def fetch_promised_blobs_process(repo):
     fetch_proc.finish()
 
 
-def fetch_promised_blobs(repo, promised_blob_ids):
+def _fetch_promised_blob_batch(repo, promised_blob_ids):
     with fetch_promised_blobs_process(repo) as p:
         for promised_blob_id in promised_blob_ids:
             p.fetch(promised_blob_id)
+    return promised_blob_ids
+
+
+class PromisedBlobFetcher:
+    """
+    Fetches requested blobs from the promisor remote. Requests are deduplicated and batched, and each batch is
+    fetched by its own git fetch process, with up to num_workers of these running at once. Fetching happens in the
+    background, so the caller can keep doing other work - poll and wait_for_any report which blobs have arrived.
+    Finally, call finish to fetch any remaining blobs and block until they have all arrived.
+    """
+
+    # How many blobs are fetched by each git fetch process.
+    BATCH_SIZE = 1000
+    # How many git fetch processes can run at once.
+    NUM_WORKERS = 4
+
+    def __init__(self, repo, num_workers=None):
+        self.repo = repo
+        # Fail early if there's nowhere to fetch from.
+        get_promisor_remote(repo)
+        self.num_workers = num_workers or self.NUM_WORKERS
+        self.requested = set()
+        self.fetched = set()
+        self.batch = []
+        self.pending = set()
+        self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.finish()
+        else:
+            self.close()
+
+    def fetch(self, promised_blob_id):
+        """Requests that the given blob is fetched. Blobs that have already been requested are ignored."""
+        if promised_blob_id in self.requested:
+            return
+        self.requested.add(promised_blob_id)
+        self.batch.append(promised_blob_id)
+        if len(self.batch) >= self.BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """Starts fetching the blobs that have been requested so far, even if there aren't a full batch of them."""
+        if not self.batch:
+            return
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.num_workers)
+        self.pending.add(
+            self.executor.submit(_fetch_promised_blob_batch, self.repo, self.batch)
+        )
+        self.batch = []
+
+    @property
+    def is_fetching(self):
+        return bool(self.batch or self.pending)
+
+    def poll(self):
+        """Returns the IDs of any blobs that have arrived since last checked, without blocking."""
+        return self._collect(timeout=0)
+
+    def wait_for_any(self):
+        """
+        Blocks until at least one more batch of blobs has arrived, and returns their IDs -
+        or returns an empty list if there is nothing left to fetch.
+        """
+        self.flush()
+        return self._collect(timeout=None)
+
+    def _collect(self, timeout):
+        if not self.pending:
+            return []
+        done, self.pending = wait(
+            self.pending, timeout=timeout, return_when=FIRST_COMPLETED
+        )
+        result = []
+        for future in done:
+            # Raises SubprocessError if the fetch failed.
+            result.extend(future.result())
+        self.fetched.update(result)
+        return result
+
+    def finish(self):
+        """Blocks until all the requested blobs have been fetched."""
+        try:
+            while self.is_fetching:
+                self.wait_for_any()
+        finally:
+            self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+
+def fetch_promised_blobs(repo, promised_blob_ids):
+    with PromisedBlobFetcher(repo) as fetcher:
+        for promised_blob_id in promised_blob_ids:
+            fetcher.fetch(promised_blob_id)
@@ -25,7 +25,8 @@ def query(ctx, path, command, params):
     Find features in a Dataset
 
     WARNING: Spatial indexing is a proof of concept.
-    Significantly, indexes don't update when the repo changes in any way.
+    Each dataset's index is kept in the gitdir, and is brought up to date with HEAD whenever it is queried -
+    by applying the feature changes since the indexed revision, rather than by rebuilding it.
     """
     repo = ctx.obj.repo
     dataset = repo.datasets()[path]
@@ -34,15 +35,13 @@ def query(ctx, path, command, params):
         USAGE = "index"
 
         t0 = time.monotonic()
-        dataset.build_spatial_index(dataset.table_name)
+        dataset.update_spatial_index()
         t1 = time.monotonic()
-        L.debug("Indexed {dataset} in %0.3fs", t1 - t0)
+        L.debug("Indexed %s in %0.3fs", dataset.path, t1 - t0)
         return
 
-    try:
-        dataset.get_spatial_index(dataset.table_name)
-    except OSError:
-        raise NotFound("No spatial index found. Run `kart query {path} index`")
+    if not dataset.update_spatial_index(create=False):
+        raise NotFound(f"No spatial index found. Run `kart query {path} index`")
 
     if command == "get":
         USAGE = "get PK"
@@ -66,7 +65,7 @@ def query(ctx, path, command, params):
         if len(coordinates) not in (2, 4):
             raise click.BadParameter(USAGE)
 
-        index = dataset.get_spatial_index(path)
+        index = dataset.get_spatial_index()
         t0 = time.monotonic()
         results = [dataset.get_feature(pk) for pk in index.nearest(coordinates, limit)]
         t1 = time.monotonic()
@@ -80,7 +79,7 @@ def query(ctx, path, command, params):
         if len(coordinates) != 4:
             raise click.BadParameter(USAGE)
 
-        index = dataset.get_spatial_index(path)
+        index = dataset.get_spatial_index()
         t0 = time.monotonic()
         results = [dataset.get_feature(pk) for pk in index.intersection(coordinates)]
         t1 = time.monotonic()
@@ -94,7 +93,7 @@ def query(ctx, path, command, params):
         if len(coordinates) != 4:
             raise click.BadParameter(USAGE)
 
-        index = dataset.get_spatial_index(path)
+        index = dataset.get_spatial_index()
         t0 = time.monotonic()
         results = index.count(coordinates)
         t1 = time.monotonic()
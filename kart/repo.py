@@ -50,6 +50,7 @@ class KartRepoFiles:
     MERGE_INDEX = "MERGE_INDEX"
     MERGE_BRANCH = "MERGE_BRANCH"
     FEATURE_ENVELOPES = "feature_envelopes.db"
+    DATASET_TREES = "dataset_trees.db"
 
 
 class KartRepoState(Enum):
@@ -86,6 +87,11 @@ class KartConfigKeys:
 
     KART_WORKINGCOPY_LOCATION = "kart.workingcopy.location"
     SNO_WORKINGCOPY_PATH = "sno.workingcopy.path"
+    # How many datasets can be written to the working copy at once - see BaseWorkingCopy.write_full.
+    KART_WORKINGCOPY_NUMWORKERS = "kart.workingcopy.numworkers"
+
+    # Whether dataset diffs go through the TreeDiffCache - see DatasetDiffMixin.get_raw_diff_for_subtree.
+    KART_DIFF_TREEDIFFCACHE = "kart.diff.treediffcache"
 
     KART_SPATIALFILTER_GEOMETRY = "kart.spatialfilter.geometry"
     KART_SPATIALFILTER_CRS = "kart.spatialfilter.crs"
@@ -406,6 +412,31 @@ class KartRepo(pygit2.Repository):
 
         return DiffAnnotations(self)
 
+    @property
+    @lru_cache(maxsize=1)
+    def tree_diff_cache(self):
+        # TreeDiffCache is slow to import - don't move this to the top of this file.
+        from .annotations import TreeDiffCache
+
+        return TreeDiffCache(self)
+
+    @property
+    def use_tree_diff_cache(self):
+        """
+        True if subtree diffs should be cached in annotations.db. Off unless configured, since caching only pays off
+        when the same subtrees are diffed over and over again - eg when diffing many commits in turn.
+        """
+        key = KartConfigKeys.KART_DIFF_TREEDIFFCACHE
+        return self.config.get_bool(key) if key in self.config else False
+
+    @property
+    @lru_cache(maxsize=1)
+    def tree_blob_counts(self):
+        # TreeBlobCounts is slow to import - don't move this to the top of this file.
+        from .annotations import TreeBlobCounts
+
+        return TreeBlobCounts(self)
+
     def write_config(
         self,
         wc_location=None,
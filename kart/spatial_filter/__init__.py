@@ -16,7 +16,7 @@ from kart.exceptions import (
     NotFound,
     NotYetImplemented,
 )
-from kart.geometry import GeometryType, geometry_from_string
+from kart.geometry import GeometryType, geometry_from_string, gpkg_point_xy
 from kart.output_util import dump_json_output
 from kart.promisor_utils import object_is_promised
 from kart.repo import KartRepoState
@@ -128,12 +128,17 @@ def resolve(ctx, reference, do_envelope, output_format):
     hidden=True,
     help="Don't do any indexing, instead just calculate the envelope for this feature / encode or decode this envelope.",
 )
+@click.option(
+    "--num-processes",
+    type=click.INT,
+    help="How many worker processes to use. Defaults to the number of available CPU cores.",
+)
 @click.argument(
     "commits",
     nargs=-1,
 )
 @click.pass_context
-def index(ctx, clear_existing, dry_run, debug, commits):
+def index(ctx, clear_existing, dry_run, debug, num_processes, commits):
     """
     Maintains the index needed to perform a spatially-filtered clone using this repo as the server.
     Indexes all features added by the supplied commits and their ancestors.
@@ -163,6 +168,7 @@ def index(ctx, clear_existing, dry_run, debug, commits):
         verbosity=ctx.obj.verbosity + 1,
         clear_existing=clear_existing,
         dry_run=dry_run,
+        num_processes=num_processes,
     )
 
 
@@ -537,12 +543,21 @@ class SpatialFilter:
             self.filter_ogr = None
             self.filter_prep = None
             self.filter_env = None
+            self.filter_polygons = None
+            self.filter_is_envelope = False
             self.geom_column_name = None
         else:
             self.crs = crs
             self.filter_ogr = filter_geometry_ogr
             self.filter_prep = filter_geometry_ogr.CreatePreparedGeometry()
             self.filter_env = self.filter_ogr.GetEnvelope()
+            # The filter's polygons as lists of rings of (x, y) coordinates, so that points can be tested against
+            # them without using OGR - or None if the filter isn't made of simple polygons.
+            self.filter_polygons = _polygons_as_rings(filter_geometry_ogr)
+            # If the filter is just a rectangle, any geometry that is inside its envelope is inside the filter.
+            self.filter_is_envelope = _is_envelope(
+                self.filter_polygons, self.filter_env
+            )
             self.geom_column_name = geom_column_name
 
     def matches(self, feature):
@@ -564,6 +579,12 @@ class SpatialFilter:
         if feature_geometry is None:
             return MatchResult.MATCHING
 
+        # Fast path - points can be tested using their coordinates alone.
+        if self.filter_polygons is not None:
+            point = gpkg_point_xy(feature_geometry)
+            if point is not None:
+                return self._matches_point(*point)
+
         err = None
         feature_env = None
         feature_ogr = None
@@ -584,6 +605,11 @@ class SpatialFilter:
                 if not bbox_intersects_fast(self.filter_env, feature_env):
                     # Geometries definitely don't intersect if envelopes don't intersect.
                     return MatchResult.NON_MATCHING
+                if self.filter_is_envelope and bbox_contains(
+                    self.filter_env, feature_env
+                ):
+                    # Geometries definitely intersect if the feature is inside a rectangular filter.
+                    return MatchResult.MATCHING
             except Exception as e:
                 raise
                 L.warn(e)
@@ -603,6 +629,16 @@ class SpatialFilter:
         click.echo(f"Error applying spatial filter to geometry:\n{err}", err=True)
         return MatchResult.MATCHING
 
+    def _matches_point(self, x, y):
+        # This treats points on the edge of the filter's envelope as outside it, same as bbox_intersects_fast does.
+        if not bbox_intersects_fast(self.filter_env, (x, x, y, y)):
+            return MatchResult.NON_MATCHING
+        if self.filter_is_envelope or any(
+            _point_in_polygon(x, y, rings) for rings in self.filter_polygons
+        ):
+            return MatchResult.MATCHING
+        return MatchResult.NON_MATCHING
+
     def matches_delta_value(self, delta_key_value):
         # Returns a MatchResult describing whether the feature contained by the given Delta KeyValue matches this
         # spatial filter. The feature may need to be lazily loaded, or it may turn out not to be present in this repo,
@@ -746,3 +782,71 @@ def bbox_intersects_fast(a, b):
     return _range_overlaps((a[0], a[1]), (b[0], b[1])) and _range_overlaps(
         (a[2], a[3]), (b[2], b[3])
     )
+
+
+def bbox_contains(a, b):
+    """
+    Given two bounding boxes in the form (min-x, max-x, min-y, max-y) - returns True if a contains b.
+    """
+    return a[0] <= b[0] and b[1] <= a[1] and a[2] <= b[2] and b[3] <= a[3]
+
+
+def _polygons_as_rings(geometry_ogr):
+    """
+    Given an OGR polygon or multipolygon, returns a list of polygons, where each polygon is a list of closed rings
+    (exterior ring first, then any holes), and each ring is a list of (x, y) tuples.
+    Returns None if the geometry is any other type.
+    """
+    from osgeo import ogr
+
+    geom_type = ogr.GT_Flatten(geometry_ogr.GetGeometryType())
+    if geom_type == ogr.wkbPolygon:
+        polygons = [geometry_ogr]
+    elif geom_type == ogr.wkbMultiPolygon:
+        polygons = [
+            geometry_ogr.GetGeometryRef(i)
+            for i in range(geometry_ogr.GetGeometryCount())
+        ]
+    else:
+        return None
+
+    result = []
+    for polygon in polygons:
+        rings = []
+        for i in range(polygon.GetGeometryCount()):
+            ring = [p[:2] for p in polygon.GetGeometryRef(i).GetPoints() or []]
+            if ring and ring[0] != ring[-1]:
+                ring.append(ring[0])
+            rings.append(ring)
+        result.append(rings)
+    return result
+
+
+def _is_envelope(polygons, envelope):
+    """Returns True if the given polygons (as returned by _polygons_as_rings) are exactly the given envelope."""
+    if not polygons or len(polygons) != 1 or len(polygons[0]) != 1:
+        return False
+    ring = polygons[0][0]
+    min_x, max_x, min_y, max_y = envelope
+    corners = {(min_x, min_y), (min_x, max_y), (max_x, max_y), (max_x, min_y)}
+    return len(ring) == 5 and set(ring) == corners
+
+
+def _point_in_polygon(x, y, rings):
+    """
+    Returns True if the point (x, y) is inside or on the boundary of the polygon made of the given rings
+    (as returned by _polygons_as_rings) - which is what an OGR Intersects test would return.
+    """
+    inside = False
+    for ring in rings:
+        for (x1, y1), (x2, y2) in zip(ring, ring[1:]):
+            if (
+                (x2 - x1) * (y - y1) == (x - x1) * (y2 - y1)
+                and min(x1, x2) <= x <= max(x1, x2)
+                and min(y1, y2) <= y <= max(y1, y2)
+            ):
+                # On the boundary.
+                return True
+            if (y1 > y) != (y2 > y) and x < x1 + (x2 - x1) * (y - y1) / (y2 - y1):
+                inside = not inside
+    return inside
@@ -1,10 +1,14 @@
+import contextlib
 import functools
 import logging
 import math
+import multiprocessing
 import re
 import subprocess
 import sys
 import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 import click
 import pygit2
@@ -20,6 +24,7 @@ from kart.serialise_util import msg_unpack
 from kart.sqlalchemy import TableSet
 from kart.sqlalchemy.sqlite import sqlite_engine
 from kart.structs import CommitWithReference
+from kart.utils import chunk
 from sqlalchemy import Column, Table
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.types import BLOB
@@ -43,8 +48,33 @@ def flush_bulk_warns(self):
             self.bulk_warns[message] = -occurrences
 
 
+def take_bulk_warns(self):
+    """
+    Removes and returns the buffered_bulk_warn messages that haven't yet been output, as a dict of
+    {message: (occurrences, sample)} - so that they can be sent from a worker process to the main process.
+    """
+    result = {
+        message: (occurrences, self.bulk_warn_samples[message])
+        for message, occurrences in self.bulk_warns.items()
+        if occurrences > 0
+    }
+    self.bulk_warns.clear()
+    self.bulk_warn_samples.clear()
+    return result
+
+
+def add_bulk_warns(self, bulk_warns):
+    """Buffers warnings that were returned by take_bulk_warns, as if buffered_bulk_warn had been called directly."""
+    for message, (occurrences, sample) in bulk_warns.items():
+        self.bulk_warns.setdefault(message, 0)
+        self.bulk_warns[message] = abs(self.bulk_warns[message]) + occurrences
+        self.bulk_warn_samples[message] = sample
+
+
 L.buffered_bulk_warn = buffered_bulk_warn.__get__(L)
 L.flush_bulk_warns = flush_bulk_warns.__get__(L)
+L.take_bulk_warns = take_bulk_warns.__get__(L)
+L.add_bulk_warns = add_bulk_warns.__get__(L)
 L.bulk_warns = {}
 L.bulk_warn_samples = {}
 
@@ -65,6 +95,10 @@ DS_PATH_PATTERN = r"(.+)/\.(sno|table)-dataset/"
 
 
 def _parse_revlist_output(repo, line_iter, rel_path_pattern):
+    """
+    Yields (commit_id, ds_path, oid) for every object in the rev-list output with a path that matches the pattern.
+    The objects themselves are not loaded, so these may be trees as well as blobs.
+    """
     full_path_pattern = re.compile(DS_PATH_PATTERN + rel_path_pattern)
 
     commit_id = None
@@ -80,10 +114,7 @@ def _parse_revlist_output(repo, line_iter, rel_path_pattern):
         m = full_path_pattern.match(path)
         if not m:
             continue
-        ds_path = m.group(1)
-        obj = repo[oid]
-        if obj.type_str == "blob":
-            yield commit_id, ds_path, obj
+        yield commit_id, m.group(1), oid
 
 
 class CrsHelper:
@@ -205,18 +236,28 @@ class CrsHelper:
         for prior_result in self._distinct_crs_list:
             if result.IsSame(prior_result):
                 return prior_result
+        # Kept so that the same CRS can be recreated in a worker process - see EnvelopeIndexer.
+        result.wkt = wkt
         self._distinct_crs_list.append(result)
         return result
 
     @functools.lru_cache()
     def transform_from_src_crs(self, src_crs):
-        transform = osr.CoordinateTransformation(src_crs, self.target_crs)
-        if src_crs.IsSame(self.target_crs):
-            desc = f"IDENTITY({src_crs.GetAuthorityCode(None)})"
-        else:
-            desc = f"{src_crs.GetAuthorityCode(None)} -> {self.target_crs.GetAuthorityCode(None)}"
-        transform.desc = desc
-        return transform
+        return make_transform(src_crs, self.target_crs)
+
+
+def make_transform(src_crs, target_crs):
+    """
+    Returns a transform from src_crs to target_crs, with a human readable "desc" and the "src_wkt" of the source CRS.
+    """
+    transform = osr.CoordinateTransformation(src_crs, target_crs)
+    if src_crs.IsSame(target_crs):
+        desc = f"IDENTITY({src_crs.GetAuthorityCode(None)})"
+    else:
+        desc = f"{src_crs.GetAuthorityCode(None)} -> {target_crs.GetAuthorityCode(None)}"
+    transform.desc = desc
+    transform.src_wkt = getattr(src_crs, "wkt", None) or src_crs.ExportToWkt()
+    return transform
 
 
 class SpatialTreeTables(TableSet):
@@ -258,7 +299,10 @@ def drop_tables(sess):
     sess.execute("DROP TABLE IF EXISTS feature_envelopes;")
 
 
-def iter_feature_blobs(repo, start_commits, stop_commits):
+def iter_feature_oids(repo, start_commits, stop_commits):
+    """
+    Yields (commit_id, ds_path, oid) for every object in the feature trees of the given commits - without loading them.
+    """
     cmd = [*_revlist_command(repo), *start_commits, "--not", *stop_commits]
     try:
         p = subprocess.Popen(
@@ -274,6 +318,16 @@ def iter_feature_blobs(repo, start_commits, stop_commits):
         )
 
 
+def iter_feature_blobs(repo, start_commits, stop_commits):
+    """Yields (commit_id, ds_path, feature_blob) for every feature blob in the given commits."""
+    for commit_id, ds_path, oid in iter_feature_oids(
+        repo, start_commits, stop_commits
+    ):
+        obj = repo[oid]
+        if obj.type_str == "blob":
+            yield commit_id, ds_path, obj
+
+
 def _minimal_description_of_commit_set(repo, commits):
     """
     Returns the minimal set of commit IDs that have the same set of ancestors as
@@ -338,8 +392,108 @@ def _format_commits(repo, commit_ids):
     return " ".join(c[:length] for c in commit_ids)
 
 
+# The number of features that are checked against the existing index, sent to a worker process, and then
+# written to the index (and committed) at a time. Work that has been committed doesn't need to be redone if
+# indexing is interrupted and then restarted.
+INDEX_BATCH_SIZE = 10_000
+
+# SQLite has a limit on the number of variables that can be bound in a single query.
+_MAX_SQL_VARIABLES = 500
+
+
+class EnvelopeIndexer:
+    """
+    Loads feature blobs, finds their geometry, and calculates and encodes their envelopes.
+    Picklable (and so can be sent to a worker process) - holds no references to the repo or to any OGR objects.
+    """
+
+    def __init__(self, repo_path, bits_per_value):
+        self.repo_path = repo_path
+        self.bits_per_value = bits_per_value
+        self._repo = None
+        self._encoder = None
+
+    def __getstate__(self):
+        return {"repo_path": self.repo_path, "bits_per_value": self.bits_per_value}
+
+    def __setstate__(self, state):
+        self.__init__(state["repo_path"], state["bits_per_value"])
+
+    @property
+    def repo(self):
+        if self._repo is None:
+            self._repo = pygit2.Repository(self.repo_path)
+        return self._repo
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            self._encoder = EnvelopeEncoder(self.bits_per_value)
+        return self._encoder
+
+    @functools.lru_cache()
+    def transforms_from_wkts(self, src_wkts):
+        target_crs = make_crs("EPSG:4326")
+        return [make_transform(make_crs(wkt), target_crs) for wkt in src_wkts]
+
+    def index_features(self, features):
+        """
+        Given a list of (feature_oid, src_wkts, feature_desc) tuples, returns a tuple containing:
+        - the number of feature blobs that were processed (some oids may turn out to be trees, these are skipped)
+        - a list of (blob_id, encoded_envelope) tuples, ready for inserting into the feature_envelopes table.
+        - any warnings that were buffered while indexing - see take_bulk_warns.
+        """
+        num_blobs = 0
+        rows = []
+        for feature_oid, src_wkts, feature_desc in features:
+            obj = self.repo[feature_oid]
+            if obj.type_str != "blob":
+                continue
+            num_blobs += 1
+            geom = get_geometry(self.repo, obj)
+            if geom is None or geom.is_empty():
+                continue
+            transforms = self.transforms_from_wkts(src_wkts)
+            envelope = get_envelope_for_indexing(geom, transforms, feature_desc)
+            if envelope is None:
+                continue
+            rows.append((bytes.fromhex(feature_oid), self.encoder.encode(envelope)))
+        return num_blobs, rows, L.take_bulk_warns()
+
+
+# The EnvelopeIndexer for the current worker process - see _init_indexer_process.
+_process_indexer = None
+
+
+def _init_indexer_process(indexer):
+    global _process_indexer
+    _process_indexer = indexer
+
+
+def _index_feature_batch(features):
+    return _process_indexer.index_features(features)
+
+
+def _find_already_indexed(dbcur, feature_oids):
+    """Returns the set of the given feature oids (in hex) which are already present in the feature_envelopes table."""
+    result = set()
+    for oid_batch in chunk(feature_oids, _MAX_SQL_VARIABLES):
+        placeholders = ",".join("?" * len(oid_batch))
+        dbcur.execute(
+            f"SELECT blob_id FROM feature_envelopes WHERE blob_id IN ({placeholders});",
+            [bytes.fromhex(oid) for oid in oid_batch],
+        )
+        result.update(row[0].hex() for row in dbcur)
+    return result
+
+
 def update_spatial_filter_index(
-    repo, commits, verbosity=1, clear_existing=False, dry_run=False
+    repo,
+    commits,
+    verbosity=1,
+    clear_existing=False,
+    dry_run=False,
+    num_processes=None,
 ):
     """
     Index the commits given in commit_spec, and write them to the feature_envelopes.db repo file.
@@ -348,7 +502,9 @@ def update_spatial_filter_index(
     commits - a set of commit IDs to index (ancestors of these are implicitly included).
     verbosity - how much non-essential information to output.
     clear_existing - when true, deletes any pre-existing data before re-indexing.
+    num_processes - how many worker processes to use. Defaults to the number of available CPU cores.
     """
+    from kart.fast_import import get_default_num_processes
 
     # This is needed to allow just-in-time fetching features that are outside the spatial filter,
     # but are needed by the client for some specific operation:
@@ -369,7 +525,7 @@ def update_spatial_filter_index(
         click.echo("Nothing to do: index already up to date.")
         return
 
-    feature_blob_iter = iter_feature_blobs(repo, start_commits, stop_commits)
+    feature_oid_iter = iter_feature_oids(repo, start_commits, stop_commits)
 
     progress_every = None
     if verbosity >= 1:
@@ -385,7 +541,7 @@ def update_spatial_filter_index(
         )
 
     bits_per_value = envelope_length * 8 // 4 if envelope_length else None
-    encoder = EnvelopeEncoder(bits_per_value)
+    indexer = EnvelopeIndexer(repo.path, bits_per_value)
 
     # We index from the most recent commits, and stop at the already-indexed ancestors -
     # but in terms of logging it makes more sense to say: indexing from <ANCESTORS> to <CURRENT>.
@@ -400,53 +556,107 @@ def update_spatial_filter_index(
         click.echo("(Not performing the indexing due to --dry-run.")
         sys.exit(0)
 
+    if num_processes is None:
+        num_processes = get_default_num_processes()
+    max_batches_in_flight = num_processes * 2
+
     t0 = time.monotonic()
-    i = 0
+    num_blobs = 0
+    num_skipped = 0
+    next_progress = progress_every
     trunc = _truncate_oid(repo)
 
+    def _progress():
+        elapsed = time.monotonic() - t0
+        rate = num_blobs / elapsed if elapsed else 0
+        click.echo(
+            f"  {num_blobs:,d} features... @{elapsed:.1f}s ({rate:,.0f} blobs/s)"
+        )
+
     # Using sqlite directly here instead of sqlalchemy is about 10x faster.
-    # Possibly due to huge number of unbatched queries.
-    # TODO - investigate further.
     db = sqlite.connect(f"file:{db_path}", uri=True)
-    with db:
-        dbcur = db.cursor()
-
-        for i, (commit_id, ds_path, feature_blob) in enumerate(feature_blob_iter):
-            if i and progress_every and i % progress_every == 0:
-                click.echo(f"  {i:,d} features... @{time.monotonic()-t0:.1f}s")
-                L.flush_bulk_warns()
+    dbcur = db.cursor()
+
+    def _write_result(result):
+        nonlocal num_blobs, next_progress
+        batch_blobs, rows, bulk_warns = result
+        dbcur.executemany(
+            "INSERT OR REPLACE INTO feature_envelopes (blob_id, envelope) VALUES (?, ?);",
+            rows,
+        )
+        # Committing each batch means that if indexing is interrupted, this work won't need to be redone.
+        db.commit()
+        num_blobs += batch_blobs
+        L.add_bulk_warns(bulk_warns)
+        if next_progress and num_blobs >= next_progress:
+            _progress()
+            L.flush_bulk_warns()
+            next_progress = (num_blobs // progress_every + 1) * progress_every
+
+    with contextlib.ExitStack() as stack:
+        stack.callback(db.close)
+        executor = None
+        pending = deque()
+
+        for batch in chunk(feature_oid_iter, INDEX_BATCH_SIZE):
+            already_indexed = _find_already_indexed(dbcur, [f[2] for f in batch])
+            num_skipped += len(already_indexed)
+
+            features = []
+            for commit_id, ds_path, feature_oid in batch:
+                if feature_oid in already_indexed:
+                    continue
+                transforms = crs_helper.transforms_for_dataset_at_commit(
+                    ds_path, commit_id
+                )
+                if not transforms:
+                    continue
+                src_wkts = tuple(t.src_wkt for t in transforms)
+                feature_desc = f"{commit_id[:trunc]}:{ds_path}:{feature_oid[:trunc]}"
+                features.append((feature_oid, src_wkts, feature_desc))
 
-            transforms = crs_helper.transforms_for_dataset_at_commit(
-                ds_path,
-                commit_id,
-            )
-            if not transforms:
+            if not features:
                 continue
-            geom = get_geometry(repo, feature_blob)
-            if geom is None or geom.is_empty():
-                continue
-            feature_oid = feature_blob.id.hex
-            feature_desc = f"{commit_id[:trunc]}:{ds_path}:{feature_oid[:trunc]}"
-            envelope = get_envelope_for_indexing(geom, transforms, feature_desc)
-            if envelope is None:
+
+            # Small jobs are done in this process - it's not worth starting worker processes
+            # unless there is more than one full batch of work to do.
+            use_executor = num_processes > 1 and len(batch) == INDEX_BATCH_SIZE
+            if executor is None and use_executor:
+                # Spawn rather than fork - forking a process with open repo / database handles isn't safe.
+                executor = stack.enter_context(
+                    ProcessPoolExecutor(
+                        num_processes,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_init_indexer_process,
+                        initargs=(indexer,),
+                    )
+                )
+
+            if executor is None:
+                _write_result(indexer.index_features(features))
                 continue
 
-            params = (bytes.fromhex(feature_oid), encoder.encode(envelope))
-            dbcur.execute(
-                "INSERT OR REPLACE INTO feature_envelopes (blob_id, envelope) VALUES (?, ?);",
-                params,
-            )
+            pending.append(executor.submit(_index_feature_batch, features))
+            while len(pending) >= max_batches_in_flight:
+                _write_result(pending.popleft().result())
+
+        while pending:
+            _write_result(pending.popleft().result())
 
-        click.echo(f"  {i:,d} features... @{time.monotonic()-t0:.1f}s")
+        _progress()
         L.flush_bulk_warns()
 
         # Update indexed commits.
         params = [(bytes.fromhex(commit_id),) for commit_id in all_independent_commits]
-        dbcur.execute("DELETE FROM commits;")
-        dbcur.executemany("INSERT INTO commits (commit_id) VALUES (?);", params)
+        with db:
+            dbcur.execute("DELETE FROM commits;")
+            dbcur.executemany("INSERT INTO commits (commit_id) VALUES (?);", params)
 
     t1 = time.monotonic()
-    click.echo(f"Indexed {i} features in {t1-t0:.1f}s")
+    if num_skipped:
+        click.echo(f"Skipped {num_skipped:,d} features that were already indexed")
+    rate = num_blobs / (t1 - t0) if t1 > t0 else 0
+    click.echo(f"Indexed {num_blobs} features in {t1-t0:.1f}s ({rate:,.0f} blobs/s)")
 
 
 def debug_index(repo, arg):
@@ -1,7 +1,6 @@
 import decimal
 import re
 
-from osgeo.osr import SpatialReference
 from psycopg2.extensions import Binary
 
 import sqlalchemy as sa
@@ -315,6 +314,8 @@ class KartAdapter_Postgis(BaseKartAdapter, Db_Postgis):
         The result is a list containing a dict per table row.
         Each dict has the format {column-name: value}.
         """
+        from osgeo.osr import SpatialReference
+
         result = []
         for crs_name, definition in v2_obj.crs_definitions().items():
             spatial_ref = SpatialReference(definition)
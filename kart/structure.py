@@ -17,6 +17,7 @@ from .exceptions import (
     NotFound,
     NotYetImplemented,
 )
+from .diff_structs import StreamingDeltaDiff, StreamingRepoDiff
 from .pack_util import packfile_object_builder
 from .tabular.schema import Schema
 from .tabular.version import extra_blobs_for_version, dataset_class_for_version
@@ -269,53 +270,87 @@ class RepoStructure:
         return tree
 
     def check_values_match_schema(self, repo_diff):
-        all_features_valid = True
         violations = {}
-
         for ds_path, ds_diff in repo_diff.items():
             ds_violations = {}
             violations[ds_path] = ds_violations
+            feature_diff = ds_diff.get("feature") or {}
+            for _ in self._validate_feature_deltas(
+                ds_path, ds_diff, feature_diff, ds_violations
+            ):
+                pass
 
-            schema_delta = ds_diff.recursive_get(["meta", "schema.json"])
-            if schema_delta:
-                if self.repo.table_dataset_version < 2:
-                    # This should have been handled already, but just to be safe.
-                    raise NotYetImplemented(
-                        "Meta changes are not supported until datasets V2"
-                    )
-                elif schema_delta.type == "delete":
-                    new_schema = None
-                else:
-                    new_schema = Schema.from_column_dicts(schema_delta.new_value)
-            else:
-                ds = self.datasets()[ds_path]
-                # TODO - check schema for point-clouds as well as table datasets.
-                if ds.DATASET_TYPE != "table":
-                    continue
-                new_schema = self.datasets()[ds_path].schema
+        self._raise_if_schema_violations(violations)
 
-            feature_diff = ds_diff.get("feature") or {}
-            for feature_delta in feature_diff.values():
-                new_value = feature_delta.new_value
-                if new_value is None:
-                    continue
+    def _validate_feature_deltas(self, ds_path, ds_diff, feature_diff, ds_violations):
+        """
+        Generator. Yields each delta from the given feature_diff, while checking that its new value matches the
+        dataset's new schema. An example of any violation found in each column is added to ds_violations.
+        """
+        schema_delta = ds_diff.recursive_get(["meta", "schema.json"])
+        validate = True
+        if schema_delta:
+            if self.repo.table_dataset_version < 2:
+                # This should have been handled already, but just to be safe.
+                raise NotYetImplemented(
+                    "Meta changes are not supported until datasets V2"
+                )
+            elif schema_delta.type == "delete":
+                new_schema = None
+            else:
+                new_schema = Schema.from_column_dicts(schema_delta.new_value)
+        else:
+            ds = self.datasets()[ds_path]
+            # TODO - check schema for point-clouds as well as table datasets.
+            validate = ds.DATASET_TYPE == "table"
+            new_schema = ds.schema if validate else None
+
+        for feature_delta in feature_diff.values():
+            new_value = feature_delta.new_value if validate else None
+            if new_value is not None:
                 if new_schema is None:
                     raise InvalidOperation(
                         f"Can't {feature_delta.type} feature {feature_delta.new_key} in deleted dataset {ds_path}",
                         exit_code=PATCH_DOES_NOT_APPLY,
                     )
-                all_features_valid &= new_schema.validate_feature(
-                    new_value, ds_violations
-                )
+                new_schema.validate_feature(new_value, ds_violations)
+            yield feature_delta
+
+    def _raise_if_schema_violations(self, violations):
+        if not any(violations.values()):
+            return
+        for ds_path, ds_violations in violations.items():
+            for message in ds_violations.values():
+                click.echo(f"{ds_path}: {message}", err=True)
+        raise InvalidOperation(
+            "Schema violation - values do not match schema",
+            exit_code=SCHEMA_VIOLATION,
+        )
 
-        if not all_features_valid:
-            for ds_path, ds_violations in violations.items():
-                for message in ds_violations.values():
-                    click.echo(f"{ds_path}: {message}", err=True)
-            raise InvalidOperation(
-                "Schema violation - values do not match schema",
-                exit_code=SCHEMA_VIOLATION,
+    def _validated_streaming_diff(self, repo_diff):
+        """
+        A StreamingRepoDiff can only be read once, so its feature values can't be checked before the diff is applied.
+        Instead, returns a StreamingRepoDiff which checks each dataset's feature values as they are applied, and
+        raises an error once all of that dataset's features have been applied if any of them were invalid.
+        """
+
+        def _validated_deltas(ds_path, ds_diff, feature_diff):
+            ds_violations = {}
+            yield from self._validate_feature_deltas(
+                ds_path, ds_diff, feature_diff, ds_violations
             )
+            self._raise_if_schema_violations({ds_path: ds_violations})
+
+        def _validated_ds_diffs():
+            for ds_path, ds_diff in repo_diff.items():
+                feature_diff = ds_diff.get("feature")
+                if feature_diff:
+                    ds_diff["feature"] = StreamingDeltaDiff(
+                        _validated_deltas(ds_path, ds_diff, feature_diff)
+                    )
+                yield ds_path, ds_diff
+
+        return StreamingRepoDiff(_validated_ds_diffs())
 
     def commit_diff(
         self,
@@ -326,12 +361,15 @@ class RepoStructure:
         committer=None,
         allow_empty=False,
         resolve_missing_values_from_rs: Optional["RepoStructure"] = None,
+        from_working_copy=False,
     ):
         """
         Update the repository structure and write the updated data to the tree
         as a new commit, setting HEAD to the new commit.
         NOTE: Doesn't update working-copy meta or tracking tables, this is the
         responsibility of the caller.
+        `from_working_copy` should be True if the diff is the working copy changes being committed to HEAD -
+        in which case the point-cloud tiles in the working copy already match the new commit.
 
         `self.ref` must be a key that works with repo.references, i.e.
         either "HEAD" or "refs/heads/{branchname}"
@@ -339,7 +377,10 @@ class RepoStructure:
         if not self.ref:
             raise RuntimeError("Can't commit diff - no reference to add commit to")
 
-        self.check_values_match_schema(wcdiff)
+        if isinstance(wcdiff, StreamingRepoDiff):
+            wcdiff = self._validated_streaming_diff(wcdiff)
+        else:
+            self.check_values_match_schema(wcdiff)
 
         with packfile_object_builder(self.repo, self.tree) as object_builder:
             new_tree = self.create_tree_from_diff(
@@ -368,16 +409,21 @@ class RepoStructure:
             )
 
         if os.environ.get("X_KART_POINT_CLOUDS"):
-            from kart.point_cloud.v1 import PointCloudV1
-            from kart.point_cloud.checkout import reset_worktree_index
-
-            # Update the worktree-index to match the actual current worktree.
-            # TODO - update that part of the index that was actually changed - don't just assume
-            # we committed all outstanding changes in all point-cloud datasets.
-            reset_index_paths = [
-                ds.path for ds in self.datasets() if isinstance(ds, PointCloudV1)
-            ]
-            reset_worktree_index(self.repo, reset_index_paths)
+            from kart.point_cloud.checkout import (
+                forget_checked_out_tree,
+                update_wc_after_commit,
+            )
+
+            if from_working_copy:
+                # Update the worktree-index entries of the tiles that were just committed.
+                old_tree = self.tree or self.repo.empty_tree
+                update_wc_after_commit(
+                    self.repo, old_tree, new_commit.peel(pygit2.Tree)
+                )
+            else:
+                # The tiles in the working copy weren't changed to match this commit - don't assume that
+                # they match any particular tree, so the next checkout writes them all.
+                forget_checked_out_tree(self.repo)
 
         L.info(f"Commit: {new_commit.id.hex}")
         return new_commit
@@ -0,0 +1,55 @@
+class FeatureBatch:
+    """
+    A batch of features, stored column-wise rather than row-wise - see TableV3.iter_feature_batches.
+
+    column_names - a tuple of the names of the columns in this batch.
+    columns - a tuple with one sequence of values per column, each the same length. Each sequence is a tuple,
+        or - if NumPy output was requested - a NumPy array for integer / float columns that can be stored as one.
+    """
+
+    def __init__(self, column_names, columns):
+        self.column_names = tuple(column_names)
+        self.columns = tuple(columns)
+        assert len(self.column_names) == len(self.columns)
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def __repr__(self):
+        return f"<FeatureBatch: {len(self)} features, columns={self.column_names}>"
+
+    def column(self, name):
+        """Returns the sequence of values for the column with the given name."""
+        try:
+            return self.columns[self.column_names.index(name)]
+        except ValueError:
+            raise KeyError(f"No such column: {name}")
+
+    def rows(self):
+        """Yields a tuple of values for each feature, in the same order as column_names."""
+        yield from zip(*self.columns)
+
+    def row_dicts(self):
+        """Yields a dict for each feature, keyed by column name - the same format as TableDataset.features()."""
+        names = self.column_names
+        for row in zip(*self.columns):
+            yield dict(zip(names, row))
+
+
+def numpy_column_if_possible(values, data_type):
+    """
+    Returns the given column of values as a NumPy array, if it has a numeric type that NumPy can store
+    without loss - otherwise, returns the values unchanged.
+    """
+    import numpy as np
+
+    if data_type == "float":
+        return np.array(
+            [float("nan") if v is None else v for v in values], dtype=np.float64
+        )
+    if data_type == "integer" and None not in values:
+        try:
+            return np.array(values, dtype=np.int64)
+        except OverflowError:
+            return values
+    return values
@@ -1,7 +1,12 @@
 import json
 
 from kart.exceptions import InvalidOperation
-from kart.geometry import Geometry, ogr_to_hex_wkb
+from kart.geometry import (
+    Geometry,
+    ogr_to_gpkg_geom,
+    ogr_to_hex_wkb,
+    transform_gpkg_geoms,
+)
 from kart.utils import ungenerator
 
 
@@ -41,15 +46,9 @@ def feature_as_json(row, pk_value, geometry_transform=None):
             if geometry_transform is None:
                 v = v.to_hex_wkb()
             else:
-                # reproject
-                ogr_geom = v.to_ogr()
-                try:
-                    ogr_geom.Transform(geometry_transform)
-                except RuntimeError as e:
-                    raise InvalidOperation(
-                        f"Can't reproject geometry with ID '{pk_value}' into target CRS"
-                    ) from e
-                v = ogr_to_hex_wkb(ogr_geom)
+                v = ogr_to_hex_wkb(
+                    _reproject_ogr(v, geometry_transform, f"with ID '{pk_value}'")
+                )
         elif isinstance(v, bytes):
             v = bytes.hex(v)
         yield k, v
@@ -78,15 +77,10 @@ def feature_as_geojson(
     for k in row.keys():
         v = row[k]
         if isinstance(v, Geometry):
-            g = v.to_ogr()
-            if geometry_transform is not None:
-                # reproject
-                try:
-                    g.Transform(geometry_transform)
-                except RuntimeError as e:
-                    raise InvalidOperation(
-                        f"Can't reproject geometry at '{change_id}' into target CRS"
-                    ) from e
+            if geometry_transform is None:
+                g = v.to_ogr()
+            else:
+                g = _reproject_ogr(v, geometry_transform, f"at '{change_id}'")
             json_str = g.ExportToJson()
             f["geometry"] = json.loads(json_str) if json_str else None
         elif isinstance(v, bytes):
@@ -95,3 +89,42 @@ def feature_as_geojson(
             f["properties"][k] = v
 
     return f
+
+
+def reproject_features(features, geometry_transform):
+    """
+    Given a list of (pk_value, row) tuples, returns a list containing a copy of each row with its geometry reprojected
+    using the given transform. The geometries are all reprojected together as a batch - which is much quicker than
+    reprojecting them one at a time - except for any that can't be, which are reprojected individually.
+    """
+    geom_cells = [
+        (i, k, v)
+        for i, (pk_value, row) in enumerate(features)
+        for k, v in row.items()
+        if isinstance(v, Geometry)
+    ]
+    reprojected = transform_gpkg_geoms(
+        [v for i, k, v in geom_cells], geometry_transform
+    )
+
+    result = [dict(row) for pk_value, row in features]
+    for (i, k, v), reprojected_v in zip(geom_cells, reprojected):
+        if reprojected_v is None:
+            pk_value = features[i][0]
+            reprojected_v = ogr_to_gpkg_geom(
+                _reproject_ogr(v, geometry_transform, f"with ID '{pk_value}'")
+            )
+        result[i][k] = reprojected_v
+    return result
+
+
+def _reproject_ogr(geometry, geometry_transform, geometry_desc):
+    """Returns the given Geometry as an OGR geometry, reprojected using the given transform."""
+    ogr_geom = geometry.to_ogr()
+    try:
+        ogr_geom.Transform(geometry_transform)
+    except RuntimeError as e:
+        raise InvalidOperation(
+            f"Can't reproject geometry {geometry_desc} into target CRS"
+        ) from e
+    return ogr_geom
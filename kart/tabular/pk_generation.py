@@ -462,6 +462,10 @@ class FilteredTableDataset:
             if self.pk_filter(pk):
                 yield blob
 
+    @property
+    def feature_count(self):
+        return sum(1 for blob in self.feature_blobs())
+
 
 class FilteredTableV3(FilteredTableDataset, TableV3):
     pass
@@ -1,12 +1,13 @@
 import functools
+import json
 import time
+from pathlib import Path
 
 import click
 import pygit2
-from osgeo import osr
 
 from kart import crs_util
-from kart.diff_structs import Delta, DeltaDiff
+from kart.diff_structs import Delta, DeltaDiff, StreamingDeltaDiff
 from kart.exceptions import PATCH_DOES_NOT_APPLY, InvalidOperation, NotYetImplemented
 from kart.key_filters import DatasetKeyFilter, FeatureKeyFilter
 from kart.promisor_utils import fetch_promised_blobs, object_is_promised
@@ -28,6 +29,12 @@ class RichTableDataset(TableDataset):
     """
 
     RTREE_INDEX_EXTENSIONS = ("kart-idxd", "kart-idxi")
+    SPATIAL_INDEX_STATE_EXTENSION = "kart-idx.json"
+    # Relative to the gitdir:
+    SPATIAL_INDEX_DIR = "query-index"
+    # When applying a feature diff, new blobs are written to the tree after this many features have changed,
+    # so that memory use doesn't depend on the size of the diff.
+    APPLY_FLUSH_INTERVAL = 100_000
 
     def features_plus_blobs(self):
         for blob in self.feature_blobs():
@@ -84,9 +91,55 @@ class RichTableDataset(TableDataset):
                 result[col.name] = crs_id
         return result
 
-    def build_spatial_index(self, path):
+    @property
+    def spatial_index_path(self):
         """
-        Internal proof-of-concept method for building a spatial index across the repository.
+        The path (without extension) of the spatial index for this dataset - see update_spatial_index.
+        This is in the gitdir since it is shared by every revision of the dataset, and the state file alongside
+        it records which revision it currently indexes.
+        """
+        return self.repo.gitdir_file(self.SPATIAL_INDEX_DIR) / self.path
+
+    def _spatial_index_properties(self, overwrite=False):
+        import rtree
+
+        p = rtree.index.Property()
+        p.dat_extension = self.RTREE_INDEX_EXTENSIONS[0]
+        p.idx_extension = self.RTREE_INDEX_EXTENSIONS[1]
+        if overwrite:
+            p.leaf_capacity = 1000
+            p.fill_factor = 0.9
+            p.overwrite = True
+            p.dimensionality = 2
+        return p
+
+    def _read_spatial_index_state(self, path):
+        state_path = Path(f"{path}.{self.SPATIAL_INDEX_STATE_EXTENSION}")
+        index_path = Path(f"{path}.{self.RTREE_INDEX_EXTENSIONS[1]}")
+        if not index_path.exists():
+            return None
+        try:
+            return json.loads(state_path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _write_spatial_index_state(self, path):
+        state_path = Path(f"{path}.{self.SPATIAL_INDEX_STATE_EXTENSION}")
+        state = {
+            "dataset_tree": self.tree.id.hex,
+            "feature_tree": self.feature_tree.id.hex,
+        }
+        state_path.write_text(json.dumps(state))
+
+    def _spatial_index_entry(self, pk, geom):
+        if geom is None:
+            return None
+        return (pk, geom.envelope(only_2d=True, calculate_if_missing=True), None)
+
+    def build_spatial_index(self, path=None):
+        """
+        Internal proof-of-concept method for building a spatial index of this dataset from scratch.
+        Generally update_spatial_index should be used instead, which only does this if it has to.
 
         Uses Rtree (libspatialindex underneath): http://toblerity.org/rtree/index.html
         """
@@ -95,55 +148,118 @@ class RichTableDataset(TableDataset):
         if not self.has_geometry:
             raise ValueError("No geometry to index")
 
+        path = path or self.spatial_index_path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        pk_name = self.primary_key
+        geom_name = self.geom_column_name
+
         def _indexer():
             t0 = time.monotonic()
 
             c = 0
             for feature in self.features():
                 c += 1
-                pk = feature[self.primary_key]
-                geom = feature[self.geom_column_name]
-
-                if geom is None:
-                    continue
-
-                e = geom.envelope(only_2d=True, calculate_if_missing=True)
-                yield (pk, e, None)
+                entry = self._spatial_index_entry(feature[pk_name], feature[geom_name])
+                if entry is not None:
+                    yield entry
 
                 if c % 50000 == 0:
                     print(f"  {c} features... @{time.monotonic()-t0:.1f}s")
 
-        p = rtree.index.Property()
-        p.dat_extension = self.RTREE_INDEX_EXTENSIONS[0]
-        p.idx_extension = self.RTREE_INDEX_EXTENSIONS[1]
-        p.leaf_capacity = 1000
-        p.fill_factor = 0.9
-        p.overwrite = True
-        p.dimensionality = 2
+        p = self._spatial_index_properties(overwrite=True)
 
         t0 = time.monotonic()
-        idx = rtree.index.Index(path, _indexer(), properties=p, interleaved=False)
+        idx = rtree.index.Index(
+            str(path), _indexer(), properties=p, interleaved=False
+        )
         t1 = time.monotonic()
         b = idx.bounds
         c = idx.count(b)
-        del idx
+        idx.close()
+        self._write_spatial_index_state(path)
         t2 = time.monotonic()
         print(f"Indexed {c} features ({b}) in {t1-t0:.1f}s; flushed in {t2-t1:.1f}s")
 
-    def get_spatial_index(self, path):
+    def update_spatial_index(self, path=None, create=True):
+        """
+        Brings the spatial index for this dataset up to date with this revision of the dataset.
+        The index records which feature tree it was built from, and is updated by applying the feature diff between
+        that revision and this one - so the index stays correct after commits, pulls, merges etc without being
+        rebuilt from scratch. Falls back to a full rebuild if the index is missing (and create is True),
+        or if the indexed revision can't be diffed against this one.
+
+        Returns True if the index is now up to date, or False if there is no index (and create is False).
+        """
+        import rtree
+
+        path = path or self.spatial_index_path
+        state = self._read_spatial_index_state(path)
+        if state is None:
+            if not create:
+                return False
+            self.build_spatial_index(path)
+            return True
+
+        if state["feature_tree"] == self.feature_tree.id.hex:
+            return True
+
+        try:
+            indexed_tree = self.repo[state["dataset_tree"]]
+            indexed_ds = self.__class__(
+                indexed_tree, self.path, self.repo, dirname=self.dirname
+            )
+            can_update = (
+                indexed_ds.primary_key == self.primary_key
+                and indexed_ds.geom_column_name == self.geom_column_name
+            )
+        except (KeyError, ValueError):
+            can_update = False
+        if not can_update:
+            self.build_spatial_index(path)
+            return True
+
+        t0 = time.monotonic()
+        c = 0
+        idx = rtree.index.Index(
+            str(path), properties=self._spatial_index_properties(), interleaved=False
+        )
+        try:
+            for delta in indexed_ds.diff_feature(self):
+                c += 1
+                if delta.old is not None:
+                    old_geom = delta.old_value[indexed_ds.geom_column_name]
+                    entry = self._spatial_index_entry(delta.old_key, old_geom)
+                    if entry is not None:
+                        idx.delete(entry[0], entry[1])
+                if delta.new is not None:
+                    new_geom = delta.new_value[self.geom_column_name]
+                    entry = self._spatial_index_entry(delta.new_key, new_geom)
+                    if entry is not None:
+                        idx.insert(*entry)
+        finally:
+            idx.close()
+
+        self._write_spatial_index_state(path)
+        t1 = time.monotonic()
+        self.L.info(
+            "Updated spatial index of %s with %d changed features in %.1fs",
+            self.path,
+            c,
+            t1 - t0,
+        )
+        return True
+
+    def get_spatial_index(self, path=None):
         """
-        Retrieve a spatial index built with build_spatial_index().
+        Retrieve a spatial index built with build_spatial_index() / update_spatial_index().
 
         Query with .nearest(coords), .intersection(coords), .count(coords)
         http://toblerity.org/rtree/index.html
         """
         import rtree
 
-        p = rtree.index.Property()
-        p.dat_extension = self.RTREE_INDEX_EXTENSIONS[0]
-        p.idx_extension = self.RTREE_INDEX_EXTENSIONS[1]
-
-        idx = rtree.index.Index(path, properties=p)
+        path = path or self.spatial_index_path
+        idx = rtree.index.Index(str(path), properties=self._spatial_index_properties())
         return idx
 
     @functools.lru_cache()
@@ -152,6 +268,8 @@ class RichTableDataset(TableDataset):
         Find the transform to reproject this dataset into the target CRS.
         Returns None if the CRS for this dataset is unknown.
         """
+        from osgeo import osr
+
         crs_definition = self.get_crs_definition()
         if crs_definition is None:
             return None
@@ -163,15 +281,26 @@ class RichTableDataset(TableDataset):
                 f"Can't reproject dataset {self.path!r} into target CRS: {e}"
             )
 
-    def diff(self, other, ds_filter=DatasetKeyFilter.MATCH_ALL, reverse=False):
+    def diff(
+        self,
+        other,
+        ds_filter=DatasetKeyFilter.MATCH_ALL,
+        reverse=False,
+        stream_features=False,
+    ):
         """
         Generates a Diff from self -> other.
         If reverse is true, generates a diff from other -> self.
+        If stream_features is true, the feature deltas are generated on demand, in path order, rather than
+        all being held in memory - see StreamingDeltaDiff.
         """
         ds_diff = super().diff(other, ds_filter=ds_filter, reverse=reverse)
         feature_filter = ds_filter.get("feature", ds_filter.child_type())
-        ds_diff["feature"] = DeltaDiff(
-            self.diff_feature(other, feature_filter, reverse=reverse)
+        delta_diff_class = StreamingDeltaDiff if stream_features else DeltaDiff
+        ds_diff["feature"] = delta_diff_class(
+            self.diff_feature(
+                other, feature_filter, reverse=reverse, lazy=stream_features
+            )
         )
         return ds_diff
 
@@ -179,11 +308,16 @@ class RichTableDataset(TableDataset):
         return wc_diff_context.table_working_copy.diff_db_to_tree(self, ds_filter)
 
     def diff_feature(
-        self, other, feature_filter=FeatureKeyFilter.MATCH_ALL, reverse=False
+        self,
+        other,
+        feature_filter=FeatureKeyFilter.MATCH_ALL,
+        reverse=False,
+        lazy=False,
     ):
         """
         Yields feature deltas from self -> other, but only for features that match the feature_filter.
         If reverse is true, yields feature deltas from other -> self.
+        If lazy is true, the feature trees are only diffed as the deltas are consumed - see diff_subtree.
         """
         yield from self.diff_subtree(
             other,
@@ -192,6 +326,7 @@ class RichTableDataset(TableDataset):
             key_decoder_method="decode_path_to_1pk",
             value_decoder_method="get_feature_promise_from_path",
             reverse=reverse,
+            lazy=lazy,
         )
 
     def get_feature_promise_from_path(self, feature_path):
@@ -332,7 +467,9 @@ class RichTableDataset(TableDataset):
                 encode_kwargs = {"schema": schema}
 
             has_conflicts = False
-            for delta in feature_diff.values():
+            for i, delta in enumerate(feature_diff.values(), 1):
+                if i % self.APPLY_FLUSH_INTERVAL == 0:
+                    object_builder.flush()
                 old_key = delta.old_key
                 new_key = delta.new_key
                 old_path = (
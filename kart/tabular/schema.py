@@ -44,6 +44,9 @@ class Legend:
         """
         self._pk_columns = tuple(pk_columns)
         self._non_pk_columns = tuple(non_pk_columns)
+        # Legends are immutable, so these can be computed once - they are needed for every feature written.
+        self._packed = msg_pack((self._pk_columns, self._non_pk_columns))
+        self._hexhash = hexhash(self._packed)
 
     @property
     def pk_columns(self):
@@ -61,7 +64,7 @@ class Legend:
 
     def dumps(self):
         """Writes this legend to a bytestring."""
-        return msg_pack((self.pk_columns, self.non_pk_columns))
+        return self._packed
 
     def value_tuples_to_raw_dict(self, pk_values, non_pk_values):
         """
@@ -99,7 +102,7 @@ class Legend:
 
     def hexhash(self):
         """Like __hash__ but with platform-independent, 160-bit hex strings."""
-        return hexhash(self.dumps())
+        return self._hexhash
 
 
 def pk_index_ordering(column):
@@ -212,6 +215,7 @@ class Schema:
             c for c in sorted(columns, key=pk_index_ordering) if c.pk_index is not None
         )
         self._hash = hash(self._columns)
+        self._packed = None
 
     @property
     def columns(self):
@@ -275,7 +279,9 @@ class Schema:
 
     def dumps(self):
         """Writes this schema to a bytestring."""
-        return json_pack(self.to_column_dicts())
+        if self._packed is None:
+            self._packed = json_pack(self.to_column_dicts())
+        return self._packed
 
     def __str__(self):
         cols = ",\n".join(str(c) for c in self.columns)
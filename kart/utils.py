@@ -2,6 +2,8 @@ import functools
 import itertools
 import os
 import platform
+import queue
+import threading
 from pathlib import Path
 
 
@@ -39,6 +41,50 @@ def chunk(iterable, size):
         yield chunk
 
 
+def iter_in_background(iterable, max_ahead=1):
+    """
+    Generator. Yields the items from the given iterable, which is iterated by a background thread that runs up to
+    max_ahead items ahead of the caller - so producing the next item overlaps with consuming this one.
+    Any exception raised by the iterable is re-raised here.
+    """
+    items = queue.Queue(maxsize=max_ahead)
+    stop = threading.Event()
+    end = object()
+
+    def _put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce():
+        try:
+            for item in iterable:
+                if not _put((item, None)):
+                    return
+        except BaseException as e:
+            _put((end, e))
+        else:
+            _put((end, None))
+
+    thread = threading.Thread(target=_produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is end:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
 def get_num_available_cores():
     """
     Returns the number of available CPU cores (best effort)
@@ -1,12 +1,19 @@
 import contextlib
 import functools
+import itertools
 import logging
+import os
+import queue
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import click
 import pygit2
 
 import sqlalchemy as sa
+from sqlalchemy.pool import QueuePool
 from kart.diff_structs import WORKING_COPY_EDIT, DatasetDiff, Delta, DeltaDiff, RepoDiff
 from kart.exceptions import (
     NO_WORKING_COPY,
@@ -15,11 +22,11 @@ from kart.exceptions import (
     NotYetImplemented,
 )
 from kart.key_filters import DatasetKeyFilter, FeatureKeyFilter, RepoKeyFilter
-from kart.promisor_utils import LibgitSubcode
+from kart.promisor_utils import LibgitSubcode, object_is_promised
 from kart.sqlalchemy.upsert import Upsert as upsert
 from kart.tabular.table_dataset import TableDataset
 from kart.tabular.schema import DefaultRoundtripContext, Schema
-from kart.utils import chunk
+from kart.utils import chunk, iter_in_background
 
 from . import WorkingCopyStatus, WorkingCopyType
 
@@ -58,6 +65,12 @@ class BaseWorkingCopy:
     self.kart_tables - sqlalchemy Table definitions for kart_state and kart_track tables.
     """
 
+    # True if several sessions can write to different tables at once - see write_full.
+    SUPPORTS_CONCURRENT_WRITES = False
+
+    # False if CREATE TABLE and DROP TABLE implicitly commit the transaction, so they can't be rolled back.
+    SUPPORTS_TRANSACTIONAL_DDL = True
+
     @property
     def WORKING_COPY_TYPE_NAME(self):
         """Human readable name of this type of working copy, eg "PostGIS"."""
@@ -631,6 +644,11 @@ class BaseWorkingCopy:
                 include_legacy_items=True,
             )
 
+    # Dirty rows are compared to the repo in batches of this many - the repo's version of each batch of features
+    # is decoded by this many worker threads. See _get_repo_features.
+    DIRTY_FEATURE_BATCH_SIZE = 1000
+    DIRTY_FEATURE_THREADS = min(8, os.cpu_count() or 1)
+
     def diff_db_to_tree_feature(
         self, dataset, feature_filter, meta_diff, raise_if_dirty=False
     ):
@@ -647,69 +665,103 @@ class BaseWorkingCopy:
 
         find_renames = self.can_find_renames(meta_diff)
 
-        with self.session() as sess:
+        with self.session() as sess, ThreadPoolExecutor(
+            max_workers=self.DIRTY_FEATURE_THREADS
+        ) as executor:
             r = self._execute_dirty_rows_query(sess, dataset, feature_filter, meta_diff)
 
             feature_diff = DeltaDiff()
             insert_count = delete_count = 0
 
-            for row in r:
-                track_pk = row[0]  # This is always a str
-                db_obj = {k: row[k] for k in row.keys() if k != ".__track_pk"}
+            for rows in chunk(r, self.DIRTY_FEATURE_BATCH_SIZE):
+                track_pks = [row[0] for row in rows]  # These are always strs
+                repo_objs = self._get_repo_features(dataset, track_pks, executor)
 
-                if db_obj[pk_field] is None:
-                    db_obj = None
+                for row, repo_obj in zip(rows, repo_objs):
+                    db_obj = {k: row[k] for k in row.keys() if k != ".__track_pk"}
 
-                repo_obj = self._get_feature_and_fetch_if_needed(dataset, track_pk)
+                    if db_obj[pk_field] is None:
+                        db_obj = None
 
-                if repo_obj == db_obj:
-                    # DB was changed and then changed back - eg INSERT then DELETE.
-                    # TODO - maybe delete track_pk from tracking table?
-                    continue
+                    if repo_obj == db_obj:
+                        # DB was changed and then changed back - eg INSERT then DELETE.
+                        # TODO - maybe delete track_pk from tracking table?
+                        continue
 
-                if raise_if_dirty:
-                    raise WorkingCopyDirty()
+                    if raise_if_dirty:
+                        raise WorkingCopyDirty()
 
-                if db_obj and not repo_obj:  # INSERT
-                    insert_count += 1
-                    delta = Delta.insert((db_obj[pk_field], db_obj))
+                    if db_obj and not repo_obj:  # INSERT
+                        insert_count += 1
+                        delta = Delta.insert((db_obj[pk_field], db_obj))
 
-                elif repo_obj and not db_obj:  # DELETE
-                    delete_count += 1
-                    delta = Delta.delete((repo_obj[pk_field], repo_obj))
+                    elif repo_obj and not db_obj:  # DELETE
+                        delete_count += 1
+                        delta = Delta.delete((repo_obj[pk_field], repo_obj))
 
-                else:  # UPDATE
-                    pk = db_obj[pk_field]
-                    delta = Delta.update((pk, repo_obj), (pk, db_obj))
+                    else:  # UPDATE
+                        pk = db_obj[pk_field]
+                        delta = Delta.update((pk, repo_obj), (pk, db_obj))
 
-                delta.flags = WORKING_COPY_EDIT
-                feature_diff.add_delta(delta)
+                    delta.flags = WORKING_COPY_EDIT
+                    feature_diff.add_delta(delta)
 
         if find_renames and (insert_count + delete_count) <= 400:
             self.find_renames(feature_diff, dataset)
 
         return feature_diff
 
-    def _get_feature_and_fetch_if_needed(self, dataset, feature_pk):
-        try:
-            return dataset.get_feature(feature_pk)
-        except KeyError as e:
-            # Couldn't find the feature.
-            subcode = getattr(e, "subcode", 0)
-
-            if subcode == LibgitSubcode.ENOSUCHPATH:
-                # There is no such feature. This is okay: it just means the user has inserted
-                # the feature into the working copy and it has not yet been committed.
-                return None
-            elif subcode == LibgitSubcode.EOBJECTPROMISED:
-                # A feature with this PK exists, but we don't have it locally right now. Fetch it.
-                # Note that this means the feature presumably doesn't match the user's spatial filter,
-                # so it was probably a mistake by the user that they have reused the existing feature's PK.
-                dataset.fetch_missing_dirty_features(self)
-                return dataset.get_feature(feature_pk)
-            else:
+    def _get_repo_features(self, dataset, track_pks, executor):
+        """
+        Returns a list containing the feature from the repo for each of the given PKs (as stored in the tracking table),
+        or None for any PK where there is no such feature - presumably because it has been inserted into the working
+        copy and not yet committed.
+        The features are looked up in path order, so that consecutive lookups share subtrees, and then read and
+        decoded by the given executor.
+        """
+        pks = [dataset.schema.sanitise_pks(pk) for pk in track_pks]
+        paths = [dataset.encode_pks_to_path(pk, relative=True) for pk in pks]
+
+        result = [None] * len(track_pks)
+        promised = []
+        to_decode = []
+        for i in sorted(range(len(paths)), key=paths.__getitem__):
+            try:
+                blob = dataset.get_blob_at(paths[i])
+            except KeyError as e:
+                subcode = getattr(e, "subcode", 0)
+                if subcode == LibgitSubcode.ENOSUCHPATH:
+                    # There is no such feature.
+                    continue
+                elif subcode == LibgitSubcode.EOBJECTPROMISED:
+                    promised.append(i)
+                    continue
                 # Some other error has happened, or no subcode was found. Re-raise the error.
                 raise
+            to_decode.append((i, pks[i], paths[i], blob))
+
+        num_workers = self.DIRTY_FEATURE_THREADS
+        work_size = max(1, -(-len(to_decode) // num_workers))
+        for decoded in executor.map(
+            functools.partial(_decode_repo_features, dataset),
+            chunk(to_decode, work_size),
+        ):
+            for i, feature in decoded:
+                if feature is _PROMISED:
+                    promised.append(i)
+                else:
+                    result[i] = feature
+
+        if promised:
+            # Features with these PKs exist, but we don't have them locally right now. Fetch them - along with any
+            # other missing features that are dirty in the working copy - all at once.
+            # Note that this means these features presumably don't match the user's spatial filter,
+            # so it was probably a mistake by the user that they have reused the existing features' PKs.
+            dataset.fetch_missing_dirty_features(self)
+            for i in promised:
+                result[i] = dataset.get_feature(pks[i], path=paths[i])
+
+        return result
 
     @property
     def _tracking_table_requires_cast(self):
@@ -902,69 +954,273 @@ class BaseWorkingCopy:
         Only writes features that match the repo's spatial filter.
 
         Use for new working-copy checkouts.
+
+        If the kart.workingcopy.numWorkers config is more than 1, working copies that support concurrent writes
+        write that many datasets at once, each in its own session - see _write_full_concurrently. This is only
+        possible when write_full isn't called inside an existing session. Otherwise, the datasets are written one
+        at a time in a single session, but features are decoded in the background while they are being written.
+        """
+        self.repo.odb.refresh()
+        num_workers = self._write_full_num_workers(datasets)
+        with pause_refreshing(self.repo.odb):
+            if self._can_write_full_concurrently(num_workers):
+                self._write_full_concurrently(commit, datasets, num_workers)
+                return
+
+            with self.session() as sess:
+                dataset_count = len(datasets)
+                for i, dataset in enumerate(datasets):
+                    self._write_full_dataset(
+                        sess,
+                        commit,
+                        dataset,
+                        i,
+                        dataset_count,
+                        decode_in_background=num_workers > 1,
+                    )
+
+                self._write_full_state(sess, commit)
+
+    def _write_full_num_workers(self, datasets):
+        from kart.repo import KartConfigKeys
+
+        key = KartConfigKeys.KART_WORKINGCOPY_NUMWORKERS
+        config = self.repo.config
+        num_workers = max(1, config.get_int(key)) if key in config else 1
+        return min(num_workers, len(datasets), self._max_concurrent_sessions())
+
+    def _max_concurrent_sessions(self):
+        """
+        Returns how many sessions can hold a connection at once - each concurrent writer keeps its connection until
+        every writer is done, so any more writers than the pool holds could end up waiting for a connection until
+        they timed out.
+        """
+        pool = self.engine.pool
+        if not isinstance(pool, QueuePool):
+            return sys.maxsize
+        return pool.size()
+
+    def _can_write_full_concurrently(self, num_workers, *, drop_existing=False):
+        # Dropping a table can only be rolled back if DDL is transactional - otherwise, tables are rewritten
+        # one at a time in a single session, so that a failure leaves as few of them dropped as possible.
+        return (
+            num_workers > 1
+            and self.SUPPORTS_CONCURRENT_WRITES
+            and (self.SUPPORTS_TRANSACTIONAL_DDL or not drop_existing)
+            and not hasattr(self, "_session")
+        )
+
+    def _write_full_concurrently(
+        self, commit, datasets, num_workers, *, drop_existing=False
+    ):
+        """
+        Writes the given datasets using num_workers threads, each with its own database session, so that several
+        tables can be written at once. None of the sessions are committed until every dataset has been written,
+        and the state table is only updated once they all have been committed.
+
+        If drop_existing is True, each existing table is dropped in the same session that rewrites it.
+
+        If writing any dataset fails before any session is committed, the sessions are all rolled back, and the
+        working copy is left as it was. But the sessions can't be committed atomically, so if one of them fails to
+        commit after others already have - or if tables were created outside of a transaction - the datasets are
+        dropped and written again one at a time, in a single session, as a serial write_full would. If that fails
+        too, the working copy is left only partly written, with the state table still referring to the old tree.
         """
         L = logging.getLogger(f"{self.__class__.__qualname__}.write_full")
 
-        self.repo.odb.refresh()
-        with pause_refreshing(self.repo.odb), self.session() as sess:
-            dataset_count = len(datasets)
-            for i, dataset in enumerate(datasets):
-                L.info(
-                    "Writing dataset %d of %d: %s", i + 1, dataset_count, dataset.path
-                )
+        # CRS definitions can be shared between datasets - they are all written first, in a single session, so that
+        # two sessions never try to write the same one.
+        with self.session() as sess:
+            writable = []
+            for dataset in datasets:
+                if self._write_full_meta(sess, dataset):
+                    writable.append(dataset)
+                elif drop_existing:
+                    self._drop_table(sess, dataset)
+            datasets = writable
+
+        dataset_count = len(datasets)
+        pending = queue.SimpleQueue()
+        for i, dataset in enumerate(datasets):
+            pending.put((i, dataset))
+        all_written = threading.Barrier(num_workers)
+        committed = []
+
+        def _write_datasets():
+            sess = self.sessionmaker()
+            try:
+                # Stop early if some other worker has failed.
+                while not all_written.broken:
+                    try:
+                        i, dataset = pending.get_nowait()
+                    except queue.Empty:
+                        break
+                    if drop_existing:
+                        self._drop_table(sess, dataset)
+                    self._write_full_dataset(
+                        sess, commit, dataset, i, dataset_count, write_meta=False
+                    )
+                all_written.wait()
+                sess.commit()
+                committed.append(True)
+            except BaseException:
+                # Make sure none of the other workers commit.
+                all_written.abort()
+                sess.rollback()
+                raise
+            finally:
+                sess.close()
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = [executor.submit(_write_datasets) for i in range(num_workers)]
+        errors = [f.exception() for f in futures if f.exception() is not None]
+        if errors:
+            # Report whatever caused the failure, rather than the BrokenBarrierErrors that it caused.
+            error = next(
+                (e for e in errors if not isinstance(e, threading.BrokenBarrierError)),
+                errors[0],
+            )
+            if not committed and self.SUPPORTS_TRANSACTIONAL_DDL:
+                # Everything was rolled back - the working copy is as it was.
+                raise error
 
-                try:
-                    # Create the table
-                    self._write_meta(sess, dataset)
-                    self._create_table_for_dataset(sess, dataset)
-                except NotYetImplemented as e:
-                    click.secho(
-                        f"Couldn't write {dataset.table_name} to working copy:\n{e}",
-                        err=True,
-                        fg="red",
+            L.warning(
+                "Writing datasets concurrently failed, writing them one at a time: %s",
+                error,
+            )
+            with self.session() as sess:
+                for i, dataset in enumerate(datasets):
+                    self._drop_table(sess, dataset)
+                    self._write_full_dataset(
+                        sess, commit, dataset, i, dataset_count, write_meta=False
                     )
-                    continue
+                self._write_full_state(sess, commit)
+            return
+
+        with self.session() as sess:
+            self._write_full_state(sess, commit)
+
+    def _write_full_meta(self, sess, dataset):
+        """
+        Writes the metadata for the given dataset. Returns False if the dataset can't be written to this working copy.
+        """
+        try:
+            self._write_meta(sess, dataset)
+            return True
+        except NotYetImplemented as e:
+            self._echo_cant_write_dataset(dataset, e)
+            return False
+
+    def _echo_cant_write_dataset(self, dataset, error):
+        click.secho(
+            f"Couldn't write {dataset.table_name} to working copy:\n{error}",
+            err=True,
+            fg="red",
+        )
 
-                if dataset.has_geometry:
-                    self._create_spatial_index_pre(sess, dataset)
+    def _write_full_dataset(
+        self,
+        sess,
+        commit,
+        dataset,
+        i,
+        dataset_count,
+        *,
+        write_meta=True,
+        decode_in_background=False,
+    ):
+        """Writes the table for the given dataset, which is number i of dataset_count being written by write_full."""
+        L = logging.getLogger(f"{self.__class__.__qualname__}.write_full")
+        L.info("Writing dataset %d of %d: %s", i + 1, dataset_count, dataset.path)
 
-                L.info("Creating features...")
-                sql = self._insert_into_dataset(dataset)
-                t0 = time.monotonic()
+        if write_meta and not self._write_full_meta(sess, dataset):
+            return
+        try:
+            # Create the table
+            self._create_table_for_dataset(sess, dataset)
+        except NotYetImplemented as e:
+            self._echo_cant_write_dataset(dataset, e)
+            return
 
-                CHUNK_SIZE = 10000
+        if dataset.has_geometry:
+            self._create_spatial_index_pre(sess, dataset)
 
-                for row_dicts in chunk(
-                    dataset.features_with_crs_ids(
-                        self.repo.spatial_filter, log_progress=L.info
-                    ),
-                    CHUNK_SIZE,
-                ):
-                    sess.execute(sql, row_dicts)
+        L.info("Creating features...")
+        t0 = time.monotonic()
 
-                if dataset.has_geometry:
-                    self._create_spatial_index_post(sess, dataset)
+        CHUNK_SIZE = 10000
 
-                if not dataset.feature_path_encoder.DISTRIBUTED_FEATURES:
-                    # Set up a sequence so that the user doesn't have to supply the next int PK.
-                    self._initialise_sequence(sess, dataset)
+        feature_batches = dataset.iter_feature_batches(
+            CHUNK_SIZE,
+            spatial_filter=self.repo.spatial_filter,
+            with_crs_ids=True,
+            log_progress=L.info,
+        )
+        if decode_in_background:
+            feature_batches = iter_in_background(feature_batches)
+        self._write_feature_batches(sess, dataset, feature_batches)
 
-                self._create_triggers(sess, dataset)
-                self._update_last_write_time(sess, dataset, commit)
+        if dataset.has_geometry:
+            self._create_spatial_index_post(sess, dataset)
 
-                t1 = time.monotonic()
-                L.info(
-                    "Wrote dataset %d of %d in %.1fs: %s",
-                    i + 1,
-                    dataset_count,
-                    t1 - t0,
-                    dataset.path,
+        if not dataset.feature_path_encoder.DISTRIBUTED_FEATURES:
+            # Set up a sequence so that the user doesn't have to supply the next int PK.
+            self._initialise_sequence(sess, dataset)
+
+        self._create_triggers(sess, dataset)
+        self._update_table_statistics(sess, dataset)
+        self._update_last_write_time(sess, dataset, commit)
+
+        t1 = time.monotonic()
+        L.info(
+            "Wrote dataset %d of %d in %.1fs: %s",
+            i + 1,
+            dataset_count,
+            t1 - t0,
+            dataset.path,
+        )
+
+    def _write_full_state(self, sess, commit):
+        self._update_state_table_tree(sess, commit.peel(pygit2.Tree).id.hex)
+        self._update_state_table_spatial_filter_hash(
+            sess, self.repo.spatial_filter.hexhash
+        )
+
+    def _write_feature_batches(self, sess, dataset, feature_batches):
+        """
+        Inserts the given FeatureBatches into the newly created table for the given dataset.
+        Called by write_full before the spatial index (if _create_spatial_index_post is implemented) and the
+        tracking triggers are created, so the table has neither of these while the features are being written.
+        """
+        dialect = self.engine.dialect
+        if not dialect.positional:
+            sql = self._insert_into_dataset(dataset)
+            for batch in feature_batches:
+                sess.execute(sql, list(batch.row_dicts()))
+            return
+
+        # Rather than building a dict per feature for SQLAlchemy to unpack again, the DBAPI's executemany is given
+        # positional rows zipped straight from the batch's columns - so we apply each column's bind processor here.
+        table = self._table_def_for_dataset(dataset)
+        conn = sess.connection()
+        inserts = {}
+        for batch in feature_batches:
+            if not len(batch):
+                continue
+            if batch.column_names not in inserts:
+                inserts[batch.column_names] = _positional_insert(
+                    table, batch.column_names, dialect
                 )
+            sql, param_getters = inserts[batch.column_names]
+            columns = [get_values(batch) for get_values in param_getters]
+            conn.exec_driver_sql(sql, list(zip(*columns)))
 
-            self._update_state_table_tree(sess, commit.peel(pygit2.Tree).id.hex)
-            self._update_state_table_spatial_filter_hash(
-                sess, self.repo.spatial_filter.hexhash
-            )
+    def _update_table_statistics(self, sess, dataset):
+        """
+        Updates the statistics the database uses for query planning, once the table for the given dataset has been
+        completely written. Does nothing by default.
+        """
+        pass
 
     def _write_meta(self, sess, dataset):
         """
@@ -1061,19 +1317,20 @@ class BaseWorkingCopy:
         """Drop the tables for all the given datasets."""
         with self.session() as sess:
             for dataset in datasets:
-                if dataset.has_geometry:
-                    self._drop_spatial_index(sess, dataset)
+                self._drop_table(sess, dataset)
 
-                sess.execute(f"DROP TABLE IF EXISTS {self.table_identifier(dataset)};")
-                self._delete_meta(sess, dataset)
+    def _drop_table(self, sess, dataset):
+        if dataset.has_geometry:
+            self._drop_spatial_index(sess, dataset)
 
-                kart_track = self.kart_tables.kart_track
-                sess.execute(
-                    sa.delete(kart_track).where(
-                        kart_track.c.table_name == dataset.table_name
-                    )
-                )
-                self._drop_sequence(sess, dataset)
+        sess.execute(f"DROP TABLE IF EXISTS {self.table_identifier(dataset)};")
+        self._delete_meta(sess, dataset)
+
+        kart_track = self.kart_tables.kart_track
+        sess.execute(
+            sa.delete(kart_track).where(kart_track.c.table_name == dataset.table_name)
+        )
+        self._drop_sequence(sess, dataset)
 
     def drop_features(self, pk_lists):
         """
@@ -1102,10 +1359,21 @@ class BaseWorkingCopy:
         Rewrites all of the given datasets from scratch to match the given commit, and updates the state table tree.
         Since write_full honours the current repo spatial filter, this also ensures that the working copy spatial
         filter is up to date.
+        Datasets are written concurrently when write_full would write them concurrently, as long as dropping the
+        existing tables can be rolled back - see _write_full_concurrently.
         """
         if not force:
             self.check_not_dirty()
 
+        num_workers = self._write_full_num_workers(datasets)
+        if self._can_write_full_concurrently(num_workers, drop_existing=True):
+            self.repo.odb.refresh()
+            with pause_refreshing(self.repo.odb):
+                self._write_full_concurrently(
+                    commit, datasets, num_workers, drop_existing=True
+                )
+            return
+
         with self.session() as _:
             self.drop_tables(commit, *datasets)
             self.write_full(commit, *datasets)
@@ -1298,6 +1566,13 @@ class BaseWorkingCopy:
 
         self._update_last_write_time(sess, target_ds, commit)
 
+    # Feature changes are applied to the working copy in batches of this many - see _apply_feature_diff.
+    APPLY_BATCH_SIZE = 10000
+
+    # False if upserting a feature doesn't fire the table's DELETE triggers for the row it replaces - in which case
+    # _apply_feature_diff deletes updated features before upserting them, so the delete triggers still fire.
+    UPSERT_FIRES_DELETE_TRIGGERS = True
+
     def _apply_feature_diff(
         self,
         sess,
@@ -1312,6 +1587,9 @@ class BaseWorkingCopy:
         one commit checked out such that they have a different commit checked out - doesn't actually support applying
         arbitrary feature diffs to a table.
 
+        The feature diff is streamed rather than loaded into memory: inserted and updated features are upserted in
+        batches, and the PKs of deleted features are staged in a temporary table so they can all be deleted at once.
+
         sess - sqlalchemy session.
         base_ds - the dataset that contains the features in their current state
         target_ds - the dataset that contains the features in their desired state.
@@ -1319,13 +1597,11 @@ class BaseWorkingCopy:
         track_changes_as_dirty - whether to track these changes as working-copy edits in the tracking table.
         """
 
-        feature_diff = DeltaDiff(base_ds.diff_feature(target_ds, feature_filter))
-
-        if not feature_diff:
+        deltas = base_ds.diff_feature(target_ds, feature_filter)
+        first_delta = next(deltas, None)
+        if first_delta is None:
             return
-
-        pks = list(feature_diff.keys())
-        L.debug("Applying feature diff: about %s changes", len(pks))
+        deltas = itertools.chain([first_delta], deltas)
 
         if not track_changes_as_dirty:
             # We don't want to track these changes as working copy edits - they will be part of the new WC base.
@@ -1334,9 +1610,103 @@ class BaseWorkingCopy:
             # We want to track these changes as working copy edits so they can be committed later.
             ctx = contextlib.nullcontext()
 
-        with ctx:
-            self._delete_features(sess, target_ds, pks)
-            self._write_features(sess, target_ds, pks, ignore_missing=True)
+        spatial_filter = self.repo.spatial_filter.transform_for_dataset(target_ds)
+        upsert_sql = self._insert_or_replace_into_dataset(target_ds)
+        delete_count = write_count = 0
+
+        with ctx, self._staged_pks_table(sess) as staged_pks:
+            for batch in chunk(deltas, self.APPLY_BATCH_SIZE):
+                pks_to_delete = []
+                pks_to_replace = []
+                features_to_write = []
+                for delta in batch:
+                    feature = None
+                    if delta.new is not None:
+                        try:
+                            feature = delta.new_value
+                        except KeyError:
+                            # Not present locally - presumably it doesn't match the spatial filter.
+                            pass
+                    if feature is not None and spatial_filter.matches(feature):
+                        features_to_write.append(feature)
+                        if delta.old is not None:
+                            pks_to_replace.append(delta.old_key)
+                    else:
+                        # Deleted, or it no longer matches the spatial filter.
+                        pks_to_delete.append(delta.key)
+
+                if pks_to_delete:
+                    sess.execute(
+                        staged_pks.insert(), [{"pk": str(pk)} for pk in pks_to_delete]
+                    )
+                    delete_count += len(pks_to_delete)
+                if features_to_write:
+                    if not self.UPSERT_FIRES_DELETE_TRIGGERS:
+                        self._delete_features(sess, target_ds, pks_to_replace)
+                    sess.execute(
+                        upsert_sql,
+                        list(target_ds._add_crs_ids_to_features(features_to_write)),
+                    )
+                    write_count += len(features_to_write)
+
+            if delete_count:
+                self._delete_staged_features(sess, target_ds, staged_pks)
+
+        L.debug(
+            "Applied feature diff: %s features written, %s deleted",
+            write_count,
+            delete_count,
+        )
+
+    def _create_staged_pks_table(self):
+        """
+        Returns a sqlalchemy table definition for a temporary table with a single "pk" column - of the same type as the
+        tracking table's pk column - for staging the PKs of features that are to be modified in bulk.
+        """
+        return sa.Table(
+            "kart_staged_pks",
+            sa.MetaData(),
+            sa.Column("pk", self.kart_tables.kart_track.c.pk.type, primary_key=True),
+            prefixes=["TEMPORARY"],
+        )
+
+    @contextlib.contextmanager
+    def _staged_pks_table(self, sess):
+        """
+        Context manager. Creates the temporary table for staging PKs, and drops it again afterwards - even if an error
+        is raised, since on some databases the table would otherwise outlive the session on the pooled connection.
+        """
+        staged_pks = self._create_staged_pks_table()
+        staged_pks.create(sess.connection())
+        try:
+            yield staged_pks
+        except BaseException:
+            # The transaction may already be unusable (eg on PostgreSQL, which drops the table on rollback anyway).
+            # Either way, the original error is the one to raise.
+            with contextlib.suppress(sa.exc.SQLAlchemyError):
+                self._drop_staged_pks_table(sess, staged_pks)
+            raise
+        self._drop_staged_pks_table(sess, staged_pks)
+
+    def _drop_staged_pks_table(self, sess, staged_pks):
+        sess.execute(sa.schema.DropTable(staged_pks, if_exists=True))
+
+    def _delete_staged_features(self, sess, dataset, staged_pks):
+        """Deletes all of the features whose PKs are in the given staging table from the table for the dataset."""
+        table = self._table_def_for_dataset(dataset)
+        pk_column = table.columns[dataset.primary_key]
+        staged_pk = staged_pks.c.pk
+
+        if not self._tracking_table_requires_cast:
+            pk_expr = pk_column.in_(sa.select([staged_pk]))
+        elif dataset.schema.pk_columns[0].data_type == "integer":
+            # Cast the staged PKs rather than the table's PKs, so that the table's primary key index can be used.
+            pk_expr = pk_column.in_(sa.select([sa.cast(staged_pk, sa.BigInteger)]))
+        else:
+            pk_expr = sa.cast(pk_column, staged_pk.type).in_(sa.select([staged_pk]))
+
+        r = sess.execute(sa.delete(table).where(pk_expr))
+        return r.rowcount
 
     def _is_meta_update_supported(self, meta_diff):
         """
@@ -1455,3 +1825,56 @@ def pause_refreshing(odb):
         yield
     finally:
         odb.set_lookup_flags(old_flags)
+
+
+# Marks a feature that could not be decoded since its blob is promised but not present locally.
+_PROMISED = object()
+
+
+def _decode_repo_features(dataset, items):
+    """
+    Reads and decodes each of the given features. items is a sequence of (index, pk_values, path, blob) tuples -
+    returns a list of (index, feature) tuples, where feature is _PROMISED if the blob is not present locally.
+    """
+    result = []
+    for i, pk_values, path, blob in items:
+        try:
+            feature = dataset.get_feature(
+                pk_values, path=path, data=memoryview(blob)
+            )
+        except KeyError as e:
+            if not object_is_promised(e):
+                raise
+            feature = _PROMISED
+        result.append((i, feature))
+    return result
+
+
+def _positional_insert(table, column_names, dialect):
+    """
+    Compiles an INSERT of the given columns into the given table, for a dialect with a positional paramstyle.
+    Returns the SQL, and for each of its parameters in order, a function that returns that parameter's values
+    for each feature in a FeatureBatch, converted by the parameter's bind processor. Most parameters are columns,
+    but some dialects add constants - eg, the CRS ID passed to the SQL function that converts geometries.
+    """
+    compiled = table.insert().compile(dialect=dialect, column_keys=list(column_names))
+    param_getters = []
+    for name in compiled.positiontup:
+        bind = compiled.binds[name]
+        prewrite = bind.type.bind_processor(dialect)
+        if name in column_names:
+            param_getters.append(_column_getter(name, prewrite))
+        else:
+            value = bind.effective_value
+            if prewrite is not None:
+                value = prewrite(value)
+            param_getters.append(
+                lambda batch, value=value: itertools.repeat(value, len(batch))
+            )
+    return compiled.string, param_getters
+
+
+def _column_getter(name, prewrite):
+    if prewrite is None:
+        return lambda batch: batch.column(name)
+    return lambda batch: [prewrite(v) for v in batch.column(name)]
@@ -16,6 +16,9 @@ from .base import BaseWorkingCopy
 class DatabaseServer_WorkingCopy(BaseWorkingCopy):
     """Functionality common to working copies that connect to a database server."""
 
+    # Each session has its own connection to the server.
+    SUPPORTS_CONCURRENT_WRITES = True
+
     @property
     @classmethod
     def URI_SCHEME(cls):
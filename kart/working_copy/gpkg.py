@@ -6,7 +6,6 @@ from datetime import datetime
 from pathlib import Path
 
 import click
-from osgeo import gdal
 
 import sqlalchemy as sa
 from kart import crs_util
@@ -34,6 +33,10 @@ class WorkingCopy_GPKG(BaseWorkingCopy):
 
     WORKING_COPY_TYPE_NAME = "GPKG"
 
+    # INSERT OR REPLACE doesn't fire DELETE triggers since recursive_triggers is off, and the RTree insert trigger
+    # skips NULL and empty geometries - so the old envelope of a geometry that became NULL would stay in the RTree.
+    UPSERT_FIRES_DELETE_TRIGGERS = False
+
     def __init__(self, repo, location):
         self.repo = repo
         self.path = self.location = location
@@ -98,14 +101,18 @@ class WorkingCopy_GPKG(BaseWorkingCopy):
     def _tracking_table_requires_cast(self):
         return False
 
+    # Cache size used while bulk-loading features during a full checkout.
+    BULK_LOAD_CACHE_SIZE_MiB = 1024
+
     @contextlib.contextmanager
-    def session(
-        self,
-    ):
+    def session(self, bulk_load=False):
         """
         Context manager for GeoPackage DB sessions, yields a connection object inside a transaction
 
         Calling again yields the _same_ connection, the transaction/etc only happen in the outer one.
+
+        bulk_load - if True, the outer session trades durability for write speed while it is open - see
+            _bulk_load_pragmas. Has no effect on an inner call.
         """
         L = logging.getLogger(f"{self.__class__.__qualname__}.session")
 
@@ -121,19 +128,58 @@ class WorkingCopy_GPKG(BaseWorkingCopy):
         self._session = self.sessionmaker()
 
         try:
-            # TODO - use tidier syntax for opening transactions from sqlalchemy.
-            self._session.execute("BEGIN TRANSACTION;")
-            yield self._session
-            self._session.commit()
-
-        except Exception:
-            self._session.rollback()
-            raise
+            with contextlib.ExitStack() as stack:
+                if bulk_load:
+                    # These pragmas can't be changed inside a transaction, so they are set first.
+                    stack.enter_context(self._bulk_load_pragmas(self._session))
+                try:
+                    # TODO - use tidier syntax for opening transactions from sqlalchemy.
+                    self._session.execute("BEGIN TRANSACTION;")
+                    yield self._session
+                    self._session.commit()
+
+                except Exception:
+                    self._session.rollback()
+                    raise
         finally:
             self._session.close()
             del self._session
             L.debug("session: new/done")
 
+    @contextlib.contextmanager
+    def _bulk_load_pragmas(self, sess):
+        """
+        Sets pragmas that make writing millions of rows much faster, at the cost of durability if the OS crashes
+        mid-write - which is fine for a full checkout, since it can just be redone.
+        The original settings are restored afterwards.
+        """
+        orig_journal_mode = sess.scalar("PRAGMA journal_mode;")
+        orig_synchronous = sess.scalar("PRAGMA synchronous;")
+        orig_cache_size = sess.scalar("PRAGMA cache_size;")
+
+        # Not journal_mode=OFF - that would make ROLLBACK unsafe if the checkout fails.
+        sess.execute("PRAGMA journal_mode = MEMORY;")
+        sess.execute("PRAGMA synchronous = OFF;")
+        sess.execute(f"PRAGMA cache_size = -{self.BULK_LOAD_CACHE_SIZE_MiB * 1024};")
+        sess.execute("PRAGMA locking_mode = EXCLUSIVE;")
+        try:
+            yield
+        finally:
+            sess.execute("PRAGMA locking_mode = NORMAL;")
+            sess.execute(f"PRAGMA cache_size = {orig_cache_size};")
+            sess.execute(f"PRAGMA synchronous = {orig_synchronous};")
+            # Changing the journal mode also releases the exclusive lock.
+            sess.execute(f"PRAGMA journal_mode = {orig_journal_mode};")
+
+    def write_full(self, commit, *datasets):
+        if hasattr(self, "_session"):
+            # Already inside a transaction - too late to change how it is journalled.
+            super().write_full(commit, *datasets)
+            return
+
+        with self.session(bulk_load=True):
+            super().write_full(commit, *datasets)
+
     def delete(self, keep_db_schema_if_possible=False):
         """Delete the working copy files."""
         self.full_path.unlink()
@@ -183,6 +229,8 @@ class WorkingCopy_GPKG(BaseWorkingCopy):
     def create_and_initialise(self):
         # GDAL: Create GeoPackage
         # GDAL: Add metadata/etc
+        from osgeo import gdal
+
         gdal_driver = gdal.GetDriverByName("GPKG")
         gdal_ds = gdal_driver.Create(str(self.full_path), 0, 0, 0, gdal.GDT_Unknown)
         del gdal_ds
@@ -438,15 +486,19 @@ class WorkingCopy_GPKG(BaseWorkingCopy):
         sess.execute(sa.delete(table).where(table.c.id.in_(ids)))
 
     def _create_spatial_index_pre(self, sess, dataset):
-        # Implementing only _create_spatial_index_pre:
-        # gpkgAddSpatialIndex has to be called before writing any features,
-        # since it only adds on-write triggers to update the index - it doesn't
-        # add any pre-existing features to the index.
+        # The spatial index is created after the features are written - see _create_spatial_index_post -
+        # so that writing each feature doesn't also fire the RTree triggers.
 
         # Generally, there shouldn't be an existing spatial index at this stage.
         # But if there is, we should clean it up and start over.
         self._drop_spatial_index(sess, dataset)
 
+    def _create_spatial_index_post(self, sess, dataset):
+        # gpkgAddSpatialIndex only creates the RTree table and the on-write triggers that keep it up to date -
+        # it doesn't add any pre-existing features to the index. So we populate the index in one pass afterwards,
+        # using the same values that the triggers would have inserted. The triggers key the index on the table's
+        # integer primary key - which isn't the dataset's primary key if that isn't an integer (see auto_int_pk) -
+        # so we select ROWID, which is always an alias for it.
         L = logging.getLogger(f"{self.__class__.__qualname__}._create_spatial_index")
         geom_col = dataset.geom_column_name
 
@@ -459,6 +511,19 @@ class WorkingCopy_GPKG(BaseWorkingCopy):
             {"table": dataset.table_name, "geom": geom_col},
         )
 
+        rtree_table = f"rtree_{dataset.table_name}_{geom_col}"
+        quoted_geom_col = self.quote(geom_col)
+        sess.execute(
+            f"""
+            INSERT OR REPLACE INTO {self.quote(rtree_table)} (id, minx, maxx, miny, maxy)
+            SELECT ROWID,
+                ST_MinX({quoted_geom_col}), ST_MaxX({quoted_geom_col}),
+                ST_MinY({quoted_geom_col}), ST_MaxY({quoted_geom_col})
+            FROM {self.table_identifier(dataset)}
+            WHERE {quoted_geom_col} NOT NULL AND NOT ST_IsEmpty({quoted_geom_col});
+            """
+        )
+
         L.info("Created spatial index in %.1fs", time.monotonic() - t0)
 
     def _drop_spatial_index(self, sess, dataset):
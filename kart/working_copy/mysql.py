@@ -2,6 +2,7 @@ import contextlib
 import logging
 import time
 
+import sqlalchemy as sa
 from kart import crs_util
 from kart.sqlalchemy import separate_last_path_part, text_with_inlined_params
 from kart.sqlalchemy.adapter.mysql import KartAdapter_MySql
@@ -35,6 +36,10 @@ class WorkingCopy_MySql(DatabaseServer_WorkingCopy):
     """
 
     WORKING_COPY_TYPE_NAME = "MySQL"
+
+    # Most DDL statements implicitly commit the current transaction.
+    SUPPORTS_TRANSACTIONAL_DDL = False
+
     URI_SCHEME = "mysql"
 
     URI_FORMAT = "//HOST[:PORT]/DBNAME"
@@ -122,6 +127,23 @@ class WorkingCopy_MySql(DatabaseServer_WorkingCopy):
         # permissions to create or delete CRS definitions. Better to just leave things as-is.
         pass
 
+    def _create_staged_pks_table(self):
+        # The connection has no default database, so the temporary table needs the same db_schema as our other tables.
+        kart_track = self.kart_tables.kart_track
+        return sa.Table(
+            "kart_staged_pks",
+            sa.MetaData(),
+            sa.Column("pk", kart_track.c.pk.type, primary_key=True),
+            schema=kart_track.schema,
+            prefixes=["TEMPORARY"],
+        )
+
+    def _drop_staged_pks_table(self, sess, staged_pks):
+        # Unlike DROP TABLE, DROP TEMPORARY TABLE doesn't implicitly commit the transaction.
+        sess.execute(
+            f"DROP TEMPORARY TABLE IF EXISTS {self.table_identifier(staged_pks)};"
+        )
+
     def _create_spatial_index_post(self, sess, dataset):
         # Only implemented as _create_spatial_index_post:
         # It is more efficient to write the features first, then index them all in bulk.
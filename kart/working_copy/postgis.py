@@ -1,11 +1,12 @@
 import contextlib
 import hashlib
+import io
 import logging
 import time
 
 from kart import crs_util
 from kart.sqlalchemy import separate_last_path_part
-from kart.sqlalchemy.adapter.postgis import KartAdapter_Postgis
+from kart.sqlalchemy.adapter.postgis import GeometryType, KartAdapter_Postgis
 from kart.tabular.schema import Schema
 from sqlalchemy import Index
 from sqlalchemy.dialects.postgresql.base import PGIdentifierPreparer
@@ -16,6 +17,11 @@ from .table_defs import PostgisKartTables
 
 POSTGRES_MAX_IDENTIFIER_LENGTH = 63
 
+# Characters that must be backslash-escaped in COPY's text format.
+_COPY_TEXT_ESCAPES = str.maketrans(
+    {"\\": "\\\\", "\n": "\\n", "\r": "\\r", "\t": "\\t"}
+)
+
 
 class WorkingCopy_Postgis(DatabaseServer_WorkingCopy):
     """
@@ -159,6 +165,36 @@ class WorkingCopy_Postgis(DatabaseServer_WorkingCopy):
         # permissions to create or delete CRS definitions. Better to just leave things as-is.
         pass
 
+    def _write_feature_batches(self, sess, dataset, feature_batches):
+        # Much faster than INSERT: each batch is streamed to the server using COPY ... FROM STDIN.
+        table = self._table_def_for_dataset(dataset)
+        dialect = self.engine.dialect
+        cursor = sess.connection().connection.cursor()
+        try:
+            for batch in feature_batches:
+                formatters = [
+                    _copy_text_formatter(table.columns[name].type, dialect)
+                    for name in batch.column_names
+                ]
+                buf = io.StringIO()
+                for row in batch.rows():
+                    buf.write(
+                        "\t".join(fmt(value) for fmt, value in zip(formatters, row))
+                    )
+                    buf.write("\n")
+                buf.seek(0)
+
+                col_names = ", ".join(self.quote(name) for name in batch.column_names)
+                cursor.copy_expert(
+                    f"COPY {self.table_identifier(dataset)} ({col_names}) FROM STDIN;",
+                    buf,
+                )
+        finally:
+            cursor.close()
+
+    def _update_table_statistics(self, sess, dataset):
+        sess.execute(f"""ANALYZE {self.table_identifier(dataset)};""")
+
     def _create_spatial_index_post(self, sess, dataset):
         # Only implemented as _create_spatial_index_post:
         # It is more efficient to write the features first, then index them all in bulk.
@@ -182,7 +218,6 @@ class WorkingCopy_Postgis(DatabaseServer_WorkingCopy):
             index_name, table.columns[geom_col], postgresql_using="GIST"
         )
         spatial_index.create(sess.connection())
-        sess.execute(f"""ANALYZE {self.table_identifier(dataset)};""")
 
         L.info("Created spatial index in %.1fs", time.monotonic() - t0)
 
@@ -348,3 +383,33 @@ class WorkingCopy_Postgis(DatabaseServer_WorkingCopy):
             sess.execute(
                 f"""ALTER TABLE {self.table_identifier(table)} ALTER COLUMN {self.quote(col.name)} TYPE {dest_type};"""
             )
+
+
+def _copy_text_formatter(column_type, dialect):
+    """
+    Returns a function that formats a value for the given column in PostgreSQL's COPY text format -
+    applying the same conversion as would be applied to the value if it was inserted using SQLAlchemy.
+    """
+    if isinstance(column_type, GeometryType):
+        # PostGIS parses hex EWKB as geometry input.
+        prewrite = _geometry_to_hex_ewkb
+    else:
+        prewrite = column_type.bind_processor(dialect)
+
+    def formatter(value):
+        if prewrite is not None and value is not None:
+            value = prewrite(value)
+        if value is None:
+            return "\\N"
+        if value is True or value is False:
+            return "t" if value else "f"
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            # bytea hex format - the backslash itself needs escaping.
+            return "\\\\x" + bytes(value).hex()
+        return str(value).translate(_COPY_TEXT_ESCAPES)
+
+    return formatter
+
+
+def _geometry_to_hex_ewkb(geom):
+    return geom.to_ewkb().hex()
@@ -2,6 +2,7 @@ import contextlib
 import logging
 import time
 
+import sqlalchemy as sa
 from kart import crs_util
 from kart.sqlalchemy import separate_last_path_part, text_with_inlined_params
 from kart.sqlalchemy.adapter.sqlserver import KartAdapter_SqlServer
@@ -100,6 +101,14 @@ class WorkingCopy_SqlServer(DatabaseServer_WorkingCopy):
         max_y = (max_y - centre_y) * scale_factor + centre_y
         return min_x, min_y, max_x, max_y
 
+    def _create_staged_pks_table(self):
+        # SQL Server has no CREATE TEMPORARY TABLE - instead, tables whose names start with # are temporary.
+        return sa.Table(
+            "#kart_staged_pks",
+            sa.MetaData(),
+            sa.Column("pk", self.kart_tables.kart_track.c.pk.type, primary_key=True),
+        )
+
     def _create_spatial_index_post(self, sess, dataset):
         # Only implementing _create_spatial_index_post:
         # We need to know the rough extent of the data to create an index in that area,
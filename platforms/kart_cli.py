@@ -1,4 +1,8 @@
+import multiprocessing
+
 import kart.cli
 
 if __name__ == "__main__":
+    # Needed for worker processes to start in a frozen (PyInstaller) build.
+    multiprocessing.freeze_support()
     kart.cli.entrypoint()
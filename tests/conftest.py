@@ -9,6 +9,7 @@ import random
 import re
 import shutil
 import subprocess
+import sys
 import tarfile
 import time
 import uuid
@@ -456,6 +457,34 @@ def helpers():
     return TestHelpers
 
 
+_MAX_RSS_SCRIPT = """
+import resource, sys
+from kart.cli import cli
+try:
+    cli(sys.argv[1:])
+except SystemExit:
+    pass
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+@pytest.helpers.register
+def kart_max_rss(repo_path, *args):
+    """
+    Runs kart with the given args in a new process, in the given repo, and returns the peak memory use (RSS)
+    of that process, in bytes.
+    """
+    r = subprocess.run(
+        [sys.executable, "-c", _MAX_RSS_SCRIPT, "-C", str(repo_path), *args],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    max_rss = int(r.stdout.split()[-1])
+    # ru_maxrss is in bytes on macOS, and in kilobytes everywhere else.
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
 @pytest.helpers.register
 def get_env_flag(env_var, ci_default=True):
     """
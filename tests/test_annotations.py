@@ -2,11 +2,15 @@ import logging
 import platform
 import shutil
 import stat
+import sys
 from contextlib import contextmanager
 from pathlib import Path
 
 import pytest
+from pysqlite3 import dbapi2 as sqlite
 
+from kart.annotations.db import KartTreeBlobCount, KartTreeDiff, annotations_session
+from kart.repo import KartRepo
 
 H = pytest.helpers.helpers()
 
@@ -35,11 +39,22 @@ def test_build_annotations(data_archive, cli_runner, caplog):
     with data_archive("points"):
         r = cli_runner.invoke(["build-annotations", "--all-reachable"])
         assert r.exit_code == 0, r.stderr
-        assert r.stdout.splitlines() == [
+        lines = r.stdout.splitlines()
+        assert lines[:4] == [
             "Enumerating reachable commits...",
             "Building feature change counts...",
             "(1/2): 1582725 Improve naming on Coromandel East coast",
             "(2/2): 6e2984a Import from nz-pa-points-topo-150k.gpkg",
+        ]
+        assert lines[4].startswith("Built feature change counts for 2 commits in ")
+        assert lines[5:] == ["done."]
+
+        # Already-annotated commits are skipped.
+        r = cli_runner.invoke(["build-annotations", "--all-reachable"])
+        assert r.exit_code == 0, r.stderr
+        assert r.stdout.splitlines() == [
+            "Enumerating reachable commits...",
+            "Skipped 2 commits that were already annotated",
             "done.",
         ]
 
@@ -60,6 +75,77 @@ def test_build_annotations(data_archive, cli_runner, caplog):
         ]
 
 
+def test_build_annotations_worker_processes(data_archive, cli_runner, monkeypatch):
+    monkeypatch.setattr(sys.modules["kart.annotations.cli"], "BUILD_BATCH_SIZE", 1)
+    with data_archive("points") as repo_path:
+        r = cli_runner.invoke(
+            ["build-annotations", "--all-reachable", "--num-processes=2"]
+        )
+        assert r.exit_code == 0, r.stderr
+        assert "(2/2): 6e2984a Import from nz-pa-points-topo-150k.gpkg" in r.stdout
+
+        repo = KartRepo(repo_path)
+        head = repo.head_commit
+        assert repo.diff_annotations.get(
+            base=head.parents[0],
+            target=head,
+            annotation_type="feature-change-counts-exact",
+        ) == {H.POINTS.LAYER: 5}
+        assert repo.diff_annotations.get(
+            base=repo.empty_tree,
+            target=head.parents[0],
+            annotation_type="feature-change-counts-exact",
+        ) == {H.POINTS.LAYER: H.POINTS.ROWCOUNT}
+
+
+def test_store_many_annotations(data_archive, monkeypatch):
+    import sqlalchemy
+    import kart.annotations.db
+
+    statements = []
+    orig_sqlite_engine = kart.annotations.db.sqlite_engine
+
+    def _sqlite_engine(path):
+        engine = orig_sqlite_engine(path)
+        sqlalchemy.event.listen(
+            engine,
+            "connect",
+            lambda conn, record: conn.set_trace_callback(statements.append),
+        )
+        return engine
+
+    monkeypatch.setattr(kart.annotations.db, "sqlite_engine", _sqlite_engine)
+
+    with data_archive("points") as repo_path:
+        repo = KartRepo(repo_path)
+        annotations = repo.diff_annotations
+        commits = [repo.head_commit, repo.head_commit.parents[0]]
+        object_ids = [
+            annotations.object_id(c.parents[0] if c.parents else repo.empty_tree, c)
+            for c in commits
+        ]
+
+        def store_many(value):
+            del statements[:]
+            annotations.store_many(
+                annotation_type="test",
+                items=[(o, {"value": value}) for o in object_ids],
+            )
+            # All the rows are written in a single transaction.
+            return [
+                s.split()[0].upper()
+                for s in statements
+                if s.split()[0].upper() in ("BEGIN", "INSERT", "COMMIT")
+            ]
+
+        assert store_many(1) == ["BEGIN", "INSERT", "INSERT", "COMMIT"]
+        # Existing annotations are replaced.
+        assert store_many(2) == ["BEGIN", "INSERT", "INSERT", "COMMIT"]
+        assert annotations.get(
+            base=commits[0].parents[0], target=commits[0], annotation_type="test"
+        ) == {"value": 2}
+
+
 @pytest.mark.parametrize(
     "existing_db_path",
     [
@@ -151,3 +237,128 @@ def test_diff_feature_count_with_readonly_repo_dir(data_archive, cli_runner, cap
                 in messages
             )
             assert "Can't store annotation; annotations.db is read-only" in messages
+
+
+def test_tree_diff_cache(data_archive):
+    with data_archive("points") as repo_path:
+        repo = KartRepo(repo_path)
+        old_ds = repo.datasets("HEAD^")[H.POINTS.LAYER]
+        new_ds = repo.datasets("HEAD")[H.POINTS.LAYER]
+        old_tree, new_tree = old_ds.feature_tree, new_ds.feature_tree
+
+        def _changes(diff):
+            return [(d.status_char(), d.new_file.path) for d in diff.deltas]
+
+        expected = _changes(old_tree.diff_to_tree(new_tree))
+        expected_reversed = _changes(new_tree.diff_to_tree(old_tree))
+        assert len(expected) == 5
+
+        cache = repo.tree_diff_cache
+        assert _changes(cache.diff_trees(old_tree, new_tree)) == expected
+        with annotations_session(repo) as session:
+            num_entries = session.query(KartTreeDiff).count()
+        assert num_entries > 0
+
+        # Served from the cache this time - in either direction.
+        assert _changes(cache.diff_trees(old_tree, new_tree)) == expected
+        assert _changes(cache.diff_trees(new_tree, old_tree)) == expected_reversed
+        with annotations_session(repo) as session:
+            assert session.query(KartTreeDiff).count() == num_entries
+
+        # Least recently used entries are evicted once the cache is full.
+        cache.MAX_TOTAL_SIZE = 0
+        changes = _changes(cache.diff_trees(new_tree, repo.empty_tree))
+        assert len(changes) == H.POINTS.ROWCOUNT
+        with annotations_session(repo) as session:
+            assert session.query(KartTreeDiff).count() == 0
+
+
+def test_tree_diff_cache_is_opt_in(data_archive, cli_runner):
+    with data_archive("points") as repo_path:
+        repo = KartRepo(repo_path)
+
+        def _num_entries():
+            with annotations_session(repo) as session:
+                return session.query(KartTreeDiff).count()
+
+        r = cli_runner.invoke(["diff", "HEAD^...HEAD"])
+        assert r.exit_code == 0, r.stderr
+        assert _num_entries() == 0
+
+        repo.config["kart.diff.treeDiffCache"] = True
+        r = cli_runner.invoke(["diff", "HEAD^...HEAD"])
+        assert r.exit_code == 0, r.stderr
+        assert _num_entries() > 0
+
+
+def test_tree_diff_cache_with_locked_db(data_archive, caplog):
+    with data_archive("points") as repo_path:
+        repo = KartRepo(repo_path)
+        old_tree = repo.datasets("HEAD^")[H.POINTS.LAYER].feature_tree
+        new_tree = repo.datasets("HEAD")[H.POINTS.LAYER].feature_tree
+        with annotations_session(repo):
+            pass
+
+        # Some other process is writing to the annotations db.
+        db = sqlite.connect(str(repo.gitdir_path / "annotations.db"), timeout=0)
+        db.isolation_level = None
+        db.execute("BEGIN IMMEDIATE;")
+        try:
+            caplog.set_level(logging.INFO)
+            changes = list(repo.tree_diff_cache.iter_changes(old_tree, new_tree))
+            assert len(changes) == 5
+        finally:
+            db.execute("ROLLBACK;")
+            db.close()
+
+        assert any("Can't store tree diffs" in r.message for r in caplog.records)
+        with annotations_session(repo) as session:
+            assert session.query(KartTreeDiff).count() == 0
+
+
+def test_tree_blob_counts(data_archive):
+    with data_archive("points") as repo_path:
+        repo = KartRepo(repo_path)
+        old_ds = repo.datasets("HEAD^")[H.POINTS.LAYER]
+        new_ds = repo.datasets("HEAD")[H.POINTS.LAYER]
+
+        def _num_entries():
+            with annotations_session(repo) as session:
+                return session.query(KartTreeBlobCount).count()
+
+        assert _num_entries() == 0
+        assert old_ds.feature_count == sum(1 for b in old_ds.feature_blobs())
+        num_old_entries = _num_entries()
+        assert num_old_entries > 0
+
+        # Only the subtrees that changed between HEAD^ and HEAD need to be counted.
+        assert new_ds.feature_count == sum(1 for b in new_ds.feature_blobs())
+        num_new_entries = _num_entries() - num_old_entries
+        assert 0 < num_new_entries < num_old_entries
+
+        # Served from the cache this time.
+        assert new_ds.feature_count == H.POINTS.ROWCOUNT
+        assert _num_entries() == num_old_entries + num_new_entries
+
+
+def test_tree_blob_counts_with_locked_db(data_archive, caplog):
+    with data_archive("points") as repo_path:
+        repo = KartRepo(repo_path)
+        dataset = repo.datasets()[H.POINTS.LAYER]
+        with annotations_session(repo):
+            pass
+
+        # Some other process is writing to the annotations db - the count isn't stored, but there's no waiting for it.
+        db = sqlite.connect(str(repo.gitdir_path / "annotations.db"), timeout=0)
+        db.isolation_level = None
+        db.execute("BEGIN IMMEDIATE;")
+        try:
+            caplog.set_level(logging.INFO)
+            assert dataset.feature_count == H.POINTS.ROWCOUNT
+        finally:
+            db.execute("ROLLBACK;")
+            db.close()
+
+        assert any("Can't store tree blob counts" in r.message for r in caplog.records)
+        with annotations_session(repo) as session:
+            assert session.query(KartTreeBlobCount).count() == 0
@@ -689,6 +689,111 @@ def test_apply_multiple_dataset_patch_roundtrip(data_archive, cli_runner):
         assert new_patch_json == patch_json
 
 
+def test_apply_streaming_patch(data_archive, cli_runner, monkeypatch):
+    from kart.json_stream import JsonStreamReader
+    from kart.tabular.rich_table_dataset import RichTableDataset
+
+    # Patches written by `kart create-patch` have the patch metadata first, so the diff can be streamed.
+    with open(patches / "points-1U-1D-1I.kartpatch") as f:
+        original_patch = json.load(f)
+    patch = {
+        "kart.patch/v1": original_patch["kart.patch/v1"],
+        "kart.diff/v1+hexwkb": original_patch["kart.diff/v1+hexwkb"],
+    }
+    monkeypatch.setattr(JsonStreamReader, "CHUNK_SIZE", 16)
+    monkeypatch.setattr(RichTableDataset, "APPLY_FLUSH_INTERVAL", 1)
+
+    with data_archive("points"):
+        r = cli_runner.invoke(["apply", "-"], input=json.dumps(patch, indent=2))
+        assert r.exit_code == 0, r.stderr
+
+        r = cli_runner.invoke(["create-patch", "HEAD"])
+        assert r.exit_code == 0, r.stderr
+        assert (
+            json.loads(r.stdout)["kart.diff/v1+hexwkb"]
+            == original_patch["kart.diff/v1+hexwkb"]
+        )
+
+
+def test_apply_streaming_patch_meta_after_features(data_archive, cli_runner):
+    patch = {
+        "kart.patch/v1": {"message": "hey"},
+        "kart.diff/v1+hexwkb": {
+            H.POINTS.LAYER: {
+                "feature": [],
+                "meta": {"title": {"-": "old title", "+": "new title"}},
+            }
+        },
+    }
+    with data_archive("points"):
+        r = cli_runner.invoke(["apply", "-"], input=json.dumps(patch))
+        assert r.exit_code == 1, r
+        assert "meta changes for nz_pa_points_topo_150k must come before" in r.stderr
+
+
+def test_apply_streaming_patch_malformed_feature(data_archive, cli_runner):
+    with open(patches / "points-1U-1D-1I.kartpatch") as f:
+        original_patch = json.load(f)
+    patch = {
+        "kart.patch/v1": original_patch["kart.patch/v1"],
+        "kart.diff/v1+hexwkb": original_patch["kart.diff/v1+hexwkb"],
+    }
+    patch_text = json.dumps(patch, indent=2)
+    # Add a stray brace after the last feature change - which isn't read until the earlier ones have been applied.
+    last_brace = patch_text.rindex("}", 0, patch_text.rindex("]"))
+    patch_text = patch_text[:last_brace] + "}}" + patch_text[last_brace + 1 :]
+
+    with data_archive("points"):
+        r = cli_runner.invoke(["apply", "-"], input=patch_text)
+        assert r.exit_code == 1, r
+        assert "Failed to parse JSON patch file" in r.stderr
+
+
+@pytest.mark.slow
+def test_apply_large_patch_memory(data_archive, cli_runner, tmp_path, benchmark):
+    # Applies a patch that inserts a million features, and measures the peak memory use of the apply process -
+    # which should be about the same as for a patch five times smaller. (Both patches are larger than
+    # APPLY_FLUSH_INTERVAL, so both buffer the same number of new features at most).
+    def _write_patch(num_features):
+        patch_path = tmp_path / f"{num_features}.kartpatch"
+        with open(patch_path, "w") as f:
+            f.write('{"kart.patch/v1": {"message": "Large patch"},\n')
+            f.write(f'"kart.diff/v1+hexwkb": {{"{H.POINTS.LAYER}": {{"feature": [\n')
+            for i in range(num_features):
+                feature = {
+                    "fid": 100_000 + i,
+                    "geom": "010100000000000000000000000000000000000000",
+                    "t50_fid": i,
+                    "name_ascii": None,
+                    "macronated": "N",
+                    "name": None,
+                }
+                f.write(("," if i else "") + json.dumps({"+": feature}) + "\n")
+            f.write("]}}}\n")
+        return patch_path
+
+    small_patch = _write_patch(200_000)
+    large_patch = _write_patch(1_000_000)
+
+    with data_archive("points") as repo_path:
+        r = cli_runner.invoke(["branch", "small-patch"])
+        assert r.exit_code == 0, r.stderr
+        r = cli_runner.invoke(["branch", "large-patch"])
+        assert r.exit_code == 0, r.stderr
+
+        def _apply(branch, patch_path):
+            return pytest.helpers.kart_max_rss(
+                repo_path, "apply", f"--ref={branch}", str(patch_path)
+            )
+
+        small_max_rss = _apply("small-patch", small_patch)
+        large_max_rss = benchmark.pedantic(
+            _apply, args=("large-patch", large_patch), rounds=1, iterations=1
+        )
+        benchmark.extra_info["max_rss"] = large_max_rss
+        assert large_max_rss < small_max_rss * 1.25
+
+
 @pytest.mark.slow
 def test_apply_benchmark(data_working_copy, benchmark, cli_runner, monkeypatch):
     from kart import apply
@@ -1,6 +1,8 @@
 import os
 import platform
 import re
+import subprocess
+import sys
 
 import pygit2
 import pytest
@@ -21,6 +23,44 @@ def test_version(cli_runner):
     )
 
 
+def _imported_modules(code):
+    r = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        encoding="utf-8",
+        check=True,
+    )
+    # Each line is "import time: <self-us> | <cumulative-us> | <indented-module-name>"
+    return {
+        line.split("|")[-1].strip()
+        for line in r.stderr.splitlines()
+        if line.startswith("import time:") and "|" in line
+    }
+
+
+@pytest.mark.parametrize("command_module", ["status", "log", "diff"])
+def test_common_commands_dont_import_gdal(command_module):
+    # Importing GDAL is slow - commands that don't need it shouldn't pay for it.
+    modules = _imported_modules(f"import kart.cli, kart.{command_module}")
+    assert f"kart.{command_module}" in modules
+    assert not [m for m in modules if m == "osgeo" or m.startswith("osgeo.")]
+
+
+def test_gdal_uses_exceptions_when_imported_lazily():
+    r = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import kart; from osgeo import gdal, ogr, osr; "
+            "print(gdal.GetUseExceptions(), ogr.GetUseExceptions(), osr.GetUseExceptions())",
+        ],
+        capture_output=True,
+        encoding="utf-8",
+        check=True,
+    )
+    assert r.stdout.split() == ["1", "1", "1"]
+
+
 def test_cli_help():
     click_app = cli.cli
     for name, cmd in click_app.commands.items():
@@ -1,5 +1,6 @@
 import functools
 import json
+import os
 import re
 import time
 
@@ -7,9 +8,13 @@ import html5lib
 import pytest
 
 import kart
+import kart.tabular.feature_output
+from kart.base_diff_writer import BaseDiffWriter
 from kart.diff_structs import Delta, DeltaDiff
+from kart.html_diff_writer import HtmlDiffWriter
 from kart.json_diff_writers import JsonLinesDiffWriter
 from kart.geometry import hex_wkb_to_ogr
+from kart.object_builder import ObjectBuilder
 from kart.repo import KartRepo
 
 
@@ -20,15 +25,26 @@ SHOW_OUTPUT_FORMATS = DIFF_OUTPUT_FORMATS
 
 
 def _check_html_output(s):
+    return {
+        ds_path: {"type": "FeatureCollection", "features": sum(pages, [])}
+        for ds_path, pages in _html_output_pages(s).items()
+    }
+
+
+def _html_output_pages(s):
     parser = html5lib.HTMLParser(strict=True, namespaceHTMLElements=False)
     # throw errors on invalid HTML
     document = parser.parse(s)
-    # find the <script> element containing data
-    el = document.find("./head/script[@id='kart-data']")
-    # find the JSON
-    m = re.match(r"\s*const DATA=(.*);\s*$", el.text, flags=re.DOTALL)
-    # validate it
-    return json.loads(m.group(1))
+    # find the <script> element containing the manifest, and validate it
+    el = document.find("./body/script[@id='kart-manifest']")
+    manifest = json.loads(el.text)
+    # find the <script> elements containing each page of features, and validate those
+    pages = {ds_path: [] for ds_path in manifest["datasets"]}
+    for el in document.findall("./body/script[@class='kart-page']"):
+        pages[el.get("data-dataset")].append(json.loads(el.text)["features"])
+    for ds_path, ds_info in manifest["datasets"].items():
+        assert len(pages[ds_path]) == ds_info["pages"]
+    return pages
 
 
 @pytest.mark.parametrize("output_format", DIFF_OUTPUT_FORMATS)
@@ -370,6 +386,46 @@ def test_diff_reprojection(output_format, data_working_copy, cli_runner):
             _check_geojson(odata["nz_pa_points_topo_150k"])
 
 
+def test_diff_reprojection_batched(data_working_copy, cli_runner, monkeypatch):
+    """Reprojecting geometries in batches gives the same results as reprojecting them one at a time."""
+    with data_working_copy("polygons") as (repo_path, wc):
+        repo = KartRepo(repo_path)
+        with repo.working_copy.session() as sess:
+            sess.execute(H.POLYGONS.INSERT, H.POLYGONS.RECORD)
+            sess.execute(f"UPDATE {H.POLYGONS.LAYER} SET id=9998 WHERE id=1424927;")
+            sess.execute(f"DELETE FROM {H.POLYGONS.LAYER} WHERE id=1452332;")
+
+        def _flatten(coords):
+            if isinstance(coords, list):
+                return [c for child in coords for c in _flatten(child)]
+            return [coords]
+
+        def _reprojected_coords():
+            r = cli_runner.invoke(
+                ["diff", "--output-format=geojson", "--output=-", "--crs=epsg:2193"]
+            )
+            assert r.exit_code == 0, r.stderr
+            return [
+                (f["id"], _flatten(f["geometry"]["coordinates"]))
+                for f in json.loads(r.stdout)["features"]
+            ]
+
+        monkeypatch.setattr(BaseDiffWriter, "REPROJECTION_BATCH_SIZE", 2)
+        batched = _reprojected_coords()
+        assert len(batched) == 4
+
+        # Make every geometry fall back to being reprojected individually.
+        monkeypatch.setattr(
+            kart.tabular.feature_output,
+            "transform_gpkg_geoms",
+            lambda gpkg_geoms, transform: [None] * len(gpkg_geoms),
+        )
+        individually = _reprojected_coords()
+        assert [i for i, c in batched] == [i for i, c in individually]
+        for (i, batched_coords), (i, coords) in zip(batched, individually):
+            assert batched_coords == pytest.approx(coords)
+
+
 def test_show_crs_with_aspatial_dataset(data_archive, cli_runner):
     """
     --crs should be ignored when used with aspatial data
@@ -733,6 +789,66 @@ def test_diff_polygons(output_format, data_working_copy, cli_runner):
             _check_html_output(r.stdout)
 
 
+def test_diff_html_pages(data_working_copy, cli_runner, monkeypatch):
+    monkeypatch.setattr(HtmlDiffWriter, "PAGE_SIZE", 2)
+    with data_working_copy("polygons") as (repo, wc):
+        repo = KartRepo(repo)
+        with repo.working_copy.session() as sess:
+            sess.execute(H.POLYGONS.INSERT, H.POLYGONS.RECORD)
+            sess.execute(f"UPDATE {H.POLYGONS.LAYER} SET id=9998 WHERE id=1424927;")
+            sess.execute(
+                f"UPDATE {H.POLYGONS.LAYER} SET survey_reference='test' WHERE id=1443053;"
+            )
+            sess.execute(f"DELETE FROM {H.POLYGONS.LAYER} WHERE id=1452332;")
+
+        r = cli_runner.invoke(["diff", "--output-format=geojson", "--output=-"])
+        assert r.exit_code == 0, r.stderr
+        expected_features = json.loads(r.stdout)["features"]
+        assert len(expected_features) == 6
+
+        r = cli_runner.invoke(["diff", "--output-format=html", "--output=-"])
+        assert r.exit_code == 0, r.stderr
+        pages = _html_output_pages(r.stdout)[H.POLYGONS.LAYER]
+        assert len(pages) > 1
+        for page in pages:
+            assert 0 < len(page) <= HtmlDiffWriter.PAGE_SIZE + 1
+            # The old and new versions of an updated feature are never split across pages.
+            assert not page[-1]["id"].endswith(":U-")
+        assert sum(pages, []) == expected_features
+
+
+def test_diff_html_streams_commit_diffs(data_archive, cli_runner, monkeypatch):
+    from kart.diff_structs import StreamingDeltaDiff
+
+    streamed = []
+    orig_init = StreamingDeltaDiff.__init__
+
+    def _init(self, deltas):
+        streamed.append(self)
+        orig_init(self, deltas)
+
+    monkeypatch.setattr(StreamingDeltaDiff, "__init__", _init)
+    monkeypatch.setattr(HtmlDiffWriter, "PAGE_SIZE", 2)
+    with data_archive("points"):
+        r = cli_runner.invoke(["diff", "--output-format=geojson", "HEAD^...HEAD"])
+        assert r.exit_code == 0, r.stderr
+        expected_features = json.loads(r.stdout)["features"]
+        assert not streamed
+
+        r = cli_runner.invoke(
+            ["diff", "--output-format=html", "--output=-", "HEAD^...HEAD"]
+        )
+        assert r.exit_code == 0, r.stderr
+        assert streamed
+        pages = _html_output_pages(r.stdout)[H.POINTS.LAYER]
+        assert len(pages) > 1
+        # The features are in path order rather than primary key order, but they're all there.
+        features = sum(pages, [])
+        assert sorted(features, key=lambda f: f["id"]) == sorted(
+            expected_features, key=lambda f: f["id"]
+        )
+
+
 @pytest.mark.parametrize("output_format", DIFF_OUTPUT_FORMATS)
 def test_diff_table(output_format, data_working_copy, cli_runner):
     """diff the working copy against HEAD"""
@@ -1825,6 +1941,94 @@ def test_diff_streaming(data_archive_readonly):
             assert new.get_feature_calls == expected_calls
 
 
+def test_diff_prefetch_delta_values(data_archive_readonly, cli_runner, monkeypatch):
+    with data_archive_readonly("points"):
+        args = ["diff", "--output-format=json-lines", "HEAD^^?...HEAD"]
+        monkeypatch.setattr(BaseDiffWriter, "PREFETCH_THREADS", 1)
+        r = cli_runner.invoke(args)
+        assert r.exit_code == 0, r.stderr
+        expected = r.stdout.splitlines()
+        assert len(expected) > H.POINTS.ROWCOUNT
+
+        # Same output, in the same order, when values are loaded in worker threads.
+        monkeypatch.setattr(BaseDiffWriter, "PREFETCH_THREADS", 4)
+        monkeypatch.setattr(BaseDiffWriter, "PREFETCH_BATCH_SIZE", 7)
+        r = cli_runner.invoke(args)
+        assert r.exit_code == 0, r.stderr
+        assert r.stdout.splitlines() == expected
+
+
+@pytest.mark.parametrize("output_format", ["json", "json-lines", "geojson"])
+def test_diff_stream_features(output_format, data_archive_readonly, cli_runner):
+    def _feature_deltas(output):
+        if output_format == "json":
+            return json.loads(output)["kart.diff/v1+hexwkb"][H.POINTS.LAYER]["feature"]
+        elif output_format == "json-lines":
+            lines = [json.loads(line) for line in output.splitlines()]
+            return [l for l in lines if l["type"] == "feature"]
+        return json.loads(output)["features"]
+
+    def _sort_key(delta):
+        return json.dumps(delta, sort_keys=True)
+
+    with data_archive_readonly("points"):
+        args = ["diff", f"--output-format={output_format}", "HEAD^...HEAD"]
+        r = cli_runner.invoke(args)
+        assert r.exit_code == 0, r.stderr
+        expected = _feature_deltas(r.stdout)
+        assert len(expected) > 0
+
+        r = cli_runner.invoke(args + ["--stream-features"])
+        assert r.exit_code == 0, r.stderr
+        # Same deltas, but in path order rather than primary key order.
+        assert sorted(_feature_deltas(r.stdout), key=_sort_key) == sorted(
+            expected, key=_sort_key
+        )
+
+        r = cli_runner.invoke(["diff", "--stream-features", "HEAD^...HEAD"])
+        assert r.exit_code == 2, r.stderr
+        assert "--stream-features requires json" in r.stderr
+
+
+@pytest.mark.slow
+def test_diff_stream_features_memory(data_archive, benchmark):
+    # Diffs a million inserted features, and measures the peak memory use of the diff process -
+    # which should be about the same as for a diff a hundred times smaller.
+    with data_archive("points") as repo_path:
+        repo = KartRepo(repo_path)
+        ds = repo.datasets()[H.POINTS.LAYER]
+        encoder = ds.feature_blob_encoder()
+
+        def _insert_features(num_features):
+            builder = ObjectBuilder(repo, repo.head_tree)
+            for i in range(num_features):
+                feature = dict(H.POINTS.RECORD, fid=100_000 + i, t50_fid=i)
+                builder.insert(*encoder.encode_feature(feature))
+            return builder.flush()
+
+        def _diff(new_tree):
+            return pytest.helpers.kart_max_rss(
+                repo_path,
+                "diff",
+                "--stream-features",
+                "-o",
+                "json",
+                "--output",
+                os.devnull,
+                f"{repo.head_tree.id}...{new_tree.id}",
+            )
+
+        small_tree = _insert_features(10_000)
+        large_tree = _insert_features(1_000_000)
+
+        small_max_rss = _diff(small_tree)
+        large_max_rss = benchmark.pedantic(
+            _diff, args=(large_tree,), rounds=1, iterations=1
+        )
+        benchmark.extra_info["max_rss"] = large_max_rss
+        assert large_max_rss < small_max_rss * 1.5
+
+
 @pytest.mark.parametrize(
     "output_format", [o for o in SHOW_OUTPUT_FORMATS if o not in {"html", "quiet"}]
 )
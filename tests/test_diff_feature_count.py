@@ -148,3 +148,20 @@ def test_feature_count_with_working_copy(data_working_copy, cli_runner):
             "nz_pa_points_topo_150k:",
             "\t6 features changed",
         ]
+
+
+def test_exact_diff_blob_count(data_archive):
+    from kart import diff_estimation
+
+    with data_archive("points") as repo_path:
+        repo = KartRepo(repo_path)
+        old_tree = repo.datasets("HEAD^")[H.POINTS.LAYER].feature_tree
+        new_tree = repo.datasets("HEAD")[H.POINTS.LAYER].feature_tree
+        empty_tree = repo.empty_tree
+
+        count = diff_estimation.get_exact_diff_blob_count
+        assert count(old_tree, new_tree) == 5
+        assert count(new_tree, old_tree) == 5
+        assert count(new_tree, new_tree) == 0
+        assert count(empty_tree, new_tree) == H.POINTS.ROWCOUNT
+        assert count(new_tree, empty_tree) == H.POINTS.ROWCOUNT
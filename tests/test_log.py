@@ -464,3 +464,93 @@ def test_log_decorate(data_archive, args, expected_ref, cli_runner):
         r = cli_runner.invoke(["log", *args])
         assert r.exit_code == 0, r
         assert get_log_refs(r) == expected_ref
+
+
+def test_log_dataset_changes_index(data_archive, cli_runner):
+    from kart.dataset_tree_index import DatasetTreeIndex
+    from kart.repo import KartRepo, KartRepoFiles
+
+    with data_archive("gpkg-points") as data:
+        with data_archive("polygons") as repo_path:
+            r = cli_runner.invoke(["import", data / "nz-pa-points-topo-150k.gpkg"])
+            assert r.exit_code == 0, r.stderr
+            r = cli_runner.invoke(
+                ["data", "rm", "nz_pa_points_topo_150k", "-m", "delete-dataset"]
+            )
+            assert r.exit_code == 0, r.stderr
+            r = cli_runner.invoke(["commit", "-m", "empty-commit", "--allow-empty"])
+            assert r.exit_code == 0, r.stderr
+
+            repo = KartRepo(repo_path)
+            index_path = repo.gitdir_file(KartRepoFiles.DATASET_TREES)
+            assert not index_path.exists()
+
+            outputs = []
+            for i in range(2):
+                r = cli_runner.invoke(["log", "-o", "json", "--dataset-changes"])
+                assert r.exit_code == 0, r.stderr
+                outputs.append(
+                    [(c["message"], c["datasetChanges"]) for c in json.loads(r.stdout)]
+                )
+                assert index_path.exists()
+
+            # The second log used the index written by the first one.
+            assert outputs[0] == outputs[1]
+            assert outputs[0][:3] == [
+                ("empty-commit", []),
+                ("delete-dataset", ["nz_pa_points_topo_150k"]),
+                (
+                    "Import from nz-pa-points-topo-150k.gpkg",
+                    ["nz_pa_points_topo_150k"],
+                ),
+            ]
+            assert all(
+                changes == ["nz_waca_adjustments"] for message, changes in outputs[0][3:]
+            )
+
+            with DatasetTreeIndex(repo) as index:
+                for commit in repo.walk(repo.head_commit.id):
+                    assert index.get_dataset_trees(commit) == {
+                        ds.path: ds.tree.id.hex for ds in repo.datasets(commit)
+                    }
+
+
+@pytest.mark.parametrize("first_write_fails", [False, True])
+def test_dataset_tree_index_cache_is_bounded(
+    first_write_fails, data_archive, monkeypatch
+):
+    from kart.dataset_tree_index import DatasetTreeIndex
+    from kart.repo import KartRepo
+
+    monkeypatch.setattr(DatasetTreeIndex, "CACHE_SIZE", 2)
+    monkeypatch.setattr(DatasetTreeIndex, "WRITE_BATCH_SIZE", 1)
+    if first_write_fails:
+        # The index falls back to an in-memory database.
+        monkeypatch.setattr(
+            DatasetTreeIndex,
+            "_write_unwritten",
+            _fail_first_write(DatasetTreeIndex._write_unwritten),
+        )
+
+    with data_archive("polygons") as repo_path:
+        repo = KartRepo(repo_path)
+        with DatasetTreeIndex(repo) as index:
+            for commit in repo.walk(repo.head_commit.id):
+                assert index.get_dataset_trees(commit) == {
+                    ds.path: ds.tree.id.hex for ds in repo.datasets(commit)
+                }
+                assert len(index.cache) <= 2
+
+
+def _fail_first_write(write_unwritten):
+    from pysqlite3 import dbapi2 as sqlite
+
+    calls = []
+
+    def wrapper(self):
+        calls.append(self)
+        if len(calls) == 1:
+            raise sqlite.OperationalError("database is locked")
+        return write_unwritten(self)
+
+    return wrapper
@@ -190,6 +190,49 @@ def test_import_several_las(
                     ).is_file()
 
 
+@pytest.mark.slow
+def test_import_several_laz_in_parallel(
+    tmp_path, chdir, cli_runner, data_archive_readonly, requires_pdal, requires_git_lfs
+):
+    with data_archive_readonly("point-cloud/laz-auckland.tgz") as auckland:
+        sources = sorted(glob(f"{auckland}/auckland_*.laz"))
+        trees = []
+        for num_workers in (1, 3):
+            repo_path = tmp_path / f"point-cloud-repo-{num_workers}"
+            r = cli_runner.invoke(["init", repo_path])
+            assert r.exit_code == 0
+
+            with chdir(repo_path):
+                r = cli_runner.invoke(
+                    [
+                        "point-cloud-import",
+                        *sources,
+                        "--dataset-path=auckland",
+                        "--no-convert-to-copc",
+                        f"--num-workers={num_workers}",
+                    ]
+                )
+                assert r.exit_code == 0, r.stderr
+                importing = [
+                    line
+                    for line in r.stdout.splitlines()
+                    if line.startswith("Importing ")
+                ]
+                assert len(importing) == len(sources)
+                for i, (line, source) in enumerate(zip(importing, sources), 1):
+                    assert line.startswith(f"Importing {source}... ({i} of 16, ")
+                    assert re.search(r"\d tiles/s, .* MB/s\)$", line)
+                assert re.search(
+                    r"Imported 16 tiles \(.* MB\) in .*s \(.* tiles/s, .* MB/s\)",
+                    r.stdout,
+                )
+
+            trees.append(KartRepo(repo_path).head_tree.hex)
+
+        # The tiles are processed in parallel, but the result is the same.
+        assert trees[0] == trees[1]
+
+
 def test_import_no_convert(
     tmp_path, chdir, cli_runner, data_archive_readonly, requires_pdal, requires_git_lfs
 ):
@@ -325,3 +368,88 @@ def test_working_copy_edit(cli_runner, data_working_copy, monkeypatch):
         r = cli_runner.invoke(["diff"])
         assert r.exit_code == 0, r.stderr
         assert r.stdout.splitlines() == []
+
+
+def test_working_copy_checkout_is_incremental(
+    cli_runner, data_working_copy, monkeypatch
+):
+    monkeypatch.setenv("X_KART_POINT_CLOUDS", "1")
+
+    with data_working_copy("point-cloud/auckland.tgz") as (repo_path, wc_path):
+        tiles_path = repo_path / "auckland" / "tiles"
+
+        # We don't yet know which tiles are checked out, so this writes every tile.
+        r = cli_runner.invoke(["point-cloud-checkout"])
+        assert r.exit_code == 0, r.stderr
+
+        shutil.copy(
+            tiles_path / "auckland_0_0.copc.laz", tiles_path / "auckland_1_1.copc.laz"
+        )
+        (tiles_path / "auckland_3_3.copc.laz").rename(
+            tiles_path / "auckland_4_4.copc.laz"
+        )
+
+        r = cli_runner.invoke(["commit", "-m", "Edit point cloud tiles"])
+        assert r.exit_code == 0, r.stderr
+
+        r = cli_runner.invoke(["status"])
+        assert r.exit_code == 0, r.stderr
+        assert r.stdout.splitlines()[-1] == "Nothing to commit, working copy clean"
+
+        def file_identity(path):
+            stat = path.stat()
+            return stat.st_ino, stat.st_mtime_ns
+
+        unchanged_tile = file_identity(tiles_path / "auckland_0_0.copc.laz")
+
+        r = cli_runner.invoke(["reset", "HEAD^"])
+        assert r.exit_code == 0, r.stderr
+        r = cli_runner.invoke(["point-cloud-checkout"])
+        assert r.exit_code == 0, r.stderr
+
+        # Only the tiles that changed are rewritten.
+        assert file_identity(tiles_path / "auckland_0_0.copc.laz") == unchanged_tile
+        assert (tiles_path / "auckland_1_1.copc.laz").stat().st_size == 23570
+        assert (tiles_path / "auckland_3_3.copc.laz").is_file()
+        assert not (tiles_path / "auckland_4_4.copc.laz").exists()
+
+        r = cli_runner.invoke(["status"])
+        assert r.exit_code == 0, r.stderr
+        assert r.stdout.splitlines()[-1] == "Nothing to commit, working copy clean"
+
+
+def test_working_copy_checked_out_tree_after_commits(
+    cli_runner, data_working_copy, monkeypatch
+):
+    from kart.diff_structs import RepoDiff
+    from kart.point_cloud.checkout import get_checked_out_tree
+
+    monkeypatch.setenv("X_KART_POINT_CLOUDS", "1")
+
+    with data_working_copy("point-cloud/auckland.tgz") as (repo_path, wc_path):
+        repo = KartRepo(repo_path)
+        tiles_path = repo_path / "auckland" / "tiles"
+
+        r = cli_runner.invoke(["point-cloud-checkout"])
+        assert r.exit_code == 0, r.stderr
+        assert get_checked_out_tree(repo) == repo.head_tree
+
+        # Committing the working copy changes means the tiles now match the new commit.
+        (tiles_path / "auckland_3_3.copc.laz").unlink()
+        r = cli_runner.invoke(["commit", "-m", "Delete a tile"])
+        assert r.exit_code == 0, r.stderr
+        assert get_checked_out_tree(repo) == repo.head_tree
+
+        # Commits that don't come from the working copy mean we no longer know what it contains.
+        repo.structure().commit_diff(RepoDiff(), "Empty commit", allow_empty=True)
+        assert get_checked_out_tree(repo) is None
+
+        # So the next checkout writes every tile.
+        r = cli_runner.invoke(["point-cloud-checkout"])
+        assert r.exit_code == 0, r.stderr
+        assert get_checked_out_tree(repo) == repo.head_tree
+        assert not (tiles_path / "auckland_3_3.copc.laz").exists()
+
+        r = cli_runner.invoke(["status"])
+        assert r.exit_code == 0, r.stderr
+        assert r.stdout.splitlines()[-1] == "Nothing to commit, working copy clean"
@@ -5,6 +5,7 @@ from pathlib import Path
 import pytest
 
 from kart.geometry import hex_wkb_to_ogr
+from kart.repo import KartRepo
 
 
 H = pytest.helpers.helpers()
@@ -31,14 +32,53 @@ def indexed_dataset(data_archive, cli_runner):
 )
 def test_build_spatial_index(archive, table, data_archive, cli_runner):
     with data_archive(archive) as repo_dir:
-        for p in Path(repo_dir).glob(f"{table}.kart-idx*"):
+        index_dir = Path(repo_dir) / ".kart" / "query-index"
+        for p in index_dir.glob(f"{table}.kart-idx*"):
             p.unlink()
 
         r = cli_runner.invoke(["query", table, "index"])
         assert r.exit_code == 0
 
-        assert (Path(repo_dir) / f"{table}.kart-idxi").exists()
-        assert (Path(repo_dir) / f"{table}.kart-idxd").exists()
+        assert (index_dir / f"{table}.kart-idxi").exists()
+        assert (index_dir / f"{table}.kart-idxd").exists()
+        assert (index_dir / f"{table}.kart-idx.json").exists()
+
+
+def test_spatial_index_updates_incrementally(data_archive, cli_runner):
+    layer = H.POINTS.LAYER
+    world = "-180,-90,180,90"
+    with data_archive("points") as repo_dir:
+        r = cli_runner.invoke(["checkout", H.POINTS.HEAD1_SHA])
+        assert r.exit_code == 0, r.stderr
+        r = cli_runner.invoke(["query", layer, "index"])
+        assert r.exit_code == 0, r.stderr
+
+        # Moving HEAD means the index is out of date - it is updated when next queried.
+        r = cli_runner.invoke(["checkout", H.POINTS.HEAD_SHA])
+        assert r.exit_code == 0, r.stderr
+        r = cli_runner.invoke(["query", layer, "geo-count", world])
+        assert r.exit_code == 0, r.stderr
+        updated_count = json.loads(r.stdout)
+        r = cli_runner.invoke(["query", layer, "geo-intersects", world])
+        assert r.exit_code == 0, r.stderr
+        updated_fids = sorted(f["fid"] for f in json.loads(r.stdout))
+
+        index_dir = Path(repo_dir) / ".kart" / "query-index"
+        state_path = index_dir / f"{layer}.kart-idx.json"
+        state = json.loads(state_path.read_text())
+        dataset = KartRepo(repo_dir).datasets()[layer]
+        assert state["feature_tree"] == dataset.feature_tree.id.hex
+
+        # Same result as an index built from scratch:
+        state_path.unlink()
+        r = cli_runner.invoke(["query", layer, "index"])
+        assert r.exit_code == 0, r.stderr
+        r = cli_runner.invoke(["query", layer, "geo-count", world])
+        assert r.exit_code == 0, r.stderr
+        assert json.loads(r.stdout) == updated_count
+        r = cli_runner.invoke(["query", layer, "geo-intersects", world])
+        assert r.exit_code == 0, r.stderr
+        assert sorted(f["fid"] for f in json.loads(r.stdout)) == updated_fids
 
 
 def test_query_cli_get(indexed_dataset, cli_runner):
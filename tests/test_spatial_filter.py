@@ -12,7 +12,11 @@ from kart.exceptions import (
     INVALID_OPERATION,
     SPATIAL_FILTER_PK_CONFLICT,
 )
-from kart.promisor_utils import FetchPromisedBlobsProcess, LibgitSubcode
+from kart.promisor_utils import (
+    FetchPromisedBlobsProcess,
+    LibgitSubcode,
+    PromisedBlobFetcher,
+)
 from kart.repo import KartRepo
 
 H = pytest.helpers.helpers()
@@ -459,7 +463,7 @@ def test_spatially_filtered_fetch_promised(
 ):
 
     # Keep track of how many features we fetch lazily after the partial clone.
-    orig_fetch_func = FetchPromisedBlobsProcess.fetch
+    orig_fetch_func = PromisedBlobFetcher.fetch
     fetch_count = 0
 
     def _fetch(*args, **kwargs):
@@ -467,7 +471,7 @@ def test_spatially_filtered_fetch_promised(
         fetch_count += 1
         return orig_fetch_func(*args, **kwargs)
 
-    monkeypatch.setattr(FetchPromisedBlobsProcess, "fetch", _fetch)
+    monkeypatch.setattr(PromisedBlobFetcher, "fetch", _fetch)
 
     with data_archive("polygons-with-feature-envelopes") as repo1_path:
         repo1_url = f"file://{repo1_path.resolve()}"
@@ -527,6 +531,50 @@ def test_spatially_filtered_fetch_promised(
             assert final_config_dict == orig_config_dict
 
 
+def test_spatially_filtered_diff_fetches_in_parallel(
+    data_archive, cli_runner, monkeypatch, git_supports_spatial_filter
+):
+    # Keep track of how many git fetch processes are started - these run in worker threads.
+    fetch_processes = []
+    orig_init = FetchPromisedBlobsProcess.__init__
+
+    def _init(self, *args, **kwargs):
+        fetch_processes.append(self)
+        orig_init(self, *args, **kwargs)
+
+    monkeypatch.setattr(FetchPromisedBlobsProcess, "__init__", _init)
+    monkeypatch.setattr(PromisedBlobFetcher, "BATCH_SIZE", 10)
+    monkeypatch.setattr(PromisedBlobFetcher, "NUM_WORKERS", 3)
+
+    with data_archive("polygons-with-feature-envelopes") as repo1_path:
+        repo1_url = f"file://{repo1_path.resolve()}"
+
+        with data_archive("polygons-spatial-filtered") as repo2_path:
+            repo2 = KartRepo(repo2_path)
+            repo2.config["remote.origin.url"] = repo1_url
+            if not git_supports_spatial_filter:
+                repo2.config["remote.origin.partialclonefilter"] = "blob:none"
+
+            ds = repo2.datasets()[H.POLYGONS.LAYER]
+            assert local_features(ds) == 52
+
+            r = cli_runner.invoke(["-C", repo2_path, "create-workingcopy"])
+            assert r.exit_code == 0, r.stderr
+            with repo2.working_copy.session() as sess:
+                sess.execute(f"DROP TABLE {H.POLYGONS.LAYER};")
+
+            r = cli_runner.invoke(["-C", repo2_path, "diff", "-o", "json"])
+            assert r.exit_code == 0, r.stderr
+            deltas = json.loads(r.stdout)["kart.diff/v1+hexwkb"][H.POLYGONS.LAYER]
+            assert len(deltas["feature"]) == H.POLYGONS.ROWCOUNT
+            assert all(set(d.keys()) == {"-"} for d in deltas["feature"])
+
+            # Every promised feature was fetched exactly once, in batches of 10.
+            num_promised = H.POLYGONS.ROWCOUNT - 52
+            assert local_features(ds) == H.POLYGONS.ROWCOUNT
+            assert len(fetch_processes) == -(-num_promised // 10)
+
+
 def test_spatially_filtered_commit(data_archive, cli_runner):
     # We use the points layer for this test since it uses consecutive integer PKs.
     # This means that promised features and locally features are likely to both be stored in the
@@ -970,3 +1018,64 @@ def test_pk_conflict_due_to_spatial_filter(
 
         with repo.working_copy.session() as sess:
             assert H.row_count(sess, H.POINTS.LAYER) == 302
+
+
+@pytest.mark.parametrize(
+    "filter_wkt",
+    [
+        "POLYGON((0 0,10 0,10 10,0 10,0 0))",
+        "POLYGON((0 0,10 0,0 10,0 0))",
+        "MULTIPOLYGON(((0 0,10 0,10 10,0 10,0 0),(4 4,6 4,6 6,4 6,4 4)),((20 0,30 0,30 10,20 0)))",
+    ],
+)
+def test_spatial_filter_fast_paths(filter_wkt, monkeypatch):
+    from kart.crs_util import make_crs
+    from kart.geometry import Geometry
+    from kart.spatial_filter import SpatialFilter
+
+    filter_ogr = Geometry.from_wkt(filter_wkt).to_ogr()
+    spatial_filter = SpatialFilter(make_crs("EPSG:4326"), filter_ogr, "geom")
+    assert spatial_filter.filter_is_envelope == filter_wkt.startswith(
+        "POLYGON((0 0,10 0,10 10"
+    )
+
+    points = [
+        Geometry.from_wkt(f"POINT({x} {y})")
+        for x in range(-1, 32)
+        for y in range(-1, 12)
+    ]
+    points.append(Geometry.from_wkt("POINT(2.5 2.5)"))
+    lines = [
+        Geometry.from_wkt("LINESTRING(1 1,2 2)"),
+        Geometry.from_wkt("LINESTRING(-5 7,7 -5)"),
+        Geometry.from_wkt("LINESTRING(8 -1,11 2)"),
+    ]
+    expected = {
+        geom: spatial_filter.filter_prep.Intersects(geom.to_ogr())
+        for geom in points + lines
+    }
+    # Points on the edge of the filter's envelope have never been considered to match.
+    min_x, max_x, min_y, max_y = spatial_filter.filter_env
+    for point in points:
+        x, y = point.to_ogr().GetPoint_2D()
+        if x in (min_x, max_x) or y in (min_y, max_y):
+            expected[point] = False
+
+    to_ogr_calls = []
+    original_to_ogr = Geometry.to_ogr
+
+    def _to_ogr(self):
+        to_ogr_calls.append(self)
+        return original_to_ogr(self)
+
+    monkeypatch.setattr(Geometry, "to_ogr", _to_ogr)
+
+    for point in points:
+        assert bool(spatial_filter.matches({"geom": point})) == expected[point]
+    assert to_ogr_calls == []
+
+    for line in lines:
+        assert bool(spatial_filter.matches({"geom": line})) == expected[line]
+    if spatial_filter.filter_is_envelope:
+        # The line inside the envelope didn't need to be loaded into OGR.
+        assert lines[0] not in to_ogr_calls
@@ -1,4 +1,5 @@
 import binascii
+import sys
 from dataclasses import dataclass
 import pytest
 
@@ -285,6 +286,44 @@ def test_index_points_idempotent(data_archive, cli_runner):
         _check_index(s, EXPECTED_POINTS_INDEX)
 
 
+def test_index_points_resume(data_archive, cli_runner):
+    # If indexing is interrupted, the features that were already written to the index aren't indexed again.
+    with data_archive("points.tgz") as repo_path:
+        r = cli_runner.invoke(["spatial-filter", "index"])
+        assert r.exit_code == 0, r.stderr
+
+        # Simulate an interruption - the feature envelopes are written, but the commits aren't yet marked as indexed.
+        db_path = repo_path / ".kart" / "feature_envelopes.db"
+        engine = sqlite_engine(db_path)
+        with sessionmaker(bind=engine)() as sess:
+            sess.execute("DELETE FROM commits;")
+            sess.execute(
+                "DELETE FROM feature_envelopes WHERE blob_id IN "
+                "(SELECT blob_id FROM feature_envelopes ORDER BY blob_id LIMIT 100);"
+            )
+
+        r = cli_runner.invoke(["spatial-filter", "index"])
+        assert r.exit_code == 0, r.stderr
+        assert "Skipped 2,048 features that were already indexed" in r.stdout
+        s = _get_index_summary(repo_path)
+        assert s.features == 2148
+        _check_index(s, EXPECTED_POINTS_INDEX)
+
+
+def test_index_points_worker_processes(data_archive, cli_runner, monkeypatch):
+    # Indexing using worker processes should give the same results as indexing in a single process.
+    # (The module itself is shadowed by the "kart spatial-filter index" command, so get it from sys.modules).
+    monkeypatch.setattr(
+        sys.modules["kart.spatial_filter.index"], "INDEX_BATCH_SIZE", 500
+    )
+    with data_archive("points.tgz") as repo_path:
+        r = cli_runner.invoke(["spatial-filter", "index", "--num-processes=2"])
+        assert r.exit_code == 0, r.stderr
+        s = _get_index_summary(repo_path)
+        assert s.features == 2148
+        _check_index(s, EXPECTED_POINTS_INDEX)
+
+
 def test_index_polygons_all(data_archive, cli_runner):
     with data_archive("polygons.tgz") as repo_path:
         r = cli_runner.invoke(["spatial-filter", "index"])
@@ -972,6 +972,26 @@ def test_feature_find_decode_performance(
         raise NotImplementedError(f"Unknown profile: {profile}")
 
 
+@pytest.mark.parametrize("columns", [None, ["t50_fid", "name_ascii"], ["geom"]])
+def test_iter_feature_batches(columns, data_archive_readonly):
+    with data_archive_readonly("points") as repo_path:
+        repo = KartRepo(repo_path)
+        dataset = repo.datasets()["nz_pa_points_topo_150k"]
+
+        expected = list(dataset.features_with_crs_ids())
+        if columns is not None:
+            expected = [{k: f[k] for k in columns} for f in expected]
+
+        batches = list(
+            dataset.iter_feature_batches(1000, columns, with_crs_ids=True)
+        )
+        assert [len(b) for b in batches] == [1000, 1000, 143]
+        assert batches[0].column_names == tuple(columns or dataset.schema.column_names)
+
+        actual = [row for b in batches for row in b.row_dicts()]
+        assert actual == expected
+
+
 @pytest.mark.slow
 def test_import_multiple(data_archive, chdir, cli_runner, tmp_path):
     repo_path = tmp_path / "repo"
@@ -1106,6 +1126,40 @@ def test_write_feature_performance(
                 benchmark(_write_feature)
 
 
+@pytest.mark.slow
+@pytest.mark.parametrize(*GPKG_IMPORTS)
+def test_import_iter_feature_blobs_performance(
+    archive,
+    source_gpkg,
+    table,
+    data_archive,
+    benchmark,
+    request,
+):
+    """ Feature encoding throughput (features/s) for the import hot path. """
+    param_ids = H.parameter_ids(request)
+    benchmark.group = f"test_import_iter_feature_blobs_performance - {param_ids[-1]}"
+
+    with data_archive(archive) as data:
+        source = TableImportSource.open(data / source_gpkg, table=table)
+        with source:
+            dataset = TableV3.new_dataset_for_writing(
+                table, source.schema, MemoryRepo()
+            )
+            features = list(source.features())
+
+            def _encode_all_features():
+                for _ in dataset.import_iter_feature_blobs(None, features, source):
+                    pass
+
+            benchmark(_encode_all_features)
+            benchmark.extra_info["num_features"] = len(features)
+            if benchmark.stats:
+                benchmark.extra_info["features_per_second"] = (
+                    len(features) / benchmark.stats.stats.mean
+                )
+
+
 @pytest.mark.slow
 def test_fast_import(data_archive, tmp_path, cli_runner, chdir):
     table = H.POINTS.LAYER
@@ -1142,6 +1196,42 @@ def test_fast_import(data_archive, tmp_path, cli_runner, chdir):
             assert feature_count == source.feature_count
 
 
+@pytest.mark.slow
+def test_fast_import_encoder_processes(
+    data_archive, tmp_path, cli_runner, chdir, monkeypatch
+):
+    table = H.POINTS.LAYER
+    monkeypatch.setattr(
+        fast_import.FastImportSettings, "MIN_FEATURES_FOR_ENCODER_PROCESSES", 0
+    )
+    with data_archive("gpkg-points") as data:
+        feature_trees = []
+        for num_encoder_processes in (0, 2):
+            repo_path = tmp_path / f"repo{num_encoder_processes}"
+            repo_path.mkdir()
+
+            with chdir(repo_path):
+                r = cli_runner.invoke(["init"])
+                assert r.exit_code == 0, r
+
+                repo = KartRepo(repo_path)
+                source = TableImportSource.open(
+                    data / "nz-pa-points-topo-150k.gpkg", table=table
+                )
+                settings = fast_import.FastImportSettings(
+                    num_processes=2,
+                    num_encoder_processes=num_encoder_processes,
+                    encoder_batch_size=100,
+                )
+                fast_import.fast_import_tables(
+                    repo, [source], settings=settings, from_commit=None
+                )
+                feature_trees.append(repo.datasets()[table].feature_tree.id)
+
+        # Encoding in worker processes results in exactly the same features.
+        assert feature_trees[0] == feature_trees[1]
+
+
 def test_postgis_import_with_sampled_geometry_dimension(
     postgis_db,
     data_archive,
@@ -1,5 +1,6 @@
-from memory_repo import MemoryTree, MemoryRepo
+from memory_repo import MemoryBlob, MemoryTree, MemoryRepo
 
+from kart.serialise_util import msg_pack
 from kart.tabular.v3 import TableV3
 from kart.tabular.schema import Legend, ColumnSchema, Schema
 
@@ -26,6 +27,16 @@ def test_legend_roundtrip():
     assert roundtripped == orig
 
 
+def test_legend_hash_is_precomputed():
+    legend = Legend(["a", "b", "c"], ["d", "e", "f"])
+    assert legend.dumps() is legend.dumps()
+    assert legend.hexhash() == Legend.loads(legend.dumps()).hexhash()
+
+    schema = abcdef_schema()
+    assert schema.legend is schema.legend
+    assert schema.dumps() is schema.dumps()
+
+
 def test_raw_dict_to_value_tuples():
     legend = Legend(["a", "b", "c"], ["d", "e", "f"])
     raw_feature_dict = {
@@ -271,3 +282,21 @@ def test_schema_change_roundtrip(gen_uuid):
     }
     # We guarantee that the dict iterates in row-order.
     assert tuple(roundtripped.values()) == (7, None, "Bloggs", "Joe", None)
+
+
+def test_iter_feature_batches_with_older_legend():
+    # This feature was written with an older legend that had a different number of primary key columns.
+    schema = abcdef_schema()
+    old_legend = Legend(["a", "c"], ["b", "d", "e", "f"])
+    empty_dataset = TableV3.new_dataset_for_writing(DATASET_PATH, schema, MemoryRepo())
+    legend_path, legend_data = empty_dataset.encode_legend(old_legend)
+    tree = MemoryTree({legend_path: legend_data})
+
+    tableV3 = TableV3(tree / DATASET_PATH, DATASET_PATH, MemoryRepo())
+    tableV3._schema = schema
+    blob = MemoryBlob(msg_pack([old_legend.hexhash(), [b"bytes", 5.0, "eggs", None]]))
+    tableV3.feature_blobs = lambda: iter([blob])
+
+    # Only non-pk columns are requested, so the pk values aren't decoded.
+    batches = list(tableV3.iter_feature_batches(columns=["d", "e"]))
+    assert [list(b.row_dicts()) for b in batches] == [[{"d": 5.0, "e": "eggs"}]]
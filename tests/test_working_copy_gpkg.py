@@ -57,6 +57,70 @@ def test_checkout_workingcopy(
         assert expected_col_spec in table_spec
 
 
+def test_checkout_workingcopy_bulk_load(data_archive, cli_runner):
+    with data_archive("polygons") as repo_path:
+        H.clear_working_copy()
+
+        r = cli_runner.invoke(["checkout"])
+        assert r.exit_code == 0, r
+
+        repo = KartRepo(repo_path)
+        wc = repo.working_copy
+        rtree_table = f"rtree_{H.POLYGONS.LAYER}_geom"
+        with wc.session() as sess:
+            # The bulk-load pragmas have been restored.
+            assert sess.scalar("PRAGMA journal_mode;") == "delete"
+            assert sess.scalar("PRAGMA locking_mode;") == "normal"
+
+            # The spatial index was populated after the features were written...
+            assert sess.scalar(
+                f"SELECT COUNT(*) FROM {rtree_table} WHERE id = 1424927;"
+            )
+            # ... and the RTree triggers were installed afterwards.
+            sess.execute(f"DELETE FROM {H.POLYGONS.LAYER} WHERE id = 1424927;")
+            assert not sess.scalar(
+                f"SELECT COUNT(*) FROM {rtree_table} WHERE id = 1424927;"
+            )
+
+
+def test_checkout_workingcopy_string_pks_spatial_index(data_archive, cli_runner):
+    with data_archive("string-pks") as repo_path:
+        H.clear_working_copy()
+
+        r = cli_runner.invoke(["checkout"])
+        assert r.exit_code == 0, r
+
+        repo = KartRepo(repo_path)
+        layer = H.POLYGONS.LAYER
+        rtree_table = f"rtree_{layer}_geom"
+        with repo.working_copy.session() as sess:
+            # The spatial index is keyed on the table's integer primary key, not on the dataset's
+            # string primary key - the same as the RTree triggers.
+            unindexed = sess.scalar(
+                f"""
+                SELECT COUNT(*) FROM {layer} T
+                LEFT OUTER JOIN {rtree_table} R ON T.auto_int_pk = R.id
+                WHERE T.geom IS NOT NULL AND R.id IS NULL;
+                """
+            )
+            assert unindexed == 0
+            assert sess.scalar(f"SELECT COUNT(*) FROM {rtree_table};") == sess.scalar(
+                f"SELECT COUNT(*) FROM {layer} WHERE geom IS NOT NULL;"
+            )
+
+            def rtree_count(rowid):
+                return sess.scalar(
+                    f"SELECT COUNT(*) FROM {rtree_table} WHERE id = :id;", {"id": rowid}
+                )
+
+            rowid = sess.scalar(
+                f"SELECT auto_int_pk FROM {layer} WHERE id = 'POLY1424927';"
+            )
+            assert rtree_count(rowid) == 1
+            sess.execute(f"DELETE FROM {layer} WHERE id = 'POLY1424927';")
+            assert rtree_count(rowid) == 0
+
+
 def test_checkout_detached(data_working_copy, cli_runner):
     """ Checkout a working copy to edit """
     with data_working_copy("points") as (repo_dir, wc):
@@ -286,6 +350,91 @@ def test_switch_branch(data_working_copy, cli_runner, tmp_path):
             assert H.row_count(sess, H.POINTS.LAYER) == H.POINTS.ROWCOUNT
 
 
+def test_switch_branch_in_batches(data_working_copy, cli_runner, monkeypatch):
+    # Apply the feature diff in lots of small batches.
+    monkeypatch.setattr(BaseWorkingCopy, "APPLY_BATCH_SIZE", 3)
+
+    with data_working_copy("points") as (repo_path, wc):
+        repo = KartRepo(repo_path)
+        wc = repo.working_copy
+        layer = H.POINTS.LAYER
+
+        def sample_names(sess):
+            r = sess.execute(f"SELECT fid, name FROM {layer} WHERE fid <= 20;")
+            return {row[0]: row[1] for row in r}
+
+        with wc.session() as sess:
+            orig_names = sample_names(sess)
+
+        r = cli_runner.invoke(["switch", "-c", "foo"])
+        assert r.exit_code == 0, r.stderr
+
+        with wc.session() as sess:
+            sess.execute(H.POINTS.INSERT, H.POINTS.RECORD)
+            sess.execute(f"UPDATE {layer} SET name='bulk' WHERE fid <= 20;")
+            sess.execute(f"DELETE FROM {layer} WHERE fid IN (1, 5, 9);")
+
+        r = cli_runner.invoke(["commit", "-m", "bulk edit"])
+        assert r.exit_code == 0, r.stderr
+
+        r = cli_runner.invoke(["switch", "main"])
+        assert r.exit_code == 0, r.stderr
+
+        with wc.session() as sess:
+            assert H.row_count(sess, layer) == H.POINTS.ROWCOUNT
+            assert sample_names(sess) == orig_names
+
+        r = cli_runner.invoke(["switch", "foo"])
+        assert r.exit_code == 0, r.stderr
+
+        with wc.session() as sess:
+            assert H.row_count(sess, layer) == H.POINTS.ROWCOUNT - 2
+            assert sample_names(sess) == {
+                fid: "bulk" for fid in orig_names if fid not in (1, 5, 9)
+            }
+
+        r = cli_runner.invoke(["status", "--output-format=json"])
+        assert r.exit_code == 0, r.stderr
+        assert json.loads(r.stdout)["kart.status/v1"]["workingCopy"]["changes"] is None
+
+
+def test_switch_branch_geometry_to_null(data_working_copy, cli_runner):
+    with data_working_copy("points") as (repo_path, wc):
+        repo = KartRepo(repo_path)
+        wc = repo.working_copy
+        layer = H.POINTS.LAYER
+        rtree_table = f"rtree_{layer}_geom"
+
+        def rtree_count(sess):
+            return sess.scalar(f"SELECT COUNT(*) FROM {rtree_table} WHERE id = 1;")
+
+        r = cli_runner.invoke(["switch", "-c", "foo"])
+        assert r.exit_code == 0, r.stderr
+
+        with wc.session() as sess:
+            sess.execute(f"UPDATE {layer} SET geom = NULL WHERE fid = 1;")
+        r = cli_runner.invoke(["commit", "-m", "null geometry"])
+        assert r.exit_code == 0, r.stderr
+
+        r = cli_runner.invoke(["switch", "main"])
+        assert r.exit_code == 0, r.stderr
+        with wc.session() as sess:
+            assert rtree_count(sess) == 1
+
+        r = cli_runner.invoke(["switch", "foo"])
+        assert r.exit_code == 0, r.stderr
+        with wc.session() as sess:
+            assert sess.scalar(f"SELECT geom FROM {layer} WHERE fid = 1;") is None
+            assert rtree_count(sess) == 0
+            assert sess.scalar(f"SELECT COUNT(*) FROM {rtree_table};") == (
+                H.POINTS.ROWCOUNT - 1
+            )
+
+        r = cli_runner.invoke(["status", "--output-format=json"])
+        assert r.exit_code == 0, r.stderr
+        assert json.loads(r.stdout)["kart.status/v1"]["workingCopy"]["changes"] is None
+
+
 @pytest.mark.parametrize(
     "archive,layer",
     [
@@ -1057,6 +1206,46 @@ def test_reset_transaction(data_working_copy, cli_runner, edit_points):
         }
 
 
+@pytest.mark.parametrize("threads", [1, 3])
+def test_status_bulk_edit(
+    threads, data_working_copy, cli_runner, edit_points, monkeypatch
+):
+    # Compare the dirty rows to the repo in lots of small batches.
+    monkeypatch.setattr(BaseWorkingCopy, "DIRTY_FEATURE_BATCH_SIZE", 7)
+    monkeypatch.setattr(BaseWorkingCopy, "DIRTY_FEATURE_THREADS", threads)
+
+    with data_working_copy("points") as (repo_path, wc_path):
+        wc = KartRepo(repo_path).working_copy
+        with wc.session() as sess:
+            edit_points(sess)
+
+        r = cli_runner.invoke(["status", "--output-format=json"])
+        assert r.exit_code == 0, r.stderr
+        changes = json.loads(r.stdout)["kart.status/v1"]["workingCopy"]["changes"]
+        assert changes == {
+            H.POINTS.LAYER: {"feature": {"inserts": 1, "updates": 2, "deletes": 5}}
+        }
+
+        r = cli_runner.invoke(["restore"])
+        assert r.exit_code == 0, r.stderr
+
+        with wc.session() as sess:
+            sess.execute(f"UPDATE {H.POINTS.LAYER} SET name = 'bulk edit';")
+
+        r = cli_runner.invoke(["status", "--output-format=json"])
+        assert r.exit_code == 0, r.stderr
+        changes = json.loads(r.stdout)["kart.status/v1"]["workingCopy"]["changes"]
+        assert changes == {
+            H.POINTS.LAYER: {"feature": {"updates": H.POINTS.ROWCOUNT}}
+        }
+
+        r = cli_runner.invoke(["commit", "-m", "bulk edit"])
+        assert r.exit_code == 0, r.stderr
+
+        r = cli_runner.invoke(["diff", "--exit-code"])
+        assert r.exit_code == 0, r.stderr
+
+
 def test_meta_updates(data_working_copy, cli_runner):
     with data_working_copy("meta-updates") as (repo_path, wc_path):
         # These commits have minor schema changes.
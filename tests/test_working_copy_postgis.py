@@ -572,6 +572,135 @@ def test_empty_geometry_roundtrip(data_archive, cli_runner, new_postgis_db_schem
             assert r.exit_code == 0, r.stdout
 
 
+def test_checkout_copies_features_before_indexing(
+    data_archive, cli_runner, new_postgis_db_schema
+):
+    with data_archive("points") as repo_path:
+        repo = KartRepo(repo_path)
+        H.clear_working_copy()
+
+        with new_postgis_db_schema() as (postgres_url, postgres_schema):
+            r = cli_runner.invoke(["create-workingcopy", postgres_url])
+            assert r.exit_code == 0, r.stderr
+
+            wc = repo.working_copy
+            table = f"{postgres_schema}.{H.POINTS.LAYER}"
+            with wc.session() as sess:
+                assert sess.scalar(f"SELECT COUNT(*) FROM {table};") == H.POINTS.ROWCOUNT
+                # The features are copied in before the tracking trigger is created, so none are tracked.
+                assert sess.scalar(f"SELECT COUNT(*) FROM {wc.KART_TRACK};") == 0
+                assert (
+                    sess.scalar(
+                        "SELECT COUNT(*) FROM pg_trigger WHERE tgrelid = (:table)::regclass AND NOT tgisinternal;",
+                        {"table": table},
+                    )
+                    == 1
+                )
+                assert (
+                    sess.scalar(
+                        "SELECT COUNT(*) FROM pg_indexes WHERE schemaname = :schema AND tablename = :table AND indexdef LIKE '%USING gist%';",
+                        {"schema": postgres_schema, "table": H.POINTS.LAYER},
+                    )
+                    == 1
+                )
+
+                # Characters that need escaping in COPY's text format:
+                sess.execute(
+                    f"UPDATE {table} SET name = :name WHERE fid = 1;",
+                    {"name": "tab\there back\\slash\nnew\rline \\N"},
+                )
+
+            r = cli_runner.invoke(["commit", "-m", "escapes"])
+            assert r.exit_code == 0, r.stderr
+
+            r = cli_runner.invoke(
+                ["create-workingcopy", postgres_url, "--delete-existing"]
+            )
+            assert r.exit_code == 0, r.stderr
+
+            with wc.session() as sess:
+                assert (
+                    sess.scalar(f"SELECT name FROM {table} WHERE fid = 1;")
+                    == "tab\there back\\slash\nnew\rline \\N"
+                )
+                # We don't diff values unless they're marked as dirty in the WC - move the rows to make them dirty.
+                sess.execute(f"UPDATE {table} SET fid = fid + 10000;")
+                sess.execute(f"UPDATE {table} SET fid = fid - 10000;")
+
+            r = cli_runner.invoke(["diff", "--exit-code"])
+            assert r.exit_code == 0, r.stdout
+
+
+def test_write_full_concurrently(
+    data_archive, cli_runner, new_postgis_db_schema, monkeypatch
+):
+    with data_archive("au-census") as repo_path:
+        repo = KartRepo(repo_path)
+        H.clear_working_copy()
+        repo.config["kart.workingcopy.numWorkers"] = 2
+
+        with new_postgis_db_schema() as (postgres_url, postgres_schema):
+            r = cli_runner.invoke(["create-workingcopy", postgres_url])
+            assert r.exit_code == 0, r.stderr
+
+            wc = repo.working_copy
+            datasets = list(repo.datasets())
+            assert len(datasets) == 2
+            assert wc.assert_db_tree_match(repo.head_tree.hex)
+
+            def table_counts():
+                with wc.session() as sess:
+                    existing = set(
+                        inspect(sess.connection()).get_table_names(postgres_schema)
+                    )
+                    return {
+                        ds.table_name: sess.scalar(
+                            f"SELECT COUNT(*) FROM {wc.table_identifier(ds)};"
+                        )
+                        for ds in datasets
+                        if ds.table_name in existing
+                    }
+
+            expected_counts = {ds.table_name: ds.feature_count for ds in datasets}
+            assert table_counts() == expected_counts
+
+            orig_write_full_dataset = type(wc)._write_full_dataset
+            failures = []
+
+            def _write_full_dataset(self, sess, commit, dataset, *args, **kwargs):
+                if dataset.path in failures:
+                    failures.remove(dataset.path)
+                    raise RuntimeError("Failed to write dataset")
+                return orig_write_full_dataset(
+                    self, sess, commit, dataset, *args, **kwargs
+                )
+
+            monkeypatch.setattr(type(wc), "_write_full_dataset", _write_full_dataset)
+
+            # If any dataset fails before anything is committed, none of the new tables are committed.
+            wc.drop_tables(repo.head_commit, *datasets)
+            failures.append(datasets[1].path)
+            with pytest.raises(RuntimeError):
+                wc.write_full(repo.head_commit, *datasets)
+            assert table_counts() == {}
+
+            wc.write_full(repo.head_commit, *datasets)
+            assert table_counts() == expected_counts
+
+            # Each table is dropped in the same session that rewrites it - so if a dataset can't be rewritten,
+            # none of the existing tables are dropped, and the state table is unchanged.
+            failures.extend([datasets[1].path] * 2)
+            with pytest.raises(RuntimeError):
+                wc.rewrite_full(repo.head_commit, *datasets, force=True)
+            assert failures == [datasets[1].path]
+            failures.clear()
+            assert table_counts() == expected_counts
+            assert wc.assert_db_tree_match(repo.head_tree.hex)
+
+            r = cli_runner.invoke(["diff", "--exit-code"])
+            assert r.exit_code == 0, r.stdout
+
+
 def test_meta_updates(data_archive, cli_runner, new_postgis_db_schema):
     with data_archive("meta-updates"):
         H.clear_working_copy()